@@ -1,20 +1,29 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import secrets
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Cookie, HTTPException, Response
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 from . import models
+from .db import SessionLocal
 
 SESSION_COOKIE_NAME = os.getenv("SESSION_COOKIE_NAME", "sa_session")
 SESSION_TTL_HOURS = int(os.getenv("SESSION_TTL_HOURS", "12"))
 SESSION_SECURE = os.getenv("SESSION_COOKIE_SECURE", "0") == "1"
 SESSION_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "lax")
+# Validated sessions are cached per token hash and re-read from the DB after this long.
+SESSION_CACHE_TTL_S = float(os.getenv("SESSION_CACHE_TTL_S", "5"))
+# Sliding-expiry extensions are written back in one batch at most this often.
+SESSION_FLUSH_INTERVAL_S = float(os.getenv("SESSION_FLUSH_INTERVAL_S", "5"))
 
 
 def utcnow() -> datetime:
@@ -64,6 +73,7 @@ def create_session(db: Session, user: models.User, response: Response) -> dict:
 def revoke_session(db: Session, token: Optional[str]) -> None:
     if not token:
         return
+    session_cache.invalidate_token(token)
     row = db.execute(
         select(models.AuthSession).where(models.AuthSession.session_token == token)
     ).scalar_one_or_none()
@@ -76,27 +86,167 @@ def clear_session_cookie(response: Response) -> None:
     response.delete_cookie(key=SESSION_COOKIE_NAME, path="/")
 
 
-def get_session_user(db: Session, token: Optional[str]) -> models.User:
-    if not token:
-        raise HTTPException(status_code=401, detail="auth_required")
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _CachedSession:
+    session_id: str
+    user_id: str
+    role_snapshot: str
+    expires_at: datetime
+    user_values: dict
+    loaded_at: float
+
+
+class SessionCache:
+    """
+    In-process cache of validated sessions keyed by sha256(token).
+
+    A hit skips the auth_sessions/users reads for SESSION_CACHE_TTL_S. Sliding
+    expiry is tracked in memory and written back by a background flusher in
+    one UPDATE batch, so validating a session never opens a write transaction.
+    Revocation drops the entry immediately; anything else (ban, deletion,
+    revocation by another process) is picked up when the entry ages out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, _CachedSession] = {}
+        self._pending: dict[str, datetime] = {}  # session_id -> expires_at not yet written
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ---------------- lookups ----------------
+    def get(self, token_hash: str) -> _CachedSession | None:
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > SESSION_CACHE_TTL_S:
+                del self._entries[token_hash]
+                return None
+            return entry
+
+    def put(self, token_hash: str, sess: models.AuthSession, user: models.User) -> _CachedSession:
+        values = {c.key: getattr(user, c.key) for c in models.User.__mapper__.column_attrs}
+        with self._lock:
+            expires_at = max(sess.expires_at, self._pending.get(sess.session_id, sess.expires_at))
+            entry = _CachedSession(sess.session_id, sess.user_id, sess.role_snapshot, expires_at, values, time.monotonic())
+            self._entries[token_hash] = entry
+            return entry
+
+    def touch(self, entry: _CachedSession):
+        expires_at = _expiry_for_role(entry.role_snapshot)
+        with self._lock:
+            entry.expires_at = expires_at
+            self._pending[entry.session_id] = expires_at
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            entry = self._entries.pop(_token_hash(token), None)
+            if entry is not None:
+                self._pending.pop(entry.session_id, None)
+
+    def invalidate_user(self, user_id: str):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.user_id == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+
+    # ---------------- background flush ----------------
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            with SessionLocal() as db:
+                for session_id, expires_at in pending.items():
+                    db.execute(
+                        update(models.AuthSession)
+                        .where(
+                            models.AuthSession.session_id == session_id,
+                            models.AuthSession.revoked_at.is_(None),
+                            models.AuthSession.expires_at < expires_at,
+                        )
+                        .values(expires_at=expires_at)
+                    )
+                db.commit()
+        except Exception as e:
+            print(f"[AUTH] session expiry flush failed: {e}")
+            with self._lock:
+                for session_id, expires_at in pending.items():
+                    self._pending.setdefault(session_id, expires_at)
+            return 0
+        return len(pending)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(SESSION_FLUSH_INTERVAL_S):
+            self.flush()
+
+
+session_cache = SessionCache()
+
+
+def _load_session(db: Session, token: str, token_hash: str) -> _CachedSession:
     sess = db.execute(
         select(models.AuthSession).where(models.AuthSession.session_token == token)
     ).scalar_one_or_none()
-    if not sess or sess.revoked_at is not None or sess.expires_at < utcnow():
+    if not sess or sess.revoked_at is not None:
         raise HTTPException(status_code=401, detail="invalid_session")
     user = db.get(models.User, sess.user_id)
     if not user:
         raise HTTPException(status_code=401, detail="invalid_session_user")
-    if user.status == "banned":
+    return session_cache.put(token_hash, sess, user)
+
+
+def _attach_user(db: Session, values: dict) -> models.User:
+    # Rebuild the cached row as a detached instance and attach it without a SELECT.
+    user = models.User(**values)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
+def get_session_user(db: Session, token: Optional[str]) -> models.User:
+    if not token:
+        raise HTTPException(status_code=401, detail="auth_required")
+    token_hash = _token_hash(token)
+    entry = session_cache.get(token_hash) or _load_session(db, token, token_hash)
+    if entry.expires_at < utcnow():
+        session_cache.invalidate_token(token)
+        raise HTTPException(status_code=401, detail="invalid_session")
+    if entry.user_values.get("status") == "banned":
         raise HTTPException(status_code=403, detail="user_banned")
-    
-    # extend session on use
-    sess.expires_at = _expiry_for_role(sess.role_snapshot)
-    db.commit()
-    return user
+
+    # extend session on use (written back in batches by session_cache)
+    session_cache.touch(entry)
+    return _attach_user(db, entry.user_values)
+
+
+def is_admin_user(user: models.User) -> bool:
+    return user.role in {"admin", "staff"}
 
 
 def require_admin_user(user: models.User) -> models.User:
-    if user.role not in {"admin", "staff"}:
+    if not is_admin_user(user):
         raise HTTPException(status_code=403, detail="admin_required")
     return user
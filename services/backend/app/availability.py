@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+from sqlalchemy import and_, case, delete, event, exists, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from . import models
+from .usecases.user_flow import ACTIVE_LOAN_STATUSES, RESERVED_HW_STATUSES
+
+_WATCHED = {
+    models.ToolItem: ("is_active", "tool_model_id"),
+    models.Loan: ("returned_at", "status", "tool_item_id"),
+    models.LoanRequest: ("hw_status", "request_type", "tool_item_id"),
+}
+
+COUNT_FIELDS = ("total", "available", "checked_out", "reserved")
+
+
+def _counts_query(tool_model_ids: set[str] | None = None):
+    ti = models.ToolItem
+    open_loan = exists().where(
+        models.Loan.tool_item_id == ti.tool_item_id,
+        models.Loan.returned_at.is_(None),
+        models.Loan.status.in_(ACTIVE_LOAN_STATUSES),
+    )
+    inflight = exists().where(
+        models.LoanRequest.tool_item_id == ti.tool_item_id,
+        models.LoanRequest.request_type == "dispense",
+        models.LoanRequest.hw_status.in_(RESERVED_HW_STATUSES),
+    )
+    q = (
+        select(
+            models.ToolModel.tool_model_id,
+            func.count(ti.tool_item_id).label("total"),
+            func.coalesce(func.sum(case((open_loan, 1), else_=0)), 0).label("checked_out"),
+            func.coalesce(func.sum(case((and_(~open_loan, inflight), 1), else_=0)), 0).label("reserved"),
+        )
+        .select_from(models.ToolModel)
+        .outerjoin(ti, and_(ti.tool_model_id == models.ToolModel.tool_model_id, ti.is_active.is_(True)))
+        .group_by(models.ToolModel.tool_model_id)
+    )
+    if tool_model_ids is not None:
+        q = q.where(models.ToolModel.tool_model_id.in_(sorted(tool_model_ids)))
+    return q
+
+
+def compute_counts(conn, tool_model_ids: set[str] | None = None) -> dict[str, dict]:
+    """Availability per model, aggregated from tool_items/loans/loan_requests."""
+    out = {}
+    for row in conn.execute(_counts_query(tool_model_ids)).mappings():
+        total, checked_out, reserved = int(row["total"]), int(row["checked_out"]), int(row["reserved"])
+        out[row["tool_model_id"]] = {
+            "total": total,
+            "available": total - checked_out - reserved,
+            "checked_out": checked_out,
+            "reserved": reserved,
+        }
+    return out
+
+
+def _write_counts(conn, tool_model_ids: set[str], counts: dict[str, dict]):
+    table = models.ToolModelAvailability.__table__
+    conn.execute(delete(table).where(table.c.tool_model_id.in_(sorted(tool_model_ids))))
+    if counts:
+        now = models.utcnow()
+        conn.execute(insert(table), [
+            {"tool_model_id": tool_model_id, "updated_at": now, **c}
+            for tool_model_id, c in counts.items()
+        ])
+
+
+def _changed(obj, attrs: tuple[str, ...]) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def _old_value(obj, attr: str):
+    deleted = inspect(obj).attrs[attr].history.deleted
+    return deleted[0] if deleted else None
+
+
+class AvailabilityCounters:
+    """
+    Keeps tool_model_availability in step with tool_items, loans and loan_requests.
+
+    After every flush on a SessionLocal session, the models touched by the flushed
+    rows are re-aggregated on the same connection, so the counts commit or roll back
+    with the change that caused them. Each refresh only scans the affected models'
+    items; readers get one row per model.
+    """
+
+    def affected_models(self, db: Session) -> tuple[set[str], set[str]]:
+        """(models to recount, tool_items whose model must be looked up)."""
+        model_ids: set[str] = set()
+        item_ids: set[str] = set()
+        for obj in list(db.new) + list(db.dirty) + list(db.deleted):
+            if isinstance(obj, models.ToolModel):
+                model_ids.add(obj.tool_model_id)
+                continue
+            attrs = _WATCHED.get(type(obj))
+            if attrs is None:
+                continue
+            if obj in db.dirty and not _changed(obj, attrs):
+                continue
+            if isinstance(obj, models.ToolItem):
+                model_ids.add(obj.tool_model_id)
+                old = _old_value(obj, "tool_model_id")
+                if old:
+                    model_ids.add(old)
+            else:
+                item_ids.add(obj.tool_item_id)
+                old = _old_value(obj, "tool_item_id")
+                if old:
+                    item_ids.add(old)
+        return model_ids, item_ids
+
+    def _on_flush(self, db: Session):
+        model_ids, item_ids = self.affected_models(db)
+        if not model_ids and not item_ids:
+            return
+        conn = db.connection()
+        if item_ids:
+            model_ids.update(conn.execute(
+                select(models.ToolItem.tool_model_id).where(models.ToolItem.tool_item_id.in_(sorted(item_ids)))
+            ).scalars())
+        model_ids.discard(None)
+        if model_ids:
+            _write_counts(conn, model_ids, compute_counts(conn, model_ids))
+
+    # ---------------- reads ----------------
+    def rows(self, db: Session) -> dict[str, dict]:
+        out = {}
+        for row in db.execute(select(models.ToolModelAvailability)).scalars():
+            out[row.tool_model_id] = {f: getattr(row, f) for f in COUNT_FIELDS}
+        return out
+
+    # ---------------- consistency ----------------
+    def check(self, db: Session | None = None, *, repair: bool = False) -> dict:
+        """
+        Recompute every model from scratch and diff against the materialized table.
+        With repair=True the table is rewritten with the recomputed counts.
+        """
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            expected = compute_counts(db.connection())
+            actual = self.rows(db)
+            mismatches = []
+            for tool_model_id in sorted(set(expected) | set(actual)):
+                want = expected.get(tool_model_id)
+                have = actual.get(tool_model_id)
+                if want != have:
+                    mismatches.append({"tool_model_id": tool_model_id, "expected": want, "actual": have})
+            if repair and mismatches:
+                conn = db.connection()
+                _write_counts(conn, {m["tool_model_id"] for m in mismatches},
+                              {m["tool_model_id"]: m["expected"] for m in mismatches if m["expected"]})
+                db.commit()
+                print(f"[AVAILABILITY] repaired models={len(mismatches)}")
+            return {"ok": not mismatches, "models": len(expected), "mismatches": mismatches, "repaired": bool(repair and mismatches)}
+        finally:
+            if own:
+                db.close()
+
+    def rebuild(self):
+        with SessionLocal() as db:
+            conn = db.connection()
+            conn.execute(delete(models.ToolModelAvailability.__table__))
+            counts = compute_counts(conn)
+            _write_counts(conn, set(counts), counts)
+            db.commit()
+        print(f"[AVAILABILITY] rebuilt models={len(counts)}")
+
+
+availability = AvailabilityCounters()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _availability_after_flush(db, flush_context):
+    availability._on_flush(db)
@@ -1,18 +1,29 @@
 # from __future__ import annotations
 
+import base64
+import hashlib
+import itertools
 import json
 import os
 import random
+import socket
+import ssl
+import struct
 import subprocess
 import threading
 import time
 from dataclasses import dataclass, field
 from functools import wraps
 from typing import Callable, Dict, Optional
-from urllib import error, parse, request
+from urllib import parse
 
 import paho.mqtt.client as mqtt
 
+try:
+    from .moonraker import MoonrakerError, MoonrakerHttpClient
+except ImportError:  # run as ./bridge.py in the bridge container
+    from moonraker import MoonrakerError, MoonrakerHttpClient
+
 try:
     import serial  # type: ignore
 except Exception:  # pragma: no cover
@@ -42,6 +53,10 @@ DONE_TIMEOUT_MS = int(os.getenv("DONE_TIMEOUT_MS", "30000"))
 WAIT_IDLE = os.getenv("WAIT_IDLE", "0") == "1"
 IDLE_POLL_INTERVAL_S = float(os.getenv("IDLE_POLL_INTERVAL_S", "0.35"))
 MOONRAKER_HTTP_TIMEOUT_S = float(os.getenv("MOONRAKER_HTTP_TIMEOUT_S", "5000.0"))
+# "websocket" keeps one JSON-RPC connection with a subscribed status mirror instead of HTTP per call.
+MOONRAKER_TRANSPORT = os.getenv("MOONRAKER_TRANSPORT", "http").lower()
+MOONRAKER_RPC_TIMEOUT_S = float(os.getenv("MOONRAKER_RPC_TIMEOUT_S", "10"))
+MOONRAKER_GCODE_TIMEOUT_S = float(os.getenv("MOONRAKER_GCODE_TIMEOUT_S", "300"))
 
 SIM_FAIL_RATE = float(os.getenv("SIM_FAIL_RATE", "0.08"))
 SIM_MIN_TIME_S = float(os.getenv("SIM_MIN_TIME_S", "0.4"))
@@ -52,12 +67,18 @@ DEDUP_TTL_S = float(os.getenv("DEDUP_TTL_S", "120"))
 IGNORE_RETAINED = os.getenv("IGNORE_RETAINED", "0") == "1"
 
 DOOR_CONFIRM_TIMEOUT_S = float(os.getenv("DOOR_CONFIRM_TIMEOUT_S", "20"))
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_WAIT_TIMEOUT_S = float(os.getenv("PREFETCH_WAIT_TIMEOUT_S", "30"))
+# Turn the target cake while the gantry travels to it (needs SA_CAKE_ROTATE_ASYNC/WAIT in the macros).
+DISPENSE_OVERLAP_ROTATION = os.getenv("DISPENSE_OVERLAP_ROTATION", "0") == "1"
 DEFAULT_HOME_MODE = os.getenv("DEFAULT_HOME_MODE", "python_assisted").lower()
 VERTICAL_HOME_SCRIPT = os.getenv("VERTICAL_HOME_SCRIPT", "/app/vertical_home.py")
 VERTICAL_HOME_TIMEOUT_S = float(os.getenv("VERTICAL_HOME_TIMEOUT_S", "180000"))
 
 SLOTS_PER_CAKE = int(os.getenv("SLOTS_PER_CAKE", "6"))
 DEG_PER_SLOT = float(os.getenv("DEG_PER_SLOT", "60.0"))
+# One SA_CAKE_ROTATE_SLOTS move per rotation; 0 falls back to one MOVE_CAKE_*_60 per slot.
+ROTATION_SINGLE_MOVE = os.getenv("ROTATION_SINGLE_MOVE", "1") == "1"
 
 TOPIC_CMD_DISPENSE = "igen/cmd/dispense"
 TOPIC_CMD_RETURN = "igen/cmd/return"
@@ -67,6 +88,7 @@ TOPIC_CMD_ADMIN_CAL = "igen/cmd/admin/calibration"
 TOPIC_CMD_ADMIN_TEST_MOTOR = "igen/cmd/admin_test/motor"
 TOPIC_CMD_HW_CONFIRM = "igen/cmd/hardware/confirm"
 TOPIC_CMD_HW_CANCEL = "igen/cmd/hardware/cancel"
+TOPIC_CMD_PREFETCH = "igen/cmd/prefetch"
 
 TOPIC_EVT_DISPENSE = "igen/evt/dispense"
 TOPIC_EVT_RETURN = "igen/evt/return"
@@ -77,6 +99,7 @@ TOPIC_EVT_ADMIN_TEST_MOTOR = "igen/evt/admin_test/motor"
 TOPIC_EVT_MACHINE_ALERT = "igen/evt/machine/alert"
 TOPIC_EVT_MACHINE_STATUS = "igen/evt/machine/status"
 TOPIC_EVT_HW_WAIT = "igen/evt/hardware/wait"
+TOPIC_EVT_PREFETCH = "igen/evt/prefetch"
 
 
 @dataclass(frozen=True)
@@ -106,6 +129,17 @@ class PendingUserConfirm:
     meta: dict = field(default_factory=dict)
 
 
+@dataclass
+class Prefetch:
+    request_id: str
+    after_request_id: str
+    cake_id: int
+    source_slot: int
+    target_slot: int
+    done: threading.Event = field(default_factory=threading.Event)
+    ok: Optional[bool] = None
+
+
 @dataclass(frozen=True)
 class RotationPlan:
     cake_id: int
@@ -159,6 +193,9 @@ def delta_to_direction(delta: int) -> str:
 def build_rotation_script(cake_id: int, direction: str, slot_count: int) -> str:
     if slot_count <= 0:
         return ""
+    if ROTATION_SINGLE_MOVE:
+        slots = slot_count if direction == "CW" else -slot_count
+        return f"SA_CAKE_ROTATE_SLOTS CAKE={cake_id} SLOTS={slots}"
     macro = "MOVE_CAKE_CW_60" if direction == "CW" else "MOVE_CAKE_CCW_60"
     return "\n".join(f"{macro} CAKE={cake_id}" for _ in range(slot_count))
 
@@ -181,6 +218,18 @@ def build_rotation_plan(cake_id: int, source_slot: int, target_slot: int) -> Rot
     )
 
 
+def build_overlapped_move_script(plan: RotationPlan) -> str:
+    """SA_MOVE_TO_CAKE with the plan's slot rotation started before it and waited for after it."""
+    move = f"SA_MOVE_TO_CAKE CAKE={plan.cake_id}"
+    if plan.delta_slots == 0:
+        return move
+    return "\n".join([
+        f"SA_CAKE_ROTATE_ASYNC CAKE={plan.cake_id} SLOTS={plan.delta_slots}",
+        move,
+        f"SA_CAKE_ROTATE_WAIT CAKE={plan.cake_id} SLOTS={plan.delta_slots}",
+    ])
+
+
 def build_bounded_return_exit_plan(cake_id: int, current_slot: int) -> RotationPlan:
     current_slot = normalize_slot(current_slot)
 
@@ -249,27 +298,14 @@ class MoonrakerClient:
     def __init__(self, base_url: str, http_timeout_s: float = 5.0):
         self.base_url = base_url.rstrip("/")
         self.http_timeout_s = http_timeout_s
+        # Scripts keep the long bridge timeout; status reads use the pool's short default.
+        self.http = MoonrakerHttpClient(self.base_url, endpoint_timeouts_s={"/printer/gcode/script": http_timeout_s})
 
     def _json_request(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
-        url = f"{self.base_url}{path}"
-        data = None
-        headers = {"Content-Type": "application/json"}
-        if payload is not None:
-            data = json.dumps(payload).encode("utf-8")
-        req = request.Request(url=url, data=data, headers=headers, method=method)
         try:
-            with request.urlopen(req, timeout=self.http_timeout_s) as resp:
-                raw = resp.read().decode("utf-8")
-                return json.loads(raw) if raw else {}
-        except error.HTTPError as e:
-            body = e.read().decode("utf-8", errors="replace") if hasattr(e, "read") else str(e)
-            raise BridgeError("MOONRAKER_HTTP_ERROR", f"HTTP {e.code}: {body}")
-        except error.URLError as e:
-            raise BridgeError("KLIPPER_NOT_RESPONDING", f"Moonraker unreachable: {e}")
-        except TimeoutError as e:
-            raise BridgeError("KLIPPER_TIMEOUT", f"Moonraker timeout: {e}")
-        except Exception as e:
-            raise BridgeError("MOONRAKER_ERROR", f"Moonraker request failed: {e}")
+            return self.http.request(method, path, payload)
+        except MoonrakerError as e:
+            raise BridgeError(e.code, e.reason)
 
     def get_server_info(self) -> dict:
         return self._json_request("GET", "/server/info")
@@ -307,6 +343,482 @@ class MoonrakerClient:
         return self._json_request("POST", "/machine/services/restart", {"service": service})
 
 
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_WS_OP_CONT, _WS_OP_TEXT, _WS_OP_BINARY = 0x0, 0x1, 0x2
+_WS_OP_CLOSE, _WS_OP_PING, _WS_OP_PONG = 0x8, 0x9, 0xA
+
+
+def _ws_mask(data: bytes, key: bytes) -> bytes:
+    if not data:
+        return data
+    n = len(data)
+    keystream = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")).to_bytes(n, "big")
+
+
+def ws_frame(opcode: int, payload: bytes, mask: bool) -> bytes:
+    head = bytearray([0x80 | opcode])
+    bit = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        head.append(bit | n)
+    elif n < 65536:
+        head.append(bit | 126)
+        head += struct.pack("!H", n)
+    else:
+        head.append(bit | 127)
+        head += struct.pack("!Q", n)
+    if not mask:
+        return bytes(head) + payload
+    key = os.urandom(4)
+    return bytes(head) + key + _ws_mask(payload, key)
+
+
+def ws_accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+class WebSocket:
+    """
+    Just enough RFC 6455 for Moonraker's JSON-RPC endpoint: text messages,
+    ping/pong and close. The bridge keeps its dependencies to paho-mqtt and
+    pyserial, so this client stays on the standard library like the HTTP one.
+    """
+
+    def __init__(self, sock: socket.socket, mask: bool = True, buffered: bytes = b""):
+        self._sock = sock
+        self._mask = mask
+        # Small JSON-RPC frames back to back; Nagle + delayed ACK would add ~40ms to each.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = bytearray(buffered)
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, url: str, timeout_s: float) -> "WebSocket":
+        u = parse.urlsplit(url)
+        secure = u.scheme == "wss"
+        host = u.hostname or "localhost"
+        port = u.port or (443 if secure else 80)
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+
+        sock = socket.create_connection((host, port), timeout=timeout_s)
+        try:
+            if secure:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            key = base64.b64encode(os.urandom(16)).decode("ascii")
+            sock.sendall((
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                "\r\n"
+            ).encode("ascii"))
+
+            raw = b""
+            while b"\r\n\r\n" not in raw:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("connection closed during websocket handshake")
+                raw += chunk
+            head, _, rest = raw.partition(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            if len(lines[0].split()) < 2 or lines[0].split()[1] != "101":
+                raise ConnectionError(f"websocket upgrade refused: {lines[0]}")
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if headers.get("sec-websocket-accept") != ws_accept_key(key):
+                raise ConnectionError("websocket upgrade returned a bad Sec-WebSocket-Accept")
+        except Exception:
+            sock.close()
+            raise
+
+        sock.settimeout(None)
+        return cls(sock, mask=True, buffered=rest)
+
+    def _recv_exact(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("websocket closed by peer")
+            self._buf += chunk
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    def _send(self, opcode: int, payload: bytes):
+        with self._send_lock:
+            self._sock.sendall(ws_frame(opcode, payload, self._mask))
+
+    def send_text(self, text: str):
+        self._send(_WS_OP_TEXT, text.encode("utf-8"))
+
+    def recv_text(self) -> Optional[str]:
+        """Next complete text message, or None once the peer closes."""
+        parts = []
+        while True:
+            b1, b2 = self._recv_exact(2)
+            opcode = b1 & 0x0F
+            n = b2 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", self._recv_exact(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", self._recv_exact(8))[0]
+            key = self._recv_exact(4) if b2 & 0x80 else None
+            data = self._recv_exact(n)
+            if key is not None:
+                data = _ws_mask(data, key)
+
+            if opcode == _WS_OP_CLOSE:
+                try:
+                    self._send(_WS_OP_CLOSE, data[:2])
+                except OSError:
+                    pass
+                return None
+            if opcode == _WS_OP_PING:
+                self._send(_WS_OP_PONG, data)
+                continue
+            if opcode == _WS_OP_PONG:
+                continue
+            parts.append(data)
+            if b1 & 0x80:
+                return b"".join(parts).decode("utf-8")
+
+    def close(self):
+        try:
+            self._send(_WS_OP_CLOSE, struct.pack("!H", 1000))
+        except OSError:
+            pass
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+@dataclass
+class RpcCall:
+    method: str
+    event: threading.Event = field(default_factory=threading.Event)
+    result: object = None
+    error: Optional[BridgeError] = None
+
+
+@dataclass
+class GcodeJob:
+    script: str
+    token: str
+    event: threading.Event = field(default_factory=threading.Event)
+    error: Optional[BridgeError] = None
+    responses: list = field(default_factory=list)
+
+    def wait(self, timeout_s: float):
+        if not self.event.wait(timeout_s):
+            first = self.script.strip().splitlines()[0] if self.script.strip() else ""
+            raise BridgeError("KLIPPER_TIMEOUT", f"G-code did not complete within {timeout_s:.1f}s: {first}")
+        if self.error is not None:
+            raise self.error
+
+
+class MoonrakerWsClient:
+    """
+    MoonrakerClient over Moonraker's /websocket JSON-RPC API.
+
+    One persistent connection replaces a urllib round trip per call. On
+    connect it subscribes to the objects _query_machine_status reads and keeps
+    a local mirror current from notify_status_update, so status reads are
+    served from memory. G-code is submitted with a trailing RESPOND marker and
+    completes when the marker comes back through notify_gcode_response (or the
+    RPC reply arrives, whichever is first); a Klipper error reply fails it.
+    Connects lazily and reconnects on the next call after the socket drops.
+    """
+
+    SUBSCRIBE_OBJECTS = {
+        "toolhead": None,
+        "idle_timeout": None,
+        "print_stats": None,
+        "gcode_macro SA_STATE": None,
+    }
+    DONE_PREFIX = "sa_done"
+
+    def __init__(self, base_url: str, rpc_timeout_s: float = 10.0, gcode_timeout_s: float = 300.0):
+        u = parse.urlsplit(base_url.rstrip("/"))
+        scheme = "wss" if u.scheme in {"https", "wss"} else "ws"
+        self.ws_url = f"{scheme}://{u.netloc}/websocket"
+        self.rpc_timeout_s = rpc_timeout_s
+        self.gcode_timeout_s = gcode_timeout_s
+
+        self._ws: Optional[WebSocket] = None
+        self._conn_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        self._calls: Dict[int, RpcCall] = {}
+        self._jobs: Dict[str, GcodeJob] = {}
+        self._pending_lock = threading.Lock()
+
+        self._status: Dict[str, dict] = {}
+        self._status_eventtime = 0.0
+        self._status_at = 0.0
+        self._status_lock = threading.Lock()
+        self._status_changed = threading.Condition(self._status_lock)
+        # Set when a script completes: Klipper batches status notifications, so the
+        # mirror may still predate the script; the next read re-queries once.
+        self._status_dirty = False
+        self.klippy_state = "unknown"
+
+    # ---------- connection ----------
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    def connect(self):
+        with self._conn_lock:
+            if self._ws is not None:
+                return
+            try:
+                ws = WebSocket.connect(self.ws_url, self.rpc_timeout_s)
+            except Exception as e:
+                raise BridgeError("KLIPPER_NOT_RESPONDING", f"Moonraker websocket unreachable: {e}")
+            self._ws = ws
+            threading.Thread(target=self._reader, args=(ws,), daemon=True).start()
+            print(f"[BRIDGE2][WS] connected {self.ws_url}")
+        self._subscribe()
+
+    def close(self):
+        with self._conn_lock:
+            ws, self._ws = self._ws, None
+        if ws is not None:
+            ws.close()
+
+    def _subscribe(self):
+        result = self.call("printer.objects.subscribe", {"objects": self.SUBSCRIBE_OBJECTS})
+        with self._status_lock:
+            self._status = {k: dict(v) for k, v in (result or {}).get("status", {}).items()}
+            self._status_eventtime = float((result or {}).get("eventtime") or 0.0)
+            self._status_at = time.monotonic()
+            self._status_changed.notify_all()
+
+    def _disconnected(self, ws: WebSocket, reason: str):
+        with self._conn_lock:
+            current = self._ws is ws
+            if current:
+                self._ws = None
+        ws.close()
+        self._fail_pending(BridgeError("KLIPPER_NOT_RESPONDING", f"Moonraker websocket lost: {reason}"))
+        if current:
+            print(f"[BRIDGE2][WS] disconnected: {reason}")
+
+    def _fail_pending(self, err: BridgeError, calls: bool = True):
+        with self._pending_lock:
+            pending = list(self._jobs.values())
+            self._jobs.clear()
+            if calls:
+                pending += list(self._calls.values())
+                self._calls.clear()
+        for p in pending:
+            p.error = err
+            p.event.set()
+
+    # ---------- incoming ----------
+
+    def _reader(self, ws: WebSocket):
+        try:
+            while True:
+                raw = ws.recv_text()
+                if raw is None:
+                    self._disconnected(ws, "closed by server")
+                    return
+                try:
+                    msg = json.loads(raw)
+                except Exception:
+                    continue
+                if "id" in msg:
+                    self._on_reply(msg)
+                else:
+                    self._on_notification(str(msg.get("method", "")), msg.get("params") or [])
+        except Exception as e:
+            self._disconnected(ws, str(e))
+
+    def _on_reply(self, msg: dict):
+        with self._pending_lock:
+            call = self._calls.pop(msg.get("id"), None)
+        if call is None:
+            return
+        if "error" in msg:
+            err = msg["error"] or {}
+            call.error = BridgeError("MOONRAKER_RPC_ERROR", f"{call.method}: {err.get('message', err)}")
+        else:
+            call.result = msg.get("result")
+        call.event.set()
+
+    def _on_notification(self, method: str, params: list):
+        if method == "notify_status_update" and params:
+            with self._status_lock:
+                for name, fields in (params[0] or {}).items():
+                    self._status.setdefault(name, {}).update(fields or {})
+                if len(params) > 1:
+                    self._status_eventtime = float(params[1] or 0.0)
+                self._status_at = time.monotonic()
+                self._status_changed.notify_all()
+        elif method == "notify_gcode_response" and params:
+            self._on_gcode_response(str(params[0]))
+        elif method == "notify_klippy_ready":
+            self.klippy_state = "ready"
+            # Klippy restarted: subscriptions do not survive it. Not on the
+            # reader thread, which has to deliver the subscribe reply.
+            threading.Thread(target=self._resubscribe, daemon=True).start()
+        elif method in {"notify_klippy_shutdown", "notify_klippy_disconnected"}:
+            self.klippy_state = "shutdown" if method == "notify_klippy_shutdown" else "disconnected"
+            self._fail_pending(BridgeError("KLIPPER_IN_ERROR_STATE", f"Moonraker {method}"), calls=False)
+
+    def _on_gcode_response(self, line: str):
+        parts = line.split()
+        with self._pending_lock:
+            if len(parts) == 2 and parts[0] == self.DONE_PREFIX:
+                job = self._jobs.pop(parts[1], None)
+                if job is not None:
+                    self._status_dirty = True
+                    job.event.set()
+                return
+            for job in self._jobs.values():
+                job.responses.append(line)
+
+    def _resubscribe(self):
+        try:
+            self._subscribe()
+        except BridgeError as e:
+            print(f"[BRIDGE2][WS] resubscribe failed: {e.code} {e.reason}")
+
+    # ---------- outgoing ----------
+
+    def _send(self, payload: dict):
+        self.connect()
+        ws = self._ws
+        if ws is None:
+            raise BridgeError("KLIPPER_NOT_RESPONDING", "Moonraker websocket not connected")
+        try:
+            ws.send_text(json.dumps(payload))
+        except OSError as e:
+            self._disconnected(ws, str(e))
+            raise BridgeError("KLIPPER_NOT_RESPONDING", f"Moonraker websocket send failed: {e}")
+
+    def _start_call(self, method: str, params: Optional[dict] = None) -> RpcCall:
+        rpc_id = next(self._ids)
+        call = RpcCall(method=method)
+        with self._pending_lock:
+            self._calls[rpc_id] = call
+        try:
+            self._send({"jsonrpc": "2.0", "method": method, "params": params or {}, "id": rpc_id})
+        except BridgeError:
+            with self._pending_lock:
+                self._calls.pop(rpc_id, None)
+            raise
+        return call
+
+    def call(self, method: str, params: Optional[dict] = None, timeout_s: Optional[float] = None):
+        call = self._start_call(method, params)
+        timeout_s = self.rpc_timeout_s if timeout_s is None else timeout_s
+        if not call.event.wait(timeout_s):
+            raise BridgeError("KLIPPER_TIMEOUT", f"Moonraker {method} timed out after {timeout_s:.1f}s")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def submit_gcode(self, script: str) -> GcodeJob:
+        token = f"{next(self._ids)}_{os.urandom(3).hex()}"
+        job = GcodeJob(script=script, token=token)
+        with self._pending_lock:
+            self._jobs[token] = job
+        marked = f"{script.rstrip()}\nRESPOND PREFIX={self.DONE_PREFIX} MSG={token}"
+        try:
+            call = self._start_call("printer.gcode.script", {"script": marked})
+        except BridgeError:
+            with self._pending_lock:
+                self._jobs.pop(token, None)
+            raise
+
+        def settle():
+            # The reply is the fallback completion signal and the only error one.
+            call.event.wait()
+            with self._pending_lock:
+                if self._jobs.pop(token, None) is None:
+                    return
+            self._status_dirty = True
+            if call.error is not None:
+                job.error = BridgeError("KLIPPER_GCODE_ERROR", call.error.reason)
+            job.event.set()
+
+        threading.Thread(target=settle, daemon=True).start()
+        return job
+
+    # ---------- MoonrakerClient interface ----------
+
+    def _merge_status(self, result: dict):
+        with self._status_lock:
+            for name, fields in (result or {}).get("status", {}).items():
+                self._status.setdefault(name, {}).update(fields or {})
+            self._status_eventtime = float((result or {}).get("eventtime") or self._status_eventtime)
+            self._status_at = time.monotonic()
+            self._status_changed.notify_all()
+
+    def _mirror(self, names: tuple) -> dict:
+        self.connect()
+        if self._status_dirty:
+            self._status_dirty = False
+            self._merge_status(self.call("printer.objects.query", {"objects": self.SUBSCRIBE_OBJECTS}))
+        with self._status_lock:
+            status = {n: dict(self._status.get(n, {})) for n in names}
+            return {"result": {"eventtime": self._status_eventtime, "status": status}}
+
+    def status_age_s(self) -> Optional[float]:
+        with self._status_lock:
+            return (time.monotonic() - self._status_at) if self._status_at else None
+
+    def get_server_info(self) -> dict:
+        result = self.call("server.info")
+        self.klippy_state = str((result or {}).get("klippy_state", self.klippy_state))
+        return {"result": result}
+
+    def get_printer_info(self) -> dict:
+        return {"result": self.call("printer.info")}
+
+    def get_printer_status(self) -> dict:
+        return self._mirror(("toolhead", "idle_timeout", "print_stats"))
+
+    def query_endstops_status(self) -> dict:
+        return {"result": self.call("printer.query_endstops.status")}
+
+    def get_sa_state(self) -> dict:
+        return self._mirror(("gcode_macro SA_STATE",))
+
+    def send_gcode(self, script: str) -> dict:
+        self.submit_gcode(script).wait(self.gcode_timeout_s)
+        return {"result": "ok"}
+
+    def wait_until_idle(self, timeout_s: float, poll_interval_s: float = 0.0):
+        deadline = time.monotonic() + timeout_s
+        self.connect()
+        with self._status_lock:
+            while str(self._status.get("idle_timeout", {}).get("state", "")).lower() == "printing":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BridgeError("KLIPPER_TIMEOUT", f"Machine still busy after {timeout_s:.1f}s")
+                self._status_changed.wait(remaining)
+
+    def emergency_stop(self) -> dict:
+        return {"result": self.call("printer.emergency_stop")}
+
+    def firmware_restart(self) -> dict:
+        return {"result": self.call("printer.firmware_restart")}
+
+    def restart_service(self, service: str = "klipper") -> dict:
+        return {"result": self.call("machine.services.restart", {"service": service})}
+
+
 class EncoderClient:
     def __init__(self, port: str, baud: int, timeout_s: float):
         if serial is None:
@@ -421,7 +933,10 @@ class Bridge2:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
 
-        self.moonraker = MoonrakerClient(cfg.moonraker_url, MOONRAKER_HTTP_TIMEOUT_S)
+        if MOONRAKER_TRANSPORT == "websocket" and cfg.mode != "SIM":
+            self.moonraker = MoonrakerWsClient(cfg.moonraker_url, MOONRAKER_RPC_TIMEOUT_S, MOONRAKER_GCODE_TIMEOUT_S)
+        else:
+            self.moonraker = MoonrakerClient(cfg.moonraker_url, MOONRAKER_HTTP_TIMEOUT_S)
         self.encoder = EncoderClient(SERIAL_PORT, SERIAL_BAUD, SERIAL_TIMEOUT_S) if ENCODER_SERIAL_ENABLED else None
 
         self._seen: Dict[str, float] = {}
@@ -433,6 +948,9 @@ class Bridge2:
         self._pending_confirms: Dict[str, PendingUserConfirm] = {}
         self._pending_lock = threading.Lock()
 
+        self._prefetch: Optional[Prefetch] = None
+        self._prefetch_lock = threading.Lock()
+
         self._ts = lambda: time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
         self._sim_state = {
@@ -452,9 +970,16 @@ class Bridge2:
         self.client.connect(MQTT_HOST, MQTT_PORT, 60)
         self.client.loop_start()
         print(f"[BRIDGE2] MQTT connected {MQTT_HOST}:{MQTT_PORT} mode={self.cfg.mode}")
+        if isinstance(self.moonraker, MoonrakerWsClient):
+            try:
+                self.moonraker.connect()
+            except BridgeError as e:
+                print(f"[BRIDGE2][WS] initial connect failed, retrying on first use: {e.reason}")
         self._publish_machine_status({"boot": True})
 
     def close(self):
+        if isinstance(self.moonraker, MoonrakerWsClient):
+            self.moonraker.close()
         try:
             self.client.loop_stop()
             self.client.disconnect()
@@ -492,6 +1017,7 @@ class Bridge2:
             "admin_machine": TOPIC_EVT_ADMIN_MACHINE,
             "admin_calibration": TOPIC_EVT_ADMIN_CAL,
             "admin_test_motor": TOPIC_EVT_ADMIN_TEST_MOTOR,
+            "prefetch": TOPIC_EVT_PREFETCH,
         }[action]
 
     def _publish(self, topic: str, payload: dict):
@@ -743,7 +1269,7 @@ class Bridge2:
         if WAIT_IDLE:
             self.moonraker.wait_until_idle(self.cfg.done_timeout_ms / 1000.0, IDLE_POLL_INTERVAL_S)
 
-    @with_timeout(max(15.0, MOONRAKER_HTTP_TIMEOUT_S + 5.0))
+    @with_timeout(max(15.0, MOONRAKER_HTTP_TIMEOUT_S + 5.0, MOONRAKER_GCODE_TIMEOUT_S + 5.0))
     def _run_gcode(self, request_id: str, script: str):
         pretty = " | ".join(line.strip() for line in script.splitlines() if line.strip())
         print(f"[BRIDGE2][RID={request_id}] >>> SENDING GCODE >>> {pretty}")
@@ -887,7 +1413,7 @@ class Bridge2:
         before = self._read_encoder_angle_if_enabled(plan.cake_id)
 
         if plan.delta_slots != 0:
-            print(f"[BRIDGE2][RID={request_id}] -> RAW SLOT ROTATION via MOVE_CAKE_CW_60 / MOVE_CAKE_CCW_60")
+            print(f"[BRIDGE2][RID={request_id}] -> RAW SLOT ROTATION via {plan.script.split()[0]}")
             self._execute_rotation_plan(request_id, plan)
         else:
             print(f"[BRIDGE2][RID={request_id}] -> NO SLOT ROTATION NEEDED (delta=0)")
@@ -899,6 +1425,16 @@ class Bridge2:
         print(f"[BRIDGE2][RID={request_id}] ===== DISPENSE ROTATION END =====")
         self._verify_rotation_plan(request_id, plan, before, after)
 
+    def _execute_overlapped_move(self, request_id: str, plan: RotationPlan):
+        print(
+            f"[BRIDGE2][RID={request_id}] move to cake={plan.cake_id} with rotation underneath "
+            f"from={plan.source_slot} to={plan.target_slot} delta_slots={plan.delta_slots} dir={plan.direction}"
+        )
+        before = self._read_encoder_angle_if_enabled(plan.cake_id) if plan.delta_slots else None
+        self._run_gcode(request_id, build_overlapped_move_script(plan))
+        after = self._read_encoder_angle_if_enabled(plan.cake_id) if plan.delta_slots else None
+        self._verify_rotation_plan(request_id, plan, before, after)
+
     def _execute_return_settle(self, request_id: str, cake_id: int, target_slot: int):
         print(
             f"[BRIDGE2][RID={request_id}] return settle cake={cake_id} target_slot={target_slot} "
@@ -907,6 +1443,131 @@ class Bridge2:
         self._run_gcode(request_id, f"SA_ROTATE_TO_SLOT CAKE={cake_id} SLOT={target_slot}")
         self._run_gcode(request_id, f"SA_ROTATE_TO_RETURN CAKE={cake_id}")
 
+    # ---------------- prefetch ----------------
+    # While a dispense waits at the door for door_take_confirm the gantry is idle
+    # and away from the cakes, so the next item's cake can already be turned to
+    # its slot. The active request waits for that rotation before it reports
+    # success, and the next request starts from where the cake really is.
+    def _door_wait_active(self) -> Optional[InFlight]:
+        with self._active_lock:
+            active = self._active
+        if active is None or active.action != "dispense":
+            return None
+        with self._pending_lock:
+            pending = self._pending_confirms.get(active.request_id)
+        if pending is None or pending.stage not in {"door_take_confirm", "waiting_user_confirm"}:
+            return None
+        return active
+
+    def _start_prefetch(self, payload: dict):
+        request_id = str(payload["request_id"])
+        try:
+            if not PREFETCH_ENABLED:
+                raise BridgeError("PREFETCH_DISABLED", "prefetch is disabled on this bridge")
+            if str(payload.get("action") or "dispense") != "dispense":
+                raise BridgeError("PREFETCH_UNSUPPORTED", "only dispense requests can be prefetched")
+            active = self._door_wait_active()
+            after_request_id = str(payload.get("after_request_id") or "")
+            if active is None or (after_request_id and active.request_id != after_request_id):
+                raise BridgeError("PREFETCH_NOT_AT_DOOR", "no dispense is waiting at the door")
+            cake_id = self._require_int(payload, "cake_id")
+            source_slot = self._require_int(payload, "current_slot")
+            target_slot = self._require_int(payload, "target_slot")
+            if int(active.payload.get("cake_id", -1)) == cake_id:
+                # The active dispense already turned this cake; the backend only learns that on success.
+                source_slot = int(active.payload["target_slot"])
+            plan = build_rotation_plan(cake_id, source_slot, target_slot)
+            pf = Prefetch(request_id, active.request_id, cake_id, plan.source_slot, plan.target_slot)
+            with self._prefetch_lock:
+                if self._prefetch is not None and not self._prefetch.done.is_set():
+                    raise BridgeError("PREFETCH_BUSY", f"prefetch already running for {self._prefetch.request_id}")
+                self._prefetch = pf
+        except BridgeError as e:
+            print(f"[BRIDGE2][PREFETCH][RID={request_id}] skipped code={e.code} reason={e.reason}")
+            self._publish_stage("prefetch", request_id, "skipped", error_code=e.code, error_reason=e.reason)
+            return
+
+        details = {"cake_id": plan.cake_id, "source_slot": plan.source_slot, "target_slot": plan.target_slot}
+        self._publish_stage("prefetch", request_id, "accepted", details=details)
+        self._dispatch_async(self._run_prefetch, pf, plan)
+
+    def _run_prefetch(self, pf: Prefetch, plan: RotationPlan):
+        try:
+            print(
+                f"[BRIDGE2][PREFETCH][RID={pf.request_id}] pre-rotating cake={plan.cake_id} "
+                f"from={plan.source_slot} to={plan.target_slot} while {pf.after_request_id} waits at door"
+            )
+            if self.cfg.mode == "SIM":
+                if plan.delta_slots:
+                    time.sleep(SIM_MIN_TIME_S)
+            else:
+                self._execute_rotation_plan(pf.request_id, plan)
+            pf.ok = True
+            self._publish_stage(
+                "prefetch",
+                pf.request_id,
+                "succeeded",
+                details={
+                    "cake_id": plan.cake_id,
+                    "source_slot": plan.source_slot,
+                    "target_slot": plan.target_slot,
+                    "final_current_slot": plan.target_slot,
+                },
+            )
+        except BridgeError as e:
+            pf.ok = False
+            self._publish_stage("prefetch", pf.request_id, "failed", error_code=e.code, error_reason=e.reason)
+            self._publish_alert(code=e.code, message=e.reason, severity="warning", related_request_id=pf.request_id)
+        except Exception as e:
+            pf.ok = False
+            self._publish_stage("prefetch", pf.request_id, "failed", error_code="UNEXPECTED", error_reason=str(e))
+        finally:
+            pf.done.set()
+
+    def _final_slot_after(self, request_id: str, cake_id: int, target_slot: int) -> int:
+        """
+        Where this request's cake is once a prefetch started while it waited at
+        the door has settled. If that prefetch turned the same cake and failed or
+        did not finish, the cake's slot is unknown and the request fails instead
+        of reporting target_slot.
+        """
+        with self._prefetch_lock:
+            pf = self._prefetch
+        if pf is None or pf.after_request_id != request_id:
+            return target_slot
+        finished = pf.done.wait(PREFETCH_WAIT_TIMEOUT_S)
+        if pf.cake_id != cake_id:
+            # Another cake: this one is where the request left it. If that rotation is
+            # still running, the prefetched request's _take_prefetch fails on it.
+            return target_slot
+        if not finished:
+            raise BridgeError("PREFETCH_TIMEOUT", f"prefetch rotation for {pf.request_id} did not finish; cake {cake_id} position unknown")
+        if not pf.ok:
+            raise BridgeError("PREFETCH_FAILED", f"prefetch rotation for {pf.request_id} failed; cake {cake_id} position unknown")
+        return pf.target_slot
+
+    def _take_prefetch(self, request_id: str, plan: RotationPlan) -> Optional[RotationPlan]:
+        """
+        If this request's cake was pre-rotated, the plan from where it now is. A
+        prefetch that failed or did not finish left the cake somewhere unknown, so
+        the request fails rather than rotate from the stale current_slot.
+        """
+        with self._prefetch_lock:
+            pf = self._prefetch
+            if pf is None or pf.request_id != request_id:
+                return None
+        if not pf.done.wait(PREFETCH_WAIT_TIMEOUT_S):
+            raise BridgeError("PREFETCH_TIMEOUT", f"prefetch rotation for {request_id} did not finish")
+        with self._prefetch_lock:
+            if self._prefetch is pf:
+                self._prefetch = None
+        if not pf.ok:
+            raise BridgeError("PREFETCH_FAILED", f"prefetch rotation for {request_id} failed; cake {pf.cake_id} position unknown")
+        if pf.cake_id != plan.cake_id:
+            return None
+        print(f"[BRIDGE2][RID={request_id}] cake={plan.cake_id} pre-rotated to slot={pf.target_slot}")
+        return build_rotation_plan(plan.cake_id, pf.target_slot, plan.target_slot)
+
     def _dispatch_async(self, target, *args):
         threading.Thread(target=target, args=args, daemon=True).start()
 
@@ -981,16 +1642,33 @@ class Bridge2:
                         f"Cake {cake_id}: slot {source_slot} → slot {target_slot}"
                     )
 
-                    self._publish_stage(action, request_id, "move_to_cake")
+                    prefetched = self._take_prefetch(request_id, build_rotation_plan(cake_id, source_slot, target_slot))
+
+                    overlap = DISPENSE_OVERLAP_ROTATION
+                    self._publish_stage(action, request_id, "move_to_cake", details={"overlap_rotation": overlap})
                     time.sleep(SIM_MIN_TIME_S)
 
-                    self._publish_stage(action, request_id, "rotate_cake")
-                    print(
-                        f"[BRIDGE2][SIM][DISPENSE][RID={request_id}] "
-                        f"would run: SA_ROTATE_TO_SLOT CAKE={cake_id} SLOT={target_slot} "
-                        f"then SA_ROTATE_TO_DISPENSE CAKE={cake_id}"
+                    self._publish_stage(
+                        action,
+                        request_id,
+                        "rotate_cake",
+                        details={"prefetched": prefetched is not None, "overlap_rotation": overlap},
                     )
-                    time.sleep(SIM_MIN_TIME_S)
+                    if prefetched is not None and prefetched.delta_slots == 0:
+                        print(f"[BRIDGE2][SIM][DISPENSE][RID={request_id}] cake already in position, skipping rotation")
+                    elif overlap:
+                        print(
+                            f"[BRIDGE2][SIM][DISPENSE][RID={request_id}] "
+                            f"slot rotation ran under move_to_cake, "
+                            f"would run: SA_ROTATE_TO_DISPENSE CAKE={cake_id}"
+                        )
+                    else:
+                        print(
+                            f"[BRIDGE2][SIM][DISPENSE][RID={request_id}] "
+                            f"would run: SA_ROTATE_TO_SLOT CAKE={cake_id} SLOT={target_slot} "
+                            f"then SA_ROTATE_TO_DISPENSE CAKE={cake_id}"
+                        )
+                        time.sleep(SIM_MIN_TIME_S)
 
                     self._publish_stage(action, request_id, "move_to_door")
                     time.sleep(SIM_MIN_TIME_S)
@@ -1014,7 +1692,7 @@ class Bridge2:
                     self._publish_stage(action, request_id, "park")
                     time.sleep(SIM_MIN_TIME_S)
 
-                    final_current_slot = int(payload.get("target_slot", 0))
+                    final_current_slot = self._final_slot_after(request_id, cake_id, int(payload.get("target_slot", 0)))
                     print(
                         f"[BRIDGE2][SIM][DISPENSE][RID={request_id}] "
                         f"publishing success cake={cake_id} source_slot={source_slot} "
@@ -1285,7 +1963,11 @@ class Bridge2:
             if action == "dispense":
                 timed_out_unconfirmed = False
                 plan = self._build_dispense_plan(payload)
+                prefetched = self._take_prefetch(request_id, plan)
+                if prefetched is not None:
+                    plan = prefetched
 
+                overlap = DISPENSE_OVERLAP_ROTATION
                 self._publish_stage(
                     action,
                     request_id,
@@ -1294,9 +1976,13 @@ class Bridge2:
                         "cake_id": plan.cake_id,
                         "source_slot": plan.source_slot,
                         "target_slot": plan.target_slot,
+                        "overlap_rotation": overlap,
                     },
                 )
-                self._run_gcode(request_id, f"SA_MOVE_TO_CAKE CAKE={plan.cake_id}")
+                if overlap:
+                    self._execute_overlapped_move(request_id, plan)
+                else:
+                    self._run_gcode(request_id, f"SA_MOVE_TO_CAKE CAKE={plan.cake_id}")
 
                 self._publish_stage(
                     action,
@@ -1307,10 +1993,16 @@ class Bridge2:
                         "direction": plan.direction,
                         "source_slot": plan.source_slot,
                         "target_slot": plan.target_slot,
+                        "prefetched": prefetched is not None,
+                        "overlap_rotation": overlap,
                     },
                 )
                 print(f"[BRIDGE2][RID={request_id}] >>> ABOUT TO EXECUTE DISPENSE ROTATION <<<")
-                self._execute_dispense_rotation(request_id, plan)
+                if overlap:
+                    # The slot rotation already ran under the gantry move; only the dispense pulse is left.
+                    self._run_gcode(request_id, f"SA_ROTATE_TO_DISPENSE CAKE={plan.cake_id}")
+                else:
+                    self._execute_dispense_rotation(request_id, plan)
                 print(f"[BRIDGE2][RID={request_id}] >>> DISPENSE ROTATION COMPLETE <<<")
 
                 self._publish_stage(action, request_id, "move_to_door")
@@ -1337,10 +2029,11 @@ class Bridge2:
 
                 self._publish_stage(action, request_id, "park")
                 self._run_gcode(request_id, "SA_PARK")
+                final_current_slot = self._final_slot_after(request_id, plan.cake_id, plan.target_slot)
                 print(
                     f"[BRIDGE2][DISPENSE][RID={request_id}] "
                     f"publishing success cake={plan.cake_id} source_slot={plan.source_slot} "
-                    f"target_slot={plan.target_slot} final_current_slot={plan.target_slot}"
+                    f"target_slot={plan.target_slot} final_current_slot={final_current_slot}"
                 )
                 self._publish_stage(
                     action,
@@ -1350,7 +2043,7 @@ class Bridge2:
                         "cake_id": plan.cake_id,
                         "source_slot": plan.source_slot,
                         "target_slot": plan.target_slot,
-                        "final_current_slot": plan.target_slot,
+                        "final_current_slot": final_current_slot,
                         "auto_unconfirmed": timed_out_unconfirmed,
                     },
                 )
@@ -1844,6 +2537,11 @@ def handle_admin_test_motor(self: Bridge2, payload: dict):
         self._dispatch_async(self._execute_motor_test, payload)
 
 
+@cmd(TOPIC_CMD_PREFETCH)
+def handle_prefetch(self: Bridge2, payload: dict):
+    self._start_prefetch(payload)
+
+
 @cmd(TOPIC_CMD_HW_CONFIRM)
 def handle_hw_confirm(self: Bridge2, payload: dict):
     request_id = str(payload["request_id"])
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from . import models
+
+SLOTS_PER_CAKE = 6
+
+_STAGE_KEY = "cake_state_staged"
+_ROWS_KEY = "cake_state_rows"
+_DIRTY_KEY = "cake_state_dirty"
+
+
+@dataclass
+class CakeView:
+    """Live state of one cake: current slot plus one entry per slot index."""
+    cake_id: str
+    current_slot: int | None = None  # None = no cake_state row yet
+    slots: list[str | None] = field(default_factory=lambda: [None] * SLOTS_PER_CAKE)
+    rows: list[bool] = field(default_factory=lambda: [False] * SLOTS_PER_CAKE)  # cake_slot_state row exists
+
+    def copy(self) -> "CakeView":
+        return CakeView(self.cake_id, self.current_slot, list(self.slots), list(self.rows))
+
+    def occupied(self) -> set[int]:
+        return {idx for idx, tool_item_id in enumerate(self.slots) if tool_item_id}
+
+
+class CakeStateEngine:
+    """
+    Process-wide mirror of cake_state / cake_slot_state.
+
+    Committed state lives here and is loaded once; reads never hit the DB.
+    Writes go through the session (ORM rows are still updated) and are staged in
+    db.info so the writing session sees its own changes immediately. Each session
+    also records which fields it wrote (current_slot, or a slot index); on commit
+    only those fields are copied into the shared state, so two sessions changing
+    different parts of one cake do not overwrite each other. Staged changes are
+    dropped on rollback. Direct ORM writes to the two tables are picked up on
+    flush, so the mirror cannot drift from the tables.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._cakes: dict[str, CakeView] = {}
+        self._tool_index: dict[str, set[tuple[str, int]]] = {}
+
+    # ---------------- loading ----------------
+    def load(self):
+        with self._lock:
+            with SessionLocal() as db:
+                cake_rows = db.execute(select(models.CakeState)).scalars().all()
+                slot_rows = db.execute(select(models.CakeSlotState)).scalars().all()
+                cakes: dict[str, CakeView] = {}
+                for row in cake_rows:
+                    cakes.setdefault(row.cake_id, CakeView(row.cake_id)).current_slot = int(row.current_slot or 0)
+                for row in slot_rows:
+                    idx = int(row.slot_index)
+                    if not 0 <= idx < SLOTS_PER_CAKE:
+                        continue
+                    view = cakes.setdefault(row.cake_id, CakeView(row.cake_id))
+                    view.rows[idx] = True
+                    view.slots[idx] = row.tool_item_id
+
+            self._cakes = cakes
+            self._tool_index = {}
+            for view in cakes.values():
+                self._index_cake(view)
+            self._loaded = True
+            print(f"[CAKE_STATE] loaded cakes={len(cakes)} slot_rows={len(slot_rows)}")
+
+    def reset(self):
+        with self._lock:
+            self._loaded = False
+            self._cakes = {}
+            self._tool_index = {}
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def _index_cake(self, view: CakeView):
+        for idx, tool_item_id in enumerate(view.slots):
+            if tool_item_id:
+                self._tool_index.setdefault(tool_item_id, set()).add((view.cake_id, idx))
+
+    def _unindex_cake(self, view: CakeView):
+        for idx, tool_item_id in enumerate(view.slots):
+            if not tool_item_id:
+                continue
+            keys = self._tool_index.get(tool_item_id)
+            if keys is None:
+                continue
+            keys.discard((view.cake_id, idx))
+            if not keys:
+                del self._tool_index[tool_item_id]
+
+    def _apply(self, staged: dict[str, CakeView], dirty: dict[str, set]):
+        with self._lock:
+            if not self._loaded:
+                return
+            for cake_id, fields in dirty.items():
+                view = staged[cake_id]
+                old = self._cakes.get(cake_id)
+                new = old.copy() if old is not None else CakeView(cake_id)
+                for name in fields:
+                    if name == "current_slot":
+                        new.current_slot = view.current_slot
+                    else:
+                        new.rows[name] = view.rows[name]
+                        new.slots[name] = view.slots[name]
+                if old is not None:
+                    self._unindex_cake(old)
+                self._cakes[cake_id] = new
+                self._index_cake(new)
+
+    # ---------------- reads ----------------
+    def _committed(self, cake_id: str) -> CakeView | None:
+        self._ensure_loaded()
+        with self._lock:
+            return self._cakes.get(cake_id)
+
+    def view(self, db: Session | None, cake_id: str) -> CakeView | None:
+        if db is not None:
+            staged = db.info.get(_STAGE_KEY, {}).get(cake_id)
+            if staged is not None:
+                return staged
+        return self._committed(cake_id)
+
+    def cake_ids(self, db: Session | None = None) -> list[str]:
+        self._ensure_loaded()
+        with self._lock:
+            ids = set(self._cakes)
+        if db is not None:
+            ids.update(db.info.get(_STAGE_KEY, {}))
+        return sorted(ids)
+
+    def current_slot(self, db: Session | None, cake_id: str) -> int | None:
+        view = self.view(db, cake_id)
+        return None if view is None else view.current_slot
+
+    def tool_slots(self, db: Session | None, tool_item_id: str) -> list[tuple[str, int]]:
+        """All (cake_id, slot_index) positions currently holding this tool."""
+        self._ensure_loaded()
+        staged = db.info.get(_STAGE_KEY, {}) if db is not None else {}
+        with self._lock:
+            out = [key for key in self._tool_index.get(tool_item_id, ()) if key[0] not in staged]
+        for view in staged.values():
+            out.extend((view.cake_id, idx) for idx, tid in enumerate(view.slots) if tid == tool_item_id)
+        return sorted(out, key=lambda key: (key[1], key[0]))
+
+    # ---------------- writes ----------------
+    def _stage(self, db: Session, cake_id: str) -> CakeView:
+        staged = db.info.setdefault(_STAGE_KEY, {})
+        view = staged.get(cake_id)
+        if view is None:
+            base = self._committed(cake_id)
+            view = base.copy() if base is not None else CakeView(cake_id)
+            staged[cake_id] = view
+        return view
+
+    def _touch(self, db: Session, cake_id: str, name: str | int) -> CakeView:
+        """Staged view of the cake, with `name` (current_slot or a slot index) marked as written."""
+        db.info.setdefault(_DIRTY_KEY, {}).setdefault(cake_id, set()).add(name)
+        return self._stage(db, cake_id)
+
+    def _cake_row(self, db: Session, cake_id: str) -> models.CakeState | None:
+        rows = db.info.setdefault(_ROWS_KEY, {})
+        row = rows.get(cake_id)
+        if row is None:
+            row = db.get(models.CakeState, cake_id)
+            if row is not None:
+                rows[cake_id] = row
+        return row
+
+    def _slot_row(self, db: Session, cake_id: str, slot_index: int) -> models.CakeSlotState | None:
+        rows = db.info.setdefault(_ROWS_KEY, {})
+        row = rows.get((cake_id, slot_index))
+        if row is None:
+            row = db.get(models.CakeSlotState, {"cake_id": cake_id, "slot_index": slot_index})
+            if row is not None:
+                rows[(cake_id, slot_index)] = row
+        return row
+
+    def ensure_cake(self, db: Session, cake_id: str) -> int:
+        """Seed a cake_state row (current_slot=0) if the cake has none; return its current slot."""
+        view = self.view(db, cake_id)
+        if view is not None and view.current_slot is not None:
+            return view.current_slot
+        row = models.CakeState(cake_id=cake_id, current_slot=0)
+        db.add(row)
+        db.info.setdefault(_ROWS_KEY, {})[cake_id] = row
+        self._touch(db, cake_id, "current_slot").current_slot = 0
+        return 0
+
+    def set_current_slot(self, db: Session, cake_id: str, slot: int):
+        slot = int(slot) % SLOTS_PER_CAKE
+        self.ensure_cake(db, cake_id)
+        row = self._cake_row(db, cake_id)
+        if row is not None:
+            row.current_slot = slot
+        self._touch(db, cake_id, "current_slot").current_slot = slot
+
+    def ensure_slot(self, db: Session, cake_id: str, slot_index: int, tool_item_id: str | None = None):
+        """Seed a cake_slot_state row if missing. An existing row (even empty) is left alone."""
+        view = self.view(db, cake_id)
+        if view is not None and view.rows[slot_index]:
+            return
+        row = models.CakeSlotState(cake_id=cake_id, slot_index=slot_index, tool_item_id=tool_item_id)
+        db.add(row)
+        db.info.setdefault(_ROWS_KEY, {})[(cake_id, slot_index)] = row
+        staged = self._touch(db, cake_id, slot_index)
+        staged.rows[slot_index] = True
+        staged.slots[slot_index] = tool_item_id
+
+    def set_slot(self, db: Session, cake_id: str, slot_index: int, tool_item_id: str | None):
+        view = self.view(db, cake_id)
+        if view is None or not view.rows[slot_index]:
+            self.ensure_slot(db, cake_id, slot_index, tool_item_id)
+            return
+        row = self._slot_row(db, cake_id, slot_index)
+        if row is not None:
+            row.tool_item_id = tool_item_id
+        self._touch(db, cake_id, slot_index).slots[slot_index] = tool_item_id
+
+    def clear_tool(self, db: Session, tool_item_id: str):
+        for cake_id, slot_index in self.tool_slots(db, tool_item_id):
+            self.set_slot(db, cake_id, slot_index, None)
+
+    # ---------------- session hooks ----------------
+    def _on_flush(self, db: Session):
+        for obj in list(db.new) + list(db.dirty):
+            if isinstance(obj, models.CakeState):
+                self._touch(db, obj.cake_id, "current_slot").current_slot = int(obj.current_slot or 0)
+            elif isinstance(obj, models.CakeSlotState):
+                idx = int(obj.slot_index)
+                if 0 <= idx < SLOTS_PER_CAKE:
+                    staged = self._touch(db, obj.cake_id, idx)
+                    staged.rows[idx] = True
+                    staged.slots[idx] = obj.tool_item_id
+        for obj in db.deleted:
+            if isinstance(obj, models.CakeState):
+                self._touch(db, obj.cake_id, "current_slot").current_slot = None
+            elif isinstance(obj, models.CakeSlotState):
+                idx = int(obj.slot_index)
+                if 0 <= idx < SLOTS_PER_CAKE:
+                    staged = self._touch(db, obj.cake_id, idx)
+                    staged.rows[idx] = False
+                    staged.slots[idx] = None
+
+    def _on_commit(self, db: Session):
+        staged = db.info.get(_STAGE_KEY)
+        dirty = db.info.get(_DIRTY_KEY)
+        if staged and dirty:
+            self._apply(staged, dirty)
+
+    def _on_transaction_end(self, db: Session, transaction):
+        if transaction.parent is None:
+            db.info.pop(_STAGE_KEY, None)
+            db.info.pop(_ROWS_KEY, None)
+            db.info.pop(_DIRTY_KEY, None)
+
+
+cake_state = CakeStateEngine()
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _cake_state_before_flush(db, flush_context, instances):
+    cake_state._on_flush(db)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _cake_state_after_commit(db):
+    cake_state._on_commit(db)
+
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _cake_state_after_transaction_end(db, transaction):
+    cake_state._on_transaction_end(db, transaction)
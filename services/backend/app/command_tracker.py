@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from .metrics import metrics
+
+ADMIN_CMD_TTL_S = float(os.getenv("ADMIN_CMD_TTL_S", "900"))
+ADMIN_CMD_MAX_ENTRIES = int(os.getenv("ADMIN_CMD_MAX_ENTRIES", "2000"))
+ADMIN_CMD_MAX_WAIT_S = float(os.getenv("ADMIN_CMD_MAX_WAIT_S", "25"))
+
+TERMINAL_STAGES = {"succeeded", "failed"}
+
+
+class CommandTracker:
+    """
+    Status of in-flight admin commands (manual, machine, calibration, motor
+    test, cake home), keyed by request_id.
+
+    The route that publishes a command records it as "queued"; the MQTT
+    handlers for the matching igen/evt/admin* topics patch it as the bridge
+    reports stages. Entries live ADMIN_CMD_TTL_S after their last update and
+    at most ADMIN_CMD_MAX_ENTRIES are kept (least recently updated go first),
+    so the map cannot grow without bound. wait() lets a status route long-poll
+    until the stage moves instead of the UI polling every few hundred ms.
+    """
+
+    def __init__(self, ttl_s: float = ADMIN_CMD_TTL_S, max_entries: int = ADMIN_CMD_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._cond = threading.Condition()
+        # request_id -> (status, last update monotonic); ordered by last update
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+
+    def _evict(self, now: float):
+        while self._entries:
+            _, (_, updated) = next(iter(self._entries.items()))
+            if now - updated <= self.ttl_s and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+            metrics.inc("admin_cmd_evicted_total")
+
+    def update(self, request_id: str, patch: dict) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            entry = self._entries.pop(request_id, None)
+            status = dict(entry[0]) if entry else {"request_id": request_id}
+            status.update(patch)
+            status["updated_at"] = datetime.now()
+            self._entries[request_id] = (status, now)
+            self._evict(now)
+            self._cond.notify_all()
+            return dict(status)
+
+    def _current(self, request_id: str, now: float) -> dict | None:
+        entry = self._entries.get(request_id)
+        if entry is None or now - entry[1] > self.ttl_s:
+            return None
+        return entry[0]
+
+    def get(self, request_id: str) -> dict | None:
+        with self._cond:
+            status = self._current(request_id, time.monotonic())
+            return dict(status) if status else None
+
+    def wait(self, request_id: str, timeout_s: float, stage: str | None = None) -> dict | None:
+        """
+        Block until the command's stage differs from `stage` (or, with no
+        stage given, reaches succeeded/failed), then return its status.
+        Returns the current status on timeout and None for unknown ids.
+        """
+        deadline = time.monotonic() + min(timeout_s, ADMIN_CMD_MAX_WAIT_S)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                status = self._current(request_id, now)
+                if status is None:
+                    return None
+                current = status.get("stage")
+                done = current != stage if stage is not None else current in TERMINAL_STAGES
+                if done or now >= deadline:
+                    return dict(status)
+                self._cond.wait(deadline - now)
+
+    def clear(self):
+        with self._cond:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+
+def status_patch(payload: dict) -> dict:
+    """Tracker patch from a bridge stage event; identity fields only when reported."""
+    patch = {
+        "stage": payload.get("stage") or "unknown",
+        "error_code": payload.get("error_code"),
+        "error_reason": payload.get("error_reason"),
+    }
+    data = payload.get("data") if isinstance(payload.get("data"), dict) else {}
+    for key in ("action", "cake_id", "motor_id"):
+        value = payload.get(key, data.get(key))
+        if value is not None:
+            patch[key] = value
+    if data:
+        patch["data"] = data
+    return patch
+
+
+command_tracker = CommandTracker()
@@ -1,10 +1,57 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/igen.db")
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite tuning, applied to every new connection. Set any of these to "" to keep the SQLite default.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable enough with WAL
+SQLITE_BUSY_TIMEOUT_MS = os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")
+SQLITE_MMAP_SIZE = os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = os.getenv("SQLITE_CACHE_SIZE_KB", "16384")
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+# Separate read-only pool for GET/polling routes (0 = share the write engine).
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+if IS_SQLITE and SQLITE_BUSY_TIMEOUT_MS:
+    connect_args["timeout"] = int(SQLITE_BUSY_TIMEOUT_MS) / 1000.0
+
+
+def sqlite_pragmas(*, read_only: bool = False) -> list[str]:
+    pragmas = []
+    if SQLITE_JOURNAL_MODE and not read_only:
+        pragmas.append(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    if SQLITE_SYNCHRONOUS:
+        pragmas.append(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    if SQLITE_BUSY_TIMEOUT_MS:
+        pragmas.append(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    if SQLITE_MMAP_SIZE:
+        pragmas.append(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+    if SQLITE_CACHE_SIZE_KB:
+        pragmas.append(f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}")
+    if SQLITE_TEMP_STORE:
+        pragmas.append(f"PRAGMA temp_store={SQLITE_TEMP_STORE}")
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+
+def _install_sqlite_pragmas(target_engine, *, read_only: bool = False):
+    pragmas = sqlite_pragmas(read_only=read_only)
+
+    @event.listens_for(target_engine, "connect")
+    def _apply_pragmas(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        try:
+            for pragma in pragmas:
+                cur.execute(pragma)
+        finally:
+            cur.close()
+
 
 engine = create_engine(
     DATABASE_URL,
@@ -13,7 +60,23 @@ engine = create_engine(
     connect_args=connect_args,
 )
 
+if IS_SQLITE:
+    _install_sqlite_pragmas(engine)
+
+if IS_SQLITE and SQLITE_READ_POOL_SIZE > 0:
+    read_engine = create_engine(
+        DATABASE_URL,
+        future=True,
+        pool_pre_ping=True,
+        pool_size=SQLITE_READ_POOL_SIZE,
+        connect_args=connect_args,
+    )
+    _install_sqlite_pragmas(read_engine, read_only=True)
+else:
+    read_engine = engine
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False, future=True)
 import os
 print("[INFO] cwd:", os.getcwd())
 print("[INFO] sqlite file:", os.path.abspath(engine.url.database))
@@ -26,10 +89,20 @@ def init_db():
 
     from . import models  # noqa: F401
     print("[INFO] tables seen:", list(Base.metadata.tables.keys()))
-    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if IS_SQLITE:
+            # Only takes effect before the first table exists; older DBs are converted by event retention.
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        Base.metadata.create_all(bind=conn)
+
+    from .db_migrations import run_migrations
+    run_migrations()
     print("[INFO]: DATABASE INITIALIZED")
     with engine.connect() as conn:
         rows = conn.exec_driver_sql(
             "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
         ).fetchall()
-    print("[INFO] tables in sqlite_master:", [r[0] for r in rows])
\ No newline at end of file
+        if IS_SQLITE:
+            journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+            print("[INFO] sqlite journal_mode:", journal_mode)
+    print("[INFO] tables in sqlite_master:", [r[0] for r in rows])
@@ -1,8 +1,12 @@
 # backend/db_migrations.py
 from __future__ import annotations
 
+import json
 import os
 import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
 
 
 def _sqlite_path_from_database_url() -> str | None:
@@ -40,10 +44,265 @@ def _cols(conn: sqlite3.Connection, table: str) -> set[str]:
     return {row[1] for row in cur.fetchall()}
 
 
+def _add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, ddl: str) -> bool:
+    if column in _cols(conn, table):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl};")
+    print(f"[MIGRATIONS] added {table}.{column}")
+    return True
+
+
+def _indexes(conn: sqlite3.Connection, table: str) -> set[str]:
+    cur = conn.execute(f"PRAGMA index_list({table});")
+    return {row[1] for row in cur.fetchall()}
+
+
+def _create_index_if_missing(conn: sqlite3.Connection, name: str, table: str, columns: tuple[str, ...]) -> bool:
+    if name in _indexes(conn, table):
+        return False
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)});")
+    print(f"[MIGRATIONS] created index {name} on {table}({', '.join(columns)})")
+    return True
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[sqlite3.Connection], None]
+    transactional: bool = True  # False for statements SQLite refuses inside a transaction (e.g. VACUUM)
+
+
+# ---------------- migrations ----------------
+def _m001_tool_model_policy_columns(conn: sqlite3.Connection) -> None:
+    _add_column_if_missing(conn, "tool_models", "max_loan_hours", "INTEGER")
+    _add_column_if_missing(conn, "tool_models", "max_qty_per_user", "INTEGER")
+
+
+# Derived from the hot queries:
+#   loans          user_flow allocation/return checks, admin_crud delete/drop, alert overdue scan
+#   loan_requests  batch release ordering (mqtt), in-flight reservation check (user_flow)
+#   events         latest-event lookups in routers/admin and alert_service
+#   auth_sessions  expiry sweeps (token lookups already use the unique index)
+HOT_QUERY_INDEXES: tuple[tuple[str, str, tuple[str, ...]], ...] = (
+    ("ix_loans_tool_open", "loans", ("tool_item_id", "returned_at", "status")),
+    ("ix_loans_user_open", "loans", ("user_id", "returned_at")),
+    ("ix_loans_open_due", "loans", ("returned_at", "due_at")),
+    ("ix_loan_requests_batch_created", "loan_requests", ("batch_id", "created_at", "request_id")),
+    ("ix_loan_requests_tool_type_status", "loan_requests", ("tool_item_id", "request_type", "hw_status")),
+    ("ix_events_type_ts", "events", ("event_type", "ts", "event_id")),
+    ("ix_auth_sessions_expires_at", "auth_sessions", ("expires_at",)),
+)
+
+
+def _m002_hot_query_indexes(conn: sqlite3.Connection) -> None:
+    for name, table, columns in HOT_QUERY_INDEXES:
+        _create_index_if_missing(conn, name, table, columns)
+
+
+def _m003_incremental_auto_vacuum(conn: sqlite3.Connection) -> None:
+    # New databases get auto_vacuum=INCREMENTAL from init_db() in db.py.
+    # An existing one needs a full VACUUM to switch, which can take minutes on the
+    # Pi's SD card, so event retention does it in the background on its first
+    # run instead of holding up startup here.
+    pass
+
+
+EVENT_FIELD_INDEXES: tuple[tuple[str, str, tuple[str, ...]], ...] = (
+    ("ix_events_type_cake_ts", "events", ("event_type", "cake_id", "ts", "event_id")),
+    ("ix_events_type_stage_ts", "events", ("event_type", "stage", "ts", "event_id")),
+    ("ix_events_type_severity_ts", "events", ("event_type", "severity", "ts", "event_id")),
+    ("ix_events_request_type", "events", ("request_id", "event_type", "ts", "event_id")),
+)
+
+def _event_fields_json(payload_json):
+    """models.event_fields_from_payload as an SQLite function, so the backfill and inserts share one definition."""
+    from .models import event_fields_from_payload
+
+    try:
+        payload = json.loads(payload_json)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    return json.dumps(event_fields_from_payload(payload))
+
+
+_EVENT_FIELDS_BACKFILL = """
+UPDATE events SET (stage, action, cake_id, severity, code) = (
+  SELECT json_extract(f, '$.stage'), json_extract(f, '$.action'), json_extract(f, '$.cake_id'),
+         json_extract(f, '$.severity'), json_extract(f, '$.code')
+  FROM (SELECT event_fields_json(events.payload_json) AS f)
+)
+WHERE stage IS NULL AND action IS NULL AND cake_id IS NULL AND severity IS NULL AND code IS NULL
+  AND event_fields_json(payload_json) IS NOT NULL;
+"""
+
+
+def _m004_event_fields(conn: sqlite3.Connection) -> None:
+    for column, ddl in (
+        ("stage", "VARCHAR"),
+        ("action", "VARCHAR"),
+        ("cake_id", "INTEGER"),
+        ("severity", "VARCHAR"),
+        ("code", "VARCHAR"),
+    ):
+        _add_column_if_missing(conn, "events", column, ddl)
+    conn.create_function("event_fields_json", 1, _event_fields_json, deterministic=True)
+    updated = conn.execute(_EVENT_FIELDS_BACKFILL).rowcount
+    print(f"[MIGRATIONS] backfilled typed event fields rows={updated}")
+    for name, table, columns in EVENT_FIELD_INDEXES:
+        _create_index_if_missing(conn, name, table, columns)
+
+
+# Existing batches keep their creation order.
+_LOAN_REQUEST_SEQUENCE_BACKFILL = """
+UPDATE loan_requests SET sequence = (
+  SELECT rn FROM (
+    SELECT request_id AS rid,
+           row_number() OVER (PARTITION BY batch_id ORDER BY created_at, request_id) AS rn
+    FROM loan_requests
+  ) WHERE rid = loan_requests.request_id
+)
+WHERE sequence IS NULL;
+"""
+
+
+def _m005_loan_request_sequence(conn: sqlite3.Connection) -> None:
+    _add_column_if_missing(conn, "loan_requests", "sequence", "INTEGER")
+    updated = conn.execute(_LOAN_REQUEST_SEQUENCE_BACKFILL).rowcount
+    print(f"[MIGRATIONS] backfilled loan_requests.sequence rows={updated}")
+    _create_index_if_missing(
+        conn, "ix_loan_requests_batch_sequence", "loan_requests", ("batch_id", "sequence", "created_at", "request_id")
+    )
+
+
+# Keyset pages for the admin lists and exports: ordered by (ts, event_id) /
+# (issued_at, loan_id), so the unfiltered list and each event filter need an
+# index ending in that pair. The tool composite supersedes the single-column one.
+KEYSET_INDEXES: tuple[tuple[str, str, tuple[str, ...]], ...] = (
+    ("ix_events_ts", "events", ("ts", "event_id")),
+    ("ix_events_actor_ts", "events", ("actor_id", "ts", "event_id")),
+    ("ix_events_tool_ts", "events", ("tool_item_id", "ts", "event_id")),
+    ("ix_loans_issued", "loans", ("issued_at", "loan_id")),
+)
+
+
+def _m006_keyset_indexes(conn: sqlite3.Connection) -> None:
+    for name, table, columns in KEYSET_INDEXES:
+        # A table old enough to lack the column has nothing to filter on there.
+        if set(columns) <= _cols(conn, table):
+            _create_index_if_missing(conn, name, table, columns)
+    if "ix_events_tool_item_id" in _indexes(conn, "events"):
+        conn.execute("DROP INDEX ix_events_tool_item_id;")
+        print("[MIGRATIONS] dropped index ix_events_tool_item_id")
+
+
+def _index_columns(conn: sqlite3.Connection, name: str) -> tuple[str, ...]:
+    return tuple(row[2] for row in conn.execute(f"PRAGMA index_info({name});").fetchall())
+
+
+# Every events index is paid for on each insert (one per MQTT message). The
+# single-column event_type and request_id indexes are prefixes of
+# ix_events_type_ts and ix_events_request_type, and the stage index gets the
+# event_id tie-breaker the other (..., ts, event_id) indexes carry.
+REDUNDANT_EVENT_INDEXES = ("ix_events_event_type", "ix_events_request_id")
+
+
+def _m007_event_index_cleanup(conn: sqlite3.Connection) -> None:
+    existing = _indexes(conn, "events")
+    for name in REDUNDANT_EVENT_INDEXES:
+        if name in existing:
+            conn.execute(f"DROP INDEX {name};")
+            print(f"[MIGRATIONS] dropped index {name}")
+    stage_columns = ("event_type", "stage", "ts", "event_id")
+    if "ix_events_type_stage_ts" in existing and _index_columns(conn, "ix_events_type_stage_ts") != stage_columns:
+        conn.execute("DROP INDEX ix_events_type_stage_ts;")
+    if "stage" in _cols(conn, "events"):
+        _create_index_if_missing(conn, "ix_events_type_stage_ts", "events", stage_columns)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "tool_model_policy_columns", _m001_tool_model_policy_columns),
+    Migration(2, "hot_query_indexes", _m002_hot_query_indexes),
+    Migration(3, "incremental_auto_vacuum", _m003_incremental_auto_vacuum),
+    Migration(4, "event_fields", _m004_event_fields),
+    Migration(5, "loan_request_sequence", _m005_loan_request_sequence),
+    Migration(6, "keyset_indexes", _m006_keyset_indexes),
+    Migration(7, "event_index_cleanup", _m007_event_index_cleanup),
+]
+
+
+# ---------------- runner ----------------
+def _ensure_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY,"
+        " name TEXT NOT NULL,"
+        " applied_at TEXT NOT NULL"
+        ");"
+    )
+
+
+def applied_versions(conn: sqlite3.Connection) -> set[int]:
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations;").fetchall()}
+
+
+def run_migrations(path: str | None = None, migrations: list[Migration] | None = None) -> list[int]:
+    """
+    Apply pending migrations in version order. Each migration is recorded in
+    schema_migrations and is itself idempotent, so re-running at every startup
+    (or against a DB that create_all already brought up to date) is safe.
+    Returns the versions applied by this call.
+    """
+    path = path or _sqlite_path_from_database_url()
+    if not path:
+        print("[MIGRATIONS] non-sqlite DB; skipping migrations")
+        return []
+    if not os.path.exists(path):
+        print(f"[MIGRATIONS] sqlite file not found yet: {path} (skipping)")
+        return []
+
+    migrations = sorted(migrations if migrations is not None else MIGRATIONS, key=lambda m: m.version)
+    applied_now: list[int] = []
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        done = applied_versions(conn)
+        for m in migrations:
+            if m.version in done:
+                continue
+            print(f"[MIGRATIONS] applying {m.version:03d}_{m.name}")
+            if m.transactional:
+                conn.execute("BEGIN IMMEDIATE;")
+                try:
+                    m.apply(conn)
+                    _record(conn, m)
+                    conn.execute("COMMIT;")
+                except Exception:
+                    conn.execute("ROLLBACK;")
+                    raise
+            else:
+                m.apply(conn)
+                _record(conn, m)
+            applied_now.append(m.version)
+    finally:
+        conn.close()
+    return applied_now
+
+
+def _record(conn: sqlite3.Connection, m: Migration) -> None:
+    conn.execute(
+        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?);",
+        (m.version, m.name, datetime.now().isoformat()),
+    )
+
+
 def ensure_tool_model_policy_columns() -> None:
     """
     Adds policy columns to tool_models if missing.
-    Safe to run multiple times on SQLite.
+    Safe to run multiple times on SQLite. Kept for callers of the old helper;
+    startup now goes through run_migrations().
 
     Columns:
       - max_loan_hours INTEGER
@@ -61,16 +320,7 @@ def ensure_tool_model_policy_columns() -> None:
 
     conn = sqlite3.connect(path)
     try:
-        existing = _cols(conn, "tool_models")
-
-        if "max_loan_hours" not in existing:
-            conn.execute("ALTER TABLE tool_models ADD COLUMN max_loan_hours INTEGER;")
-            print("[MIGRATIONS] added tool_models.max_loan_hours")
-
-        if "max_qty_per_user" not in existing:
-            conn.execute("ALTER TABLE tool_models ADD COLUMN max_qty_per_user INTEGER;")
-            print("[MIGRATIONS] added tool_models.max_qty_per_user")
-
+        _m001_tool_model_policy_columns(conn)
         conn.commit()
     finally:
         conn.close()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+from .db import SessionLocal
+from .metrics import metrics
+from . import models
+
+_KINDS = {
+    "user": models.User,
+    "tool_model": models.ToolModel,
+    "tool_item": models.ToolItem,
+}
+
+
+def _values(obj) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in type(obj).__mapper__.column_attrs}
+
+
+class EntityCache:
+    """
+    Read-through cache of users, tool models and tool items, with card_id -> user
+    and tool_tag_id -> tool_item indexes.
+
+    Rows are held as plain column snapshots and handed out as persistent
+    instances attached to the caller's session without a SELECT, so callers use
+    them exactly like db.get() results. Those tables only change through the
+    admin CRUD usecases and the card/tag assign routes, which invalidate after
+    they commit. A load that races an invalidation is not stored.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: dict[str, dict[str, dict]] = {kind: {} for kind in _KINDS}
+        self._card_index: dict[str, str] = {}
+        self._tag_index: dict[str, str] = {}
+        self._generation = 0
+        self._hits: dict[str, int] = {}
+        self._misses: dict[str, int] = {}
+
+    # ---------------- counters ----------------
+    def _count(self, kind: str, hit: bool):
+        counts = self._hits if hit else self._misses
+        with self._lock:
+            counts[kind] = counts.get(kind, 0) + 1
+        metrics.inc(f"entity_cache_{'hits' if hit else 'misses'}_total:{kind}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sizes": {kind: len(rows) for kind, rows in self._rows.items()},
+                "hits": dict(self._hits),
+                "misses": dict(self._misses),
+            }
+
+    # ---------------- storage ----------------
+    def _store(self, kind: str, obj, generation: int):
+        values = _values(obj)
+        with self._lock:
+            if generation != self._generation:
+                return
+            pk = values[_KINDS[kind].__mapper__.primary_key[0].key]
+            self._rows[kind][pk] = values
+            if kind == "user" and values.get("card_id"):
+                self._card_index[values["card_id"]] = pk
+            elif kind == "tool_item" and values.get("tool_tag_id"):
+                self._tag_index[values["tool_tag_id"]] = pk
+
+    def _attach(self, db: Session, kind: str, values: dict):
+        model = _KINDS[kind]
+        pk = values[model.__mapper__.primary_key[0].key]
+        existing = db.identity_map.get(identity_key(model, pk))
+        if existing is not None:
+            return existing
+        obj = model(**values)
+        make_transient_to_detached(obj)
+        return db.merge(obj, load=False)
+
+    def _get(self, db: Session, kind: str, pk: str | None):
+        if pk is None:
+            return None
+        with self._lock:
+            values = self._rows[kind].get(pk)
+            generation = self._generation
+        if values is not None:
+            self._count(kind, True)
+            return self._attach(db, kind, values)
+        self._count(kind, False)
+        obj = db.get(_KINDS[kind], pk)
+        if obj is not None:
+            self._store(kind, obj, generation)
+        return obj
+
+    # ---------------- lookups ----------------
+    def user(self, db: Session, user_id: str | None) -> models.User | None:
+        return self._get(db, "user", user_id)
+
+    def tool_model(self, db: Session, tool_model_id: str | None) -> models.ToolModel | None:
+        return self._get(db, "tool_model", tool_model_id)
+
+    def tool_item(self, db: Session, tool_item_id: str | None) -> models.ToolItem | None:
+        return self._get(db, "tool_item", tool_item_id)
+
+    def user_by_card(self, db: Session, card_id: str | None) -> models.User | None:
+        if not card_id:
+            return None
+        with self._lock:
+            user_id = self._card_index.get(card_id)
+            generation = self._generation
+        if user_id is not None:
+            return self.user(db, user_id)
+        self._count("card_id", False)
+        u = db.execute(select(models.User).where(models.User.card_id == card_id)).scalar_one_or_none()
+        if u is not None:
+            self._store("user", u, generation)
+        return u
+
+    def tool_item_by_tag(self, db: Session, tool_tag_id: str | None) -> models.ToolItem | None:
+        if not tool_tag_id:
+            return None
+        with self._lock:
+            tool_item_id = self._tag_index.get(tool_tag_id)
+            generation = self._generation
+        if tool_item_id is not None:
+            return self.tool_item(db, tool_item_id)
+        self._count("tool_tag_id", False)
+        ti = db.execute(select(models.ToolItem).where(models.ToolItem.tool_tag_id == tool_tag_id)).scalar_one_or_none()
+        if ti is not None:
+            self._store("tool_item", ti, generation)
+        return ti
+
+    # ---------------- invalidation ----------------
+    def _invalidate(self, kind: str, pk: str):
+        with self._lock:
+            self._generation += 1
+            self._rows[kind].pop(pk, None)
+            index = self._card_index if kind == "user" else self._tag_index if kind == "tool_item" else None
+            if index is not None:
+                for key in [k for k, v in index.items() if v == pk]:
+                    del index[key]
+
+    def invalidate_user(self, user_id: str):
+        self._invalidate("user", user_id)
+
+    def invalidate_tool_model(self, tool_model_id: str):
+        self._invalidate("tool_model", tool_model_id)
+
+    def invalidate_tool_item(self, tool_item_id: str):
+        self._invalidate("tool_item", tool_item_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            for rows in self._rows.values():
+                rows.clear()
+            self._card_index.clear()
+            self._tag_index.clear()
+
+    def warm(self):
+        self.clear()
+        with self._lock:
+            generation = self._generation
+        with SessionLocal() as db:
+            for kind, model in _KINDS.items():
+                for obj in db.execute(select(model)).scalars():
+                    self._store(kind, obj, generation)
+        sizes = self.stats()["sizes"]
+        print(f"[ENTITY_CACHE] warmed users={sizes['user']} tool_models={sizes['tool_model']} tool_items={sizes['tool_item']}")
+
+
+entity_cache = EntityCache()
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from . import models
+
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "2000"))
+STREAM_KEEPALIVE_S = float(os.getenv("STREAM_KEEPALIVE_S", "15"))
+STREAM_RETRY_MS = int(os.getenv("STREAM_RETRY_MS", "2000"))
+
+_PENDING_KEY = "event_stream_pending"
+
+
+@dataclass(frozen=True)
+class StreamEvent:
+    id: int
+    event: str
+    data: dict
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.event}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+class EventStream:
+    """
+    In-process fan-out for the /api/stream SSE endpoint.
+
+    Events get a monotonically increasing id and are kept in a bounded ring so a
+    client reconnecting with Last-Event-ID can be replayed what it missed.
+    publish() is thread-safe (MQTT workers call it); subscribers are asyncio
+    events woken on their own loop.
+    """
+
+    def __init__(self, maxlen: int = STREAM_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._buffer: deque[StreamEvent] = deque(maxlen=maxlen)
+        self._last_id = 0
+        self._subscribers: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    @property
+    def last_id(self) -> int:
+        with self._lock:
+            return self._last_id
+
+    def publish(self, name: str, data: dict) -> StreamEvent:
+        with self._lock:
+            self._last_id += 1
+            ev = StreamEvent(self._last_id, name, data)
+            self._buffer.append(ev)
+            subscribers = list(self._subscribers)
+        for loop, wake in subscribers:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # loop already closed; the subscriber is on its way out
+        return ev
+
+    def since(self, last_id: int) -> tuple[list[StreamEvent], bool]:
+        """
+        Events after last_id, plus whether the replay is complete. False means the
+        client is further behind than the buffer (or from before a restart) and
+        should re-fetch full state.
+        """
+        with self._lock:
+            if last_id > self._last_id:
+                return [], False
+            if not self._buffer:
+                return [], last_id == self._last_id or last_id == 0
+            oldest = self._buffer[0].id
+            complete = last_id >= oldest - 1
+            return [ev for ev in self._buffer if ev.id > last_id], complete
+
+    def subscribe(self) -> asyncio.Event:
+        wake = asyncio.Event()
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), wake))
+        return wake
+
+    def unsubscribe(self, wake: asyncio.Event):
+        with self._lock:
+            self._subscribers = {s for s in self._subscribers if s[1] is not wake}
+
+    def reset(self):
+        with self._lock:
+            self._buffer.clear()
+            self._last_id = 0
+            self._subscribers.clear()
+
+
+stream = EventStream()
+
+
+def loan_request_snapshot(req: models.LoanRequest) -> dict:
+    return {
+        "batch_id": req.batch_id,
+        "request_id": req.request_id,
+        "request_type": req.request_type,
+        "user_id": req.user_id,
+        "tool_item_id": req.tool_item_id,
+        "slot_id": req.slot_id,
+        "sequence": req.sequence,
+        "hw_status": req.hw_status,
+        "hw_error_code": req.hw_error_code,
+        "hw_error_reason": req.hw_error_reason,
+        "hw_updated_at": req.hw_updated_at.isoformat() if req.hw_updated_at else None,
+    }
+
+
+async def sse_events(
+    last_event_id: int | None,
+    *,
+    names: set[str] | None = None,
+    batch_id: str | None = None,
+    user_id: str | None = None,
+    is_disconnected=None,
+    keepalive_s: float = STREAM_KEEPALIVE_S,
+    source: EventStream | None = None,
+):
+    """
+    Async generator of SSE frames, starting after last_event_id (None = live only).
+    With user_id set, loan_request events for other users' requests are dropped.
+    """
+    source = source or stream
+
+    def wanted(ev: StreamEvent) -> bool:
+        if names and ev.event not in names:
+            return False
+        if batch_id and ev.event == "loan_request" and ev.data.get("batch_id") != batch_id:
+            return False
+        if user_id and ev.event == "loan_request" and ev.data.get("user_id") != user_id:
+            return False
+        return True
+
+    wake = source.subscribe()
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        cursor = source.last_id if last_event_id is None else last_event_id
+        if last_event_id is not None:
+            _, complete = source.since(last_event_id)
+            if not complete:
+                # Tell the client to reload full state; then stream from now.
+                cursor = source.last_id
+                yield StreamEvent(cursor, "reset", {"reason": "replay_unavailable"}).encode()
+
+        while True:
+            wake.clear()
+            events, _ = source.since(cursor)
+            for ev in events:
+                cursor = ev.id
+                if wanted(ev):
+                    yield ev.encode()
+            if is_disconnected is not None and await is_disconnected():
+                return
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=keepalive_s)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        source.unsubscribe(wake)
+
+
+# ---------------- LoanRequest transitions ----------------
+# Captured on flush and published only once the transaction commits, so the
+# stream never shows a state that was rolled back.
+def _on_flush(db: Session):
+    pending = None
+    for obj in list(db.new) + list(db.dirty):
+        if not isinstance(obj, models.LoanRequest):
+            continue
+        if obj in db.dirty and not inspect(obj).attrs.hw_status.history.has_changes():
+            continue
+        if pending is None:
+            pending = db.info.setdefault(_PENDING_KEY, {})
+        pending[obj.request_id] = loan_request_snapshot(obj)
+
+
+def _on_commit(db: Session):
+    pending = db.info.pop(_PENDING_KEY, None)
+    for snapshot in (pending or {}).values():
+        stream.publish("loan_request", snapshot)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _event_stream_after_flush(db, flush_context):
+    _on_flush(db)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _event_stream_after_commit(db):
+    _on_commit(db)
+
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _event_stream_after_transaction_end(db, transaction):
+    if transaction.parent is None:
+        db.info.pop(_PENDING_KEY, None)
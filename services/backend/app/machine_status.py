@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+
+from .db import SessionLocal
+from .metrics import metrics
+from .moonraker import MOONRAKER_URL, MoonrakerError, shared_client
+from . import models
+
+MACHINE_STATUS_PROBE_INTERVAL_S = float(os.getenv("MACHINE_STATUS_PROBE_INTERVAL_S", "2.0"))  # 0 disables the direct probe
+MACHINE_STATUS_PROBE_TIMEOUT_S = float(os.getenv("MACHINE_STATUS_PROBE_TIMEOUT_S", "3.0"))
+
+STATUS_EVENT_TYPE = "mqtt:igen/evt/machine/status"
+_PROBE_QUERY = "toolhead=homed_axes,position&idle_timeout=state&print_stats=state,message"
+
+
+def coerce_status(payload: dict | None, source: str = "mqtt_cache") -> dict:
+    payload = payload or {}
+    pos = payload.get("position") or payload.get("machine", {}).get("position") or []
+    x = pos[0] if isinstance(pos, list) and len(pos) > 0 else payload.get("horizontal_position")
+    z = pos[2] if isinstance(pos, list) and len(pos) > 2 else payload.get("vertical_position")
+    return {
+        "ok": True,
+        "reachable": payload.get("reachable", False),
+        "state": payload.get("state") or payload.get("machine", {}).get("state") or "unknown",
+        "busy": payload.get("busy", False),
+        "homed": payload.get("homed", False),
+        "horizontal_position": x,
+        "vertical_position": z,
+        "active_cake_id": payload.get("active_cake_id"),
+        "position": pos if isinstance(pos, list) else [],
+        "error": payload.get("error"),
+        "source": payload.get("source", source),
+    }
+
+
+def parse_objects_query(out: dict) -> dict | None:
+    status = (out.get("result") or {}).get("status") or {}
+    if not status:
+        return None
+    toolhead = status.get("toolhead") or {}
+    idle_timeout = status.get("idle_timeout") or {}
+    print_stats = status.get("print_stats") or {}
+    homed_axes = str(toolhead.get("homed_axes") or "")
+    pos = toolhead.get("position") or []
+    x = pos[0] if len(pos) > 0 else None
+    z = pos[2] if len(pos) > 2 else None
+    return {
+        "ok": True,
+        "reachable": True,
+        "state": print_stats.get("state") or idle_timeout.get("state") or "unknown",
+        "busy": str(idle_timeout.get("state") or "").lower() != "idle",
+        "homed": bool(homed_axes),
+        "homed_axes": homed_axes,
+        "horizontal_position": x,
+        "vertical_position": z,
+        "active_cake_id": None,
+        "position": pos,
+        "print_message": print_stats.get("message"),
+        "source": "moonraker_direct",
+    }
+
+
+class MachineStatusCollector:
+    """
+    Latest machine status, kept in memory for the admin status routes.
+
+    Fed by igen/evt/machine/status (after the MQTT handler commits) and, when
+    MACHINE_STATUS_PROBE_INTERVAL_S > 0, by a background probe of Moonraker at
+    most that often. A successful probe wins over the bridge's last report,
+    as the routes did when they probed inline; a failed probe falls back to it.
+    load() seeds the MQTT side from the newest stored event so a restart does
+    not start from "unknown". Reads never touch the DB or the network.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mqtt: dict | None = None
+        self._mqtt_at: float | None = None
+        self._direct: dict | None = None
+        self._direct_at: float | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ---------------- sources ----------------
+    def load(self):
+        with SessionLocal() as db:
+            row = db.execute(
+                select(models.Event.ts, models.Event.payload_json)
+                .where(models.Event.event_type == STATUS_EVENT_TYPE)
+                .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
+                .limit(1)
+            ).first()
+        if not row:
+            return
+        try:
+            payload = json.loads(row.payload_json or "{}")
+        except Exception:
+            return
+        with self._lock:
+            if self._mqtt_at is None:
+                self._mqtt = coerce_status(payload)
+                self._mqtt_at = row.ts.timestamp()
+
+    def update_from_mqtt(self, payload: dict):
+        status = coerce_status(payload)
+        with self._lock:
+            self._mqtt = status
+            self._mqtt_at = time.time()
+
+    def probe(self) -> dict | None:
+        try:
+            out = shared_client(MOONRAKER_URL).get(f"/printer/objects/query?{_PROBE_QUERY}", timeout_s=MACHINE_STATUS_PROBE_TIMEOUT_S)
+            status = parse_objects_query(out)
+        except MoonrakerError:
+            status = None
+        metrics.inc(f"machine_status_probe_total:{'ok' if status else 'failed'}")
+        with self._lock:
+            self._direct = status
+            self._direct_at = time.time() if status else None
+        return status
+
+    # ---------------- reads ----------------
+    @staticmethod
+    def _stamped(status: dict, at: float | None) -> dict:
+        out = dict(status)
+        out["updated_at"] = datetime.fromtimestamp(at) if at is not None else None
+        out["age_s"] = round(time.time() - at, 3) if at is not None else None
+        return out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            if self._direct is not None:
+                return self._stamped(self._direct, self._direct_at)
+            if self._mqtt is not None:
+                return self._stamped(self._mqtt, self._mqtt_at)
+        return self._stamped({"ok": True, "reachable": False, "state": "unknown", "busy": False}, None)
+
+    def mqtt_snapshot(self) -> dict:
+        """Last bridge report only; calibration status shows what the bridge saw."""
+        with self._lock:
+            return self._stamped(self._mqtt or coerce_status(None), self._mqtt_at)
+
+    def clear(self):
+        with self._lock:
+            self._mqtt = self._mqtt_at = None
+            self._direct = self._direct_at = None
+
+    # ---------------- background probe ----------------
+    def start(self):
+        if MACHINE_STATUS_PROBE_INTERVAL_S <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception as e:
+                print(f"[MACHINE_STATUS] probe failed: {e}")
+            self._stop.wait(MACHINE_STATUS_PROBE_INTERVAL_S)
+
+
+status_collector = MachineStatusCollector()
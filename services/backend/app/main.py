@@ -1,26 +1,44 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
+from .auth import session_cache
 from .db import init_db
+from .availability import availability
+from .cake_state import cake_state
+from .entity_cache import entity_cache
+from .machine_status import status_collector
 from .mqtt import MqttBus
 from .services.alert_service import AlertService
+from .services.event_retention import EventRetentionService
 
 from .routers.health import router as health_router
 from .routers.user import router as user_router
 from .routers.rfid import router as rfid_router
 from .routers.admin import router as admin_router
+from .routers.stream import router as stream_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    cake_state.load()
+    availability.check(repair=True)
+    entity_cache.warm()
+    status_collector.load()
+
+    session_cache.start()
 
     app.state.mqtt = MqttBus()
     app.state.mqtt.start()
 
+    status_collector.start()
+
     app.state.alert_service = AlertService()
     app.state.alert_service.start()
 
+    app.state.event_retention = EventRetentionService()
+    app.state.event_retention.start()
+
     try:
         yield
     finally:
@@ -28,7 +46,13 @@ async def lifespan(app: FastAPI):
             app.state.alert_service.stop()
         except Exception:
             pass
+        try:
+            app.state.event_retention.stop()
+        except Exception:
+            pass
+        status_collector.stop()
         app.state.mqtt.stop()
+        session_cache.stop()
 
 
 app = FastAPI(title="IGEN Shop Assistant API", lifespan=lifespan)
@@ -36,3 +60,4 @@ app.include_router(health_router, prefix="/api")
 app.include_router(user_router, prefix="/api")
 app.include_router(rfid_router, prefix="/api")
 app.include_router(admin_router, prefix="/api")
+app.include_router(stream_router, prefix="/api")
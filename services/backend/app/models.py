@@ -1,9 +1,10 @@
 from __future__ import annotations
 
+import json
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, DateTime, ForeignKey, Index, Integer, String, Text, event
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -74,9 +75,18 @@ class LoanRequest(Base):
     hw_status: Mapped[str] = mapped_column(String, default="pending")
     hw_error_code: Mapped[str | None] = mapped_column(String, nullable=True)
     hw_error_reason: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Execution order within the batch (1-based): plan_batch's order for dispenses,
+    # user_flow.resequence_batch for returns.
+    sequence: Mapped[int | None] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow)
     hw_updated_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
+    __table_args__ = (
+        Index("ix_loan_requests_batch_created", "batch_id", "created_at", "request_id"),
+        Index("ix_loan_requests_batch_sequence", "batch_id", "sequence", "created_at", "request_id"),
+        Index("ix_loan_requests_tool_type_status", "tool_item_id", "request_type", "hw_status"),
+    )
+
 
 class Loan(Base):
     __tablename__ = "loans"
@@ -89,17 +99,97 @@ class Loan(Base):
     returned_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     status: Mapped[str] = mapped_column(String, default="unconfirmed")
 
+    __table_args__ = (
+        Index("ix_loans_tool_open", "tool_item_id", "returned_at", "status"),
+        Index("ix_loans_user_open", "user_id", "returned_at"),
+        Index("ix_loans_open_due", "returned_at", "due_at"),
+        Index("ix_loans_issued", "issued_at", "loan_id"),
+    )
+
 
 class Event(Base):
     __tablename__ = "events"
     event_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     ts: Mapped[datetime] = mapped_column(DateTime, default=utcnow)
-    event_type: Mapped[str] = mapped_column(String, index=True)
+    event_type: Mapped[str] = mapped_column(String)
     actor_type: Mapped[str] = mapped_column(String, default="system")
     actor_id: Mapped[str | None] = mapped_column(String, nullable=True)
-    request_id: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
-    tool_item_id: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
+    request_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    tool_item_id: Mapped[str | None] = mapped_column(String, nullable=True)
     payload_json: Mapped[str] = mapped_column(Text, default="{}")
+    # Copied out of payload_json on insert (see event_fields_from_payload) so hot filters stay indexed.
+    stage: Mapped[str | None] = mapped_column(String, nullable=True)
+    action: Mapped[str | None] = mapped_column(String, nullable=True)
+    cake_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    severity: Mapped[str | None] = mapped_column(String, nullable=True)
+    code: Mapped[str | None] = mapped_column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_events_type_ts", "event_type", "ts", "event_id"),
+        Index("ix_events_type_cake_ts", "event_type", "cake_id", "ts", "event_id"),
+        Index("ix_events_type_stage_ts", "event_type", "stage", "ts", "event_id"),
+        Index("ix_events_type_severity_ts", "event_type", "severity", "ts", "event_id"),
+        Index("ix_events_request_type", "request_id", "event_type", "ts", "event_id"),
+        Index("ix_events_ts", "ts", "event_id"),
+        Index("ix_events_actor_ts", "actor_id", "ts", "event_id"),
+        Index("ix_events_tool_ts", "tool_item_id", "ts", "event_id"),
+    )
+
+
+def _as_cake_id(value) -> int | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def event_fields_from_payload(payload: dict) -> dict:
+    """
+    Typed Event columns derived from a payload. The only definition: the
+    migration backfill calls it too (db_migrations._event_fields_json).
+    """
+    data = payload.get("data") if isinstance(payload.get("data"), dict) else {}
+    cake_id = payload.get("cake_id")
+    if cake_id is None:
+        cake_id = data.get("cake_id")
+    severity = payload.get("severity")
+    code = payload.get("code")
+    if code is None or (isinstance(code, str) and not code.strip()):
+        code = payload.get("error_code")
+    return {
+        "stage": str(payload["stage"]) if payload.get("stage") is not None else None,
+        "action": str(payload["action"]) if payload.get("action") is not None else None,
+        "cake_id": _as_cake_id(cake_id),
+        "severity": str(severity).lower() if severity is not None else None,
+        "code": str(code) if code is not None else None,
+    }
+
+
+@event.listens_for(Event, "before_insert")
+def _event_extract_fields(mapper, connection, target: Event):
+    try:
+        payload = json.loads(target.payload_json or "{}")
+    except (TypeError, ValueError):
+        return
+    if not isinstance(payload, dict):
+        return
+    for key, value in event_fields_from_payload(payload).items():
+        if getattr(target, key) is None:
+            setattr(target, key, value)
+
+
+class ToolModelAvailability(Base):
+    """Materialized per-model counts behind /catalog and /admin/inventory (see app.availability)."""
+    __tablename__ = "tool_model_availability"
+    tool_model_id: Mapped[str] = mapped_column(String, primary_key=True)
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    available: Mapped[int] = mapped_column(Integer, default=0)
+    checked_out: Mapped[int] = mapped_column(Integer, default=0)
+    reserved: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow, onupdate=utcnow)
 
 
 class CakeState(Base):
@@ -118,3 +208,7 @@ class AuthSession(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow)
     expires_at: Mapped[datetime] = mapped_column(DateTime)
     revoked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_auth_sessions_expires_at", "expires_at"),
+    )
@@ -0,0 +1,223 @@
+"""
+Shared Moonraker HTTP client for the bridge, vertical homing and the admin API.
+
+Keeps a small pool of keep-alive connections per Moonraker instead of a new
+TCP connection per call, applies per-endpoint timeouts (reads are short, gcode
+scripts can run for minutes), and caches /printer/objects/query responses for
+a short TTL. Any POST through the same client drops the cache, so a status
+read right after a script never sees the pre-script state.
+
+Plain standard library, so the bridge image needs nothing beyond its own
+dependencies; the module is copied next to bridge.py and vertical_home.py.
+"""
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from typing import Dict, Optional
+from urllib import parse
+
+try:
+    from .metrics import metrics
+except ImportError:  # bridge / vertical_home run as plain scripts
+    from metrics import metrics
+
+MOONRAKER_URL = os.getenv("MOONRAKER_URL", "http://host.docker.internal:7125").rstrip("/")
+MOONRAKER_POOL_SIZE = int(os.getenv("MOONRAKER_POOL_SIZE", "4"))
+MOONRAKER_READ_TIMEOUT_S = float(os.getenv("MOONRAKER_READ_TIMEOUT_S", "5"))
+MOONRAKER_SCRIPT_TIMEOUT_S = float(os.getenv("MOONRAKER_SCRIPT_TIMEOUT_S", "300"))
+MOONRAKER_QUERY_CACHE_TTL_S = float(os.getenv("MOONRAKER_QUERY_CACHE_TTL_S", "0.25"))
+
+# Endpoint path -> timeout; anything not listed uses the client's read timeout.
+DEFAULT_ENDPOINT_TIMEOUTS_S = {
+    "/printer/gcode/script": MOONRAKER_SCRIPT_TIMEOUT_S,
+    "/printer/firmware_restart": 30.0,
+    "/machine/services/restart": 30.0,
+}
+
+CACHEABLE_PATHS = {"/printer/objects/query"}
+
+# How a pooled connection the server has already closed fails. From the send,
+# the request never reached Moonraker; from getresponse()/read() it may already
+# have been received and run, so only an idempotent GET is retried then.
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class MoonrakerError(Exception):
+    def __init__(self, code: str, reason: str, status: Optional[int] = None):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+        self.status = status
+
+
+class MoonrakerHttpClient:
+    def __init__(
+        self,
+        base_url: str = MOONRAKER_URL,
+        read_timeout_s: float = MOONRAKER_READ_TIMEOUT_S,
+        endpoint_timeouts_s: Optional[Dict[str, float]] = None,
+        pool_size: int = MOONRAKER_POOL_SIZE,
+        cache_ttl_s: float = MOONRAKER_QUERY_CACHE_TTL_S,
+    ):
+        u = parse.urlsplit(base_url.rstrip("/"))
+        self.base_url = base_url.rstrip("/")
+        self._https = u.scheme == "https"
+        self._host = u.hostname or "localhost"
+        self._port = u.port or (443 if self._https else 80)
+        self._prefix = u.path.rstrip("/")
+
+        self.read_timeout_s = read_timeout_s
+        self.endpoint_timeouts_s = {**DEFAULT_ENDPOINT_TIMEOUTS_S, **(endpoint_timeouts_s or {})}
+        self.pool_size = pool_size
+        self.cache_ttl_s = cache_ttl_s
+
+        self._idle: list[http.client.HTTPConnection] = []
+        self._pool_lock = threading.Lock()
+        self._cache: Dict[str, tuple[float, dict]] = {}
+        self._cache_lock = threading.Lock()
+
+    # ---------- pool ----------
+
+    def _new_connection(self, timeout_s: float) -> http.client.HTTPConnection:
+        metrics.inc("moonraker_http_connects_total")
+        if self._https:
+            return http.client.HTTPSConnection(self._host, self._port, timeout=timeout_s)
+        return http.client.HTTPConnection(self._host, self._port, timeout=timeout_s)
+
+    def _acquire(self, timeout_s: float) -> tuple[http.client.HTTPConnection, bool]:
+        with self._pool_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return self._new_connection(timeout_s), False
+        conn.timeout = timeout_s
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout_s)
+        return conn, True
+
+    def _release(self, conn: http.client.HTTPConnection):
+        with self._pool_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    # ---------- cache ----------
+
+    def invalidate_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _cached(self, key: str) -> Optional[dict]:
+        with self._cache_lock:
+            hit = self._cache.get(key)
+            if hit is None:
+                return None
+            if time.monotonic() - hit[0] > self.cache_ttl_s:
+                self._cache.pop(key, None)
+                return None
+            return hit[1]
+
+    # ---------- requests ----------
+
+    def timeout_for(self, path: str) -> float:
+        return self.endpoint_timeouts_s.get(path.split("?", 1)[0], self.read_timeout_s)
+
+    def _roundtrip(self, method: str, path: str, body: Optional[bytes], timeout_s: float) -> tuple[int, bytes]:
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            conn, reused = self._acquire(timeout_s)
+            sent = False
+            try:
+                conn.request(method, f"{self._prefix}{path}", body=body, headers=headers)
+                sent = True
+                resp = conn.getresponse()
+                raw = resp.read()
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                # A gcode script that was delivered must not run twice.
+                if reused and attempt == 0 and (method == "GET" or not sent):
+                    metrics.inc("moonraker_http_stale_retries_total")
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return resp.status, raw
+        raise ConnectionError("unreachable")  # pragma: no cover
+
+    def request(self, method: str, path: str, payload: Optional[dict] = None, timeout_s: Optional[float] = None) -> dict:
+        endpoint = path.split("?", 1)[0]
+        cacheable = method == "GET" and endpoint in CACHEABLE_PATHS and self.cache_ttl_s > 0
+        if cacheable:
+            hit = self._cached(path)
+            if hit is not None:
+                metrics.inc("moonraker_query_cache_hits_total")
+                return hit
+        elif method != "GET":
+            self.invalidate_cache()
+
+        timeout_s = self.timeout_for(path) if timeout_s is None else timeout_s
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        started = time.monotonic()
+        try:
+            status, raw = self._roundtrip(method, path, body, timeout_s)
+        except (socket.timeout, TimeoutError) as e:
+            metrics.inc(f"moonraker_http_errors_total:{endpoint}")
+            raise MoonrakerError("KLIPPER_TIMEOUT", f"Moonraker timeout after {timeout_s:.1f}s: {e}")
+        except (OSError, http.client.HTTPException) as e:
+            metrics.inc(f"moonraker_http_errors_total:{endpoint}")
+            raise MoonrakerError("KLIPPER_NOT_RESPONDING", f"Moonraker unreachable: {e}")
+        finally:
+            metrics.observe(f"moonraker_http_ms:{endpoint}", (time.monotonic() - started) * 1000.0)
+
+        text = raw.decode("utf-8", errors="replace")
+        if status >= 400:
+            metrics.inc(f"moonraker_http_errors_total:{endpoint}")
+            raise MoonrakerError("MOONRAKER_HTTP_ERROR", f"HTTP {status}: {text}", status=status)
+        try:
+            out = json.loads(text) if text else {}
+        except ValueError as e:
+            raise MoonrakerError("MOONRAKER_ERROR", f"Moonraker returned invalid JSON: {e}")
+
+        if cacheable:
+            with self._cache_lock:
+                self._cache[path] = (time.monotonic(), out)
+        return out
+
+    def get(self, path: str, timeout_s: Optional[float] = None) -> dict:
+        return self.request("GET", path, timeout_s=timeout_s)
+
+    def post(self, path: str, payload: Optional[dict] = None, timeout_s: Optional[float] = None) -> dict:
+        return self.request("POST", path, payload if payload is not None else {}, timeout_s=timeout_s)
+
+    def query_objects(self, objects: Dict[str, str]) -> dict:
+        return self.get(f"/printer/objects/query?{parse.urlencode(objects)}")
+
+
+_shared: Dict[str, MoonrakerHttpClient] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_client(base_url: str = MOONRAKER_URL) -> MoonrakerHttpClient:
+    """One pooled client per Moonraker URL for the whole process."""
+    key = base_url.rstrip("/")
+    with _shared_lock:
+        client = _shared.get(key)
+        if client is None:
+            client = _shared[key] = MoonrakerHttpClient(key)
+        return client
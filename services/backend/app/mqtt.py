@@ -2,19 +2,37 @@ from __future__ import annotations
 
 import json
 import os
+import queue
+import re
+import threading
 import time
+import zlib
 from datetime import datetime, timedelta
 
 import paho.mqtt.client as mqtt
 from sqlalchemy import select
 
-from .utils import with_db, mqtt_topic, dispatch_mqtt
+from .utils import with_db, mqtt_topic, dispatch_mqtt, unit_of_work, commit_or_flush, after_commit
 from . import models
-from .motor_test_store import set_motor_test_status
-from .usecases.user_flow import build_hw_payload, set_cake_current_slot, parse_slot_index
+from .cake_state import cake_state
+from .command_tracker import command_tracker, status_patch
+from .entity_cache import entity_cache
+from .machine_status import status_collector
+from .event_stream import stream as event_stream
+from .metrics import metrics
+from .usecases.user_flow import BATCH_ORDER, build_hw_payload, set_cake_current_slot, parse_slot_index
 
 MQTT_HOST = os.getenv("MQTT_HOST", "mqtt")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_OUTBOX_MAX = int(os.getenv("MQTT_OUTBOX_MAX", "1000"))
+MQTT_ACK_TIMEOUT_S = float(os.getenv("MQTT_ACK_TIMEOUT_S", "10"))
+MQTT_REPLY_MAX_WAIT_S = float(os.getenv("MQTT_REPLY_MAX_WAIT_S", "25"))
+MQTT_WORKERS = int(os.getenv("MQTT_WORKERS", "4"))
+MQTT_INBOX_MAX = int(os.getenv("MQTT_INBOX_MAX", "256"))  # per worker
+# One transaction per inbound message (audit event + state changes) instead of a commit per step.
+MQTT_UNIT_OF_WORK = os.getenv("MQTT_UNIT_OF_WORK", "1").strip().lower() not in {"0", "false", "no", "off"}
+# Ask the bridge to pre-rotate the next dispense's cake while the current item waits at the door.
+DISPENSE_PREFETCH = os.getenv("DISPENSE_PREFETCH", "1").strip().lower() not in {"0", "false", "no", "off"}
 
 SUB_TOPICS = [
     "igen/evt/dispense",
@@ -30,6 +48,7 @@ SUB_TOPICS = [
     "igen/evt/admin/machine",
     "igen/evt/admin/calibration",
     "igen/evt/hardware/wait",
+    "igen/evt/prefetch",
 ]
 
 
@@ -37,13 +56,18 @@ def _now() -> datetime:
     return datetime.now()
     
 def _clear_tool_from_live_slots(db, tool_item_id: str):
-    rows = db.execute(
-        select(models.CakeSlotState).where(models.CakeSlotState.tool_item_id == tool_item_id)
-    ).scalars().all()
-    for row in rows:
-        row.tool_item_id = None
+    cake_state.clear_tool(db, tool_item_id)
+
+_ACTIVE_BUS: "MqttBus | None" = None
+
+
+def _publish(topic: str, payload: dict, qos: int = 1, *, on_ack=None):
+    # Prefer the long-lived bus connection; fall back to a one-shot client
+    # (scripts, tests, or before the bus has started).
+    bus = _ACTIVE_BUS
+    if bus is not None and bus.is_running():
+        return bus.publish(topic, payload, qos=qos, on_ack=on_ack)
 
-def _publish(topic: str, payload: dict, qos: int = 1):
     c = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     c.connect(MQTT_HOST, MQTT_PORT, 60)
     c.loop_start()
@@ -53,29 +77,243 @@ def _publish(topic: str, payload: dict, qos: int = 1):
     finally:
         c.loop_stop()
         c.disconnect()
+    if on_ack is not None:
+        on_ack(None)
 
 
-def _release_next_request_in_batch(db, batch_id: str, request_type: str, finished_request_id: str):
+def _next_pending_in_batch(db, batch_id: str, after_request_id: str) -> models.LoanRequest | None:
     rows = db.execute(
         select(models.LoanRequest)
         .where(models.LoanRequest.batch_id == batch_id)
-        .order_by(models.LoanRequest.created_at.asc(), models.LoanRequest.request_id.asc())
+        .order_by(*BATCH_ORDER)
     ).scalars().all()
-    if not rows:
-        return
 
-    finished_seen = False
+    seen = False
     for row in rows:
-        if row.request_id == finished_request_id:
-            finished_seen = True
+        if row.request_id == after_request_id:
+            seen = True
             continue
-        if not finished_seen:
-            continue
-        if row.hw_status == "pending":
-            payload = build_hw_payload(db, row.request_id)
-            topic = "igen/cmd/dispense" if request_type == "dispense" else "igen/cmd/return"
-            _publish(topic, payload, qos=1)
+        if seen and row.hw_status == "pending":
+            return row
+    return None
+
+
+def _release_next_request_in_batch(db, batch_id: str, request_type: str, finished_request_id: str, *, finished_at: float | None = None):
+    row = _next_pending_in_batch(db, batch_id, finished_request_id)
+    if row is None:
+        return
+
+    payload = build_hw_payload(db, row.request_id)
+    topic = "igen/cmd/dispense" if request_type == "dispense" else "igen/cmd/return"
+    on_ack = None
+    if finished_at is not None:
+        def on_ack(_pending, _t0=finished_at):
+            metrics.observe("batch_release_latency_ms", (time.monotonic() - _t0) * 1000.0)
+    after_commit(db, lambda: _publish(topic, payload, qos=1, on_ack=on_ack))
+
+
+def _prefetch_next_request_in_batch(db, req: models.LoanRequest):
+    row = _next_pending_in_batch(db, req.batch_id, req.request_id)
+    if row is None or row.request_type != "dispense":
+        return
+    payload = build_hw_payload(db, row.request_id)
+    payload["after_request_id"] = req.request_id
+    after_commit(db, lambda: _publish("igen/cmd/prefetch", payload, qos=1))
+
+
+class PendingPublish:
+    """One queued outbound message; `wait()` blocks until the broker acknowledges it."""
+
+    def __init__(self, topic: str, payload: dict, qos: int, on_ack=None):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.on_ack = on_ack
+        self.mid: int | None = None
+        self.enqueued_at = time.monotonic()
+        self.sent_at: float | None = None
+        self.acked_at: float | None = None
+        self.error: str | None = None
+        self._done = threading.Event()
+
+    @property
+    def acked(self) -> bool:
+        return self.acked_at is not None
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout) and self.error is None
+
+    def _finish(self, error: str | None = None):
+        if self._done.is_set():
+            return
+        self.error = error
+        if error is None:
+            self.acked_at = time.monotonic()
+        self._done.set()
+        if self.on_ack is not None and error is None:
+            try:
+                self.on_ack(self)
+            except Exception as e:
+                print(f"[MQTT] on_ack callback failed: {e}")
+
+
+class PendingReply:
+    """Waiter for the terminal stage event carrying one request_id on one topic."""
+
+    def __init__(self, request_id: str, topic: str):
+        self.request_id = request_id
+        self.topic = topic
+        self.payload: dict | None = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: float | None = None) -> dict | None:
+        self._done.wait(timeout)
+        return self.payload
+
+    def _finish(self, payload: dict | None):
+        if self._done.is_set():
+            return
+        self.payload = payload
+        self._done.set()
+
+
+class ReplyCorrelator:
+    """
+    Matches inbound bridge events to commands a caller is waiting on.
+
+    A waiter is registered before its command is published, so a fast reply
+    cannot slip past it. resolve() runs on paho's network thread before the
+    message is queued for the DB handlers: the caller is woken as soon as the
+    succeeded/failed event arrives, not after its audit row commits.
+    """
+
+    TERMINAL_STAGES = {"succeeded", "failed"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: dict[str, PendingReply] = {}
+
+    def expect(self, request_id: str, topic: str) -> PendingReply:
+        reply = PendingReply(request_id, topic)
+        with self._lock:
+            self._waiters[request_id] = reply
+            metrics.set_gauge("mqtt_reply_waiters", len(self._waiters))
+        return reply
+
+    def discard(self, reply: PendingReply):
+        with self._lock:
+            if self._waiters.get(reply.request_id) is reply:
+                del self._waiters[reply.request_id]
+            metrics.set_gauge("mqtt_reply_waiters", len(self._waiters))
+
+    def resolve(self, topic: str, payload: dict) -> bool:
+        request_id = payload.get("request_id")
+        if not request_id or payload.get("stage") not in self.TERMINAL_STAGES:
+            return False
+        with self._lock:
+            reply = self._waiters.get(request_id)
+            if reply is None or reply.topic != topic:
+                return False
+            del self._waiters[request_id]
+            metrics.set_gauge("mqtt_reply_waiters", len(self._waiters))
+        reply._finish(payload)
+        return True
+
+    def cancel_all(self):
+        with self._lock:
+            waiters, self._waiters = list(self._waiters.values()), {}
+            metrics.set_gauge("mqtt_reply_waiters", 0)
+        for reply in waiters:
+            reply._finish(None)
+
+
+_ITEM_SUFFIX_RE = re.compile(r"_item_\d+$")
+
+
+def _ordering_key(topic: str, payload: dict) -> str:
+    """
+    Messages sharing a key are handled in arrival order on one worker.
+    Batch items share their batch (request ids are "<batch_id>_item_<n>");
+    anything without ids is ordered per topic.
+    """
+    batch_id = payload.get("batch_id")
+    if batch_id:
+        return str(batch_id)
+    request_id = payload.get("request_id")
+    if request_id:
+        return _ITEM_SUFFIX_RE.sub("", str(request_id))
+    return topic
+
+
+class InboundWorkerPool:
+    """
+    Runs inbound MQTT handlers off paho's network thread.
+
+    One bounded queue per worker; a message is routed by hashing its ordering
+    key, so related messages stay in order while unrelated ones run in
+    parallel. A full queue blocks the caller (backpressure onto the broker
+    connection) rather than dropping hardware events.
+    """
+
+    def __init__(self, handler, workers: int = MQTT_WORKERS, maxsize: int = MQTT_INBOX_MAX):
+        self._handler = handler
+        self._queues: list[queue.Queue] = [queue.Queue(maxsize=maxsize) for _ in range(max(1, workers))]
+        self._threads: list[threading.Thread] = []
+        self._running = False
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for idx, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"mqtt-worker-{idx}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        if not self._running:
             return
+        self._running = False
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, topic: str, payload: dict):
+        key = _ordering_key(topic, payload)
+        q = self._queues[zlib.crc32(key.encode("utf-8")) % len(self._queues)]
+        item = (topic, payload, time.monotonic())
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            metrics.inc("mqtt_inbox_full_total")
+            print(f"[MQTT] inbound queue full, blocking topic={topic} key={key}")
+            q.put(item)
+        metrics.set_gauge("mqtt_inbox_depth", self.depth())
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            topic, payload, enqueued_at = item
+            started = time.monotonic()
+            metrics.observe("mqtt_inbox_wait_ms", (started - enqueued_at) * 1000.0)
+            try:
+                self._handler(topic, payload)
+            except Exception as e:
+                metrics.inc("mqtt_handler_errors_total")
+                print(f"[MQTT] handler failed topic={topic}: {e}")
+            finally:
+                metrics.observe(f"mqtt_handler_ms:{topic}", (time.monotonic() - started) * 1000.0)
+                metrics.set_gauge("mqtt_inbox_depth", self.depth())
 
 
 class MqttBus:
@@ -83,6 +321,21 @@ class MqttBus:
         self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
+        self._client.on_publish = self._on_publish
+
+        # Outbound queue drained by a single publisher thread; in-flight
+        # messages are tracked by mid until the broker acks them. _ack_lock is
+        # never held across a paho call: paho's network thread fires on_publish
+        # while holding its own message mutex, which publish() also takes.
+        self._outbox: "queue.Queue[PendingPublish | None]" = queue.Queue(maxsize=MQTT_OUTBOX_MAX)
+        self._inflight: dict[int, PendingPublish] = {}
+        # mid -> monotonic time of an ack that arrived before its message was registered.
+        self._early_acks: dict[int, float] = {}
+        self._ack_lock = threading.Lock()
+        self._publisher: threading.Thread | None = None
+        self._running = False
+        self._inbound = InboundWorkerPool(lambda topic, payload: _handle_mqtt_message(topic, payload))
+        self._replies = ReplyCorrelator()
 
     def _on_connect(self, client, userdata, flags, reason_code, properties=None):
         if reason_code == 0:
@@ -99,13 +352,92 @@ class MqttBus:
             payload = json.loads(raw)
         except Exception:
             payload = {"raw": raw}
-        _handle_mqtt_message(topic, payload)
+        if isinstance(payload, dict):
+            self._replies.resolve(topic, payload)
+        if self._inbound.is_running():
+            self._inbound.submit(topic, payload)
+        else:
+            _handle_mqtt_message(topic, payload)
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        with self._ack_lock:
+            pending = self._inflight.pop(mid, None)
+            if pending is None:
+                # Ack raced ahead of registration in _publisher_loop (or belongs to
+                # an expired message; its timestamp then predates any reuse of mid).
+                self._early_acks[mid] = time.monotonic()
+                return
+        self._complete(pending)
+
+    def _complete(self, pending: PendingPublish, error: str | None = None):
+        pending._finish(error)
+        if error is None:
+            metrics.inc("mqtt_publish_acked_total")
+            metrics.observe("mqtt_publish_ack_ms", (pending.acked_at - pending.enqueued_at) * 1000.0)
+        else:
+            metrics.inc("mqtt_publish_failed_total")
+        metrics.set_gauge("mqtt_inflight", len(self._inflight))
+
+    def _publisher_loop(self):
+        while True:
+            try:
+                pending = self._outbox.get(timeout=1.0)
+            except queue.Empty:
+                if not self._running:
+                    return
+                self._expire_inflight()
+                continue
+            metrics.set_gauge("mqtt_outbox_depth", self._outbox.qsize())
+            if pending is None:
+                return
+            try:
+                sent_at = time.monotonic()
+                info = self._client.publish(pending.topic, json.dumps(pending.payload), qos=pending.qos)
+                with self._ack_lock:
+                    pending.mid = info.mid
+                    pending.sent_at = sent_at
+                    # QoS 0 has no PUBACK; paho fires on_publish once written.
+                    early = self._early_acks.pop(info.mid, None)
+                    acked_now = early is not None and early >= sent_at
+                    if not acked_now:
+                        self._inflight[info.mid] = pending
+                # Not connected: paho keeps QoS>0 messages and resends on reconnect.
+                if info.rc != mqtt.MQTT_ERR_SUCCESS and (info.rc != mqtt.MQTT_ERR_NO_CONN or pending.qos == 0):
+                    with self._ack_lock:
+                        self._inflight.pop(info.mid, None)
+                    self._complete(pending, error=mqtt.error_string(info.rc))
+                elif acked_now:
+                    self._complete(pending)
+                metrics.set_gauge("mqtt_inflight", len(self._inflight))
+            except Exception as e:
+                print(f"[MQTT] publish failed topic={pending.topic}: {e}")
+                self._complete(pending, error=str(e))
+
+    def _expire_inflight(self):
+        now = time.monotonic()
+        with self._ack_lock:
+            stale = [mid for mid, p in self._inflight.items() if p.sent_at and now - p.sent_at > MQTT_ACK_TIMEOUT_S]
+            expired = [self._inflight.pop(mid) for mid in stale]
+            for mid in [m for m, at in self._early_acks.items() if now - at > MQTT_ACK_TIMEOUT_S]:
+                del self._early_acks[mid]
+        for pending in expired:
+            print(f"[MQTT] no ack for topic={pending.topic} mid={pending.mid}")
+            self._complete(pending, error="ack_timeout")
+
+    def is_running(self) -> bool:
+        return self._running
 
     def start(self):
+        global _ACTIVE_BUS
+        self._inbound.start()
         for i in range(10):
             try:
                 self._client.connect(MQTT_HOST, MQTT_PORT)
                 self._client.loop_start()
+                self._running = True
+                self._publisher = threading.Thread(target=self._publisher_loop, name="mqtt-publisher", daemon=True)
+                self._publisher.start()
+                _ACTIVE_BUS = self
                 print("[MQTT] loop started")
                 return
             except Exception as e:
@@ -114,42 +446,96 @@ class MqttBus:
         print("[MQTT] failed to start")
 
     def stop(self):
+        global _ACTIVE_BUS
+        if _ACTIVE_BUS is self:
+            _ACTIVE_BUS = None
+        self._running = False
+        self._replies.cancel_all()
+        if self._publisher is not None:
+            try:
+                self._outbox.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+            self._publisher.join(timeout=5)
+            self._publisher = None
         try:
             self._client.loop_stop()
             self._client.disconnect()
         except Exception:
             pass
-
-    def publish(self, topic: str, payload: dict, qos: int = 1):
-        self._client.publish(topic, json.dumps(payload), qos=qos)
+        self._inbound.stop()
+
+    def publish(self, topic: str, payload: dict, qos: int = 1, *, on_ack=None) -> PendingPublish:
+        """Queue a message for the publisher thread. Blocks only if the outbox is full."""
+        pending = PendingPublish(topic, payload, qos, on_ack=on_ack)
+        if not self._running:
+            # Bus never started (or failed to): keep the old direct behaviour.
+            self._client.publish(topic, json.dumps(payload), qos=qos)
+            pending._finish("bus_not_running")
+            return pending
+        self._outbox.put(pending)
+        metrics.inc("mqtt_publish_total")
+        metrics.set_gauge("mqtt_outbox_depth", self._outbox.qsize())
+        return pending
+
+    def request(self, topic: str, payload: dict, *, reply_topic: str, timeout_s: float, qos: int = 1) -> dict | None:
+        """
+        Publish a command and block until the succeeded/failed event for its
+        request_id arrives on reply_topic. Returns that event's payload, or
+        None if none came within timeout_s (capped at MQTT_REPLY_MAX_WAIT_S).
+        """
+        reply = self._replies.expect(payload["request_id"], reply_topic)
+        started = time.monotonic()
+        try:
+            self.publish(topic, payload, qos=qos)
+            out = reply.wait(min(timeout_s, MQTT_REPLY_MAX_WAIT_S))
+        finally:
+            self._replies.discard(reply)
+        if out is None:
+            metrics.inc("mqtt_reply_timeouts_total")
+        else:
+            metrics.observe(f"mqtt_reply_ms:{reply_topic}", (time.monotonic() - started) * 1000.0)
+        return out
 
 
-@with_db
-def _handle_mqtt_message(db, topic: str, payload: dict):
-    db.add(models.Event(
+def _mqtt_audit_event(topic: str, payload: dict) -> models.Event:
+    return models.Event(
         event_type=f"mqtt:{topic}",
         request_id=payload.get("request_id"),
         tool_item_id=payload.get("tool_item_id"),
         payload_json=json.dumps(payload),
-    ))
-    db.commit()
-    dispatch_mqtt(db, topic, payload)
+    )
+
+
+@with_db
+def _handle_mqtt_message(db, topic: str, payload: dict):
+    if not MQTT_UNIT_OF_WORK:
+        db.add(_mqtt_audit_event(topic, payload))
+        db.commit()
+        dispatch_mqtt(db, topic, payload)
+        return
+
+    try:
+        with unit_of_work(db):
+            db.add(_mqtt_audit_event(topic, payload))
+            dispatch_mqtt(db, topic, payload)
+    except Exception:
+        # Handler changes are rolled back; the audit row is still kept.
+        db.add(_mqtt_audit_event(topic, payload))
+        db.commit()
+        raise
 
 
 @mqtt_topic("igen/evt/admin_test/motor")
-def handle_evt_admin_test_motor(db, payload: dict):
+@mqtt_topic("igen/evt/admin/manual")
+@mqtt_topic("igen/evt/admin/machine")
+@mqtt_topic("igen/evt/admin/calibration")
+def handle_evt_admin_command(db, payload: dict):
     request_id = payload.get("request_id")
-    stage = payload.get("stage")
-    if not request_id or not stage:
+    if not request_id or not payload.get("stage"):
         return
-    set_motor_test_status(request_id, {
-        "request_id": request_id,
-        "stage": stage,
-        "motor_id": payload.get("motor_id"),
-        "action": payload.get("action"),
-        "error_code": payload.get("error_code"),
-        "error_reason": payload.get("error_reason"),
-    })
+    patch = status_patch(payload)
+    after_commit(db, lambda: command_tracker.update(request_id, patch))
 
 
 def _set_request_status(req: models.LoanRequest, payload: dict):
@@ -171,6 +557,7 @@ def _set_request_status(req: models.LoanRequest, payload: dict):
 
 @mqtt_topic("igen/evt/dispense")
 def handle_evt_dispense(db, payload: dict):
+    received_at = time.monotonic()
     request_id = payload.get("request_id")
     stage = payload.get("stage")
     if not request_id or not stage:
@@ -181,10 +568,10 @@ def handle_evt_dispense(db, payload: dict):
         return
 
     _set_request_status(req, payload)
-    db.commit()
+    commit_or_flush(db)
 
     if stage == "succeeded":
-        tool = db.get(models.ToolItem, req.tool_item_id)
+        tool = entity_cache.tool_item(db, req.tool_item_id)
         if tool:
             slot = parse_slot_index(req.slot_id)
             final_slot = int(payload.get("final_current_slot", slot))
@@ -193,7 +580,7 @@ def handle_evt_dispense(db, payload: dict):
             _clear_tool_from_live_slots(db, req.tool_item_id)
 
             set_cake_current_slot(db, tool.cake_id, final_slot)
-            db.commit()
+            commit_or_flush(db)
 
         existing_loan = db.execute(
             select(models.Loan).where(
@@ -225,14 +612,18 @@ def handle_evt_dispense(db, payload: dict):
                 tool_item_id=req.tool_item_id,
                 payload_json=json.dumps({"reason": "dispensed_ok_requires_confirm"}),
             ))
-            db.commit()
+            commit_or_flush(db)
+
+    if stage == "waiting_user_confirm" and DISPENSE_PREFETCH:
+        _prefetch_next_request_in_batch(db, req)
 
     if stage in {"succeeded", "failed"}:
-        _release_next_request_in_batch(db, req.batch_id, "dispense", req.request_id)
+        _release_next_request_in_batch(db, req.batch_id, "dispense", req.request_id, finished_at=received_at)
 
 
 @mqtt_topic("igen/evt/return")
 def handle_evt_return(db, payload: dict):
+    received_at = time.monotonic()
     request_id = payload.get("request_id")
     stage = payload.get("stage")
     if not request_id or not stage:
@@ -243,10 +634,10 @@ def handle_evt_return(db, payload: dict):
         return
 
     _set_request_status(req, payload)
-    db.commit()
+    commit_or_flush(db)
 
     if stage == "succeeded":
-        tool = db.get(models.ToolItem, req.tool_item_id)
+        tool = entity_cache.tool_item(db, req.tool_item_id)
         if tool:
             slot = parse_slot_index(req.slot_id)
             final_slot = int(payload.get("final_current_slot", slot))
@@ -258,18 +649,10 @@ def handle_evt_return(db, payload: dict):
 
             _clear_tool_from_live_slots(db, req.tool_item_id)
 
-            state = db.get(models.CakeSlotState, {"cake_id": tool.cake_id, "slot_index": slot})
-            if state is None:
-                state = models.CakeSlotState(
-                    cake_id=tool.cake_id,
-                    slot_index=slot,
-                    tool_item_id=req.tool_item_id,
-                )
-                db.add(state)
-            state.tool_item_id = req.tool_item_id
+            cake_state.set_slot(db, tool.cake_id, slot, req.tool_item_id)
 
             set_cake_current_slot(db, tool.cake_id, final_slot)
-            db.commit()
+            commit_or_flush(db)
 
         loan = db.execute(
             select(models.Loan).where(
@@ -289,10 +672,25 @@ def handle_evt_return(db, payload: dict):
                 tool_item_id=req.tool_item_id,
                 payload_json="{}",
             ))
-            db.commit()
+            commit_or_flush(db)
 
     if stage in {"succeeded", "failed"}:
-        _release_next_request_in_batch(db, req.batch_id, "return", req.request_id)
+        _release_next_request_in_batch(db, req.batch_id, "return", req.request_id, finished_at=received_at)
+
+@mqtt_topic("igen/evt/prefetch")
+def handle_evt_prefetch(db, payload: dict):
+    # The bridge turned the next request's cake ahead of time; track where it is now
+    # so that request (and anything else on the cake) is planned from there.
+    if payload.get("stage") != "succeeded" or payload.get("final_current_slot") is None:
+        return
+    req = db.get(models.LoanRequest, payload.get("request_id"))
+    if not req:
+        return
+    tool = entity_cache.tool_item(db, req.tool_item_id)
+    if tool:
+        set_cake_current_slot(db, tool.cake_id, int(payload["final_current_slot"]))
+        commit_or_flush(db)
+
 
 @mqtt_topic("igen/evt/rfid/card_scan")
 def handle_evt_card_scan(db, payload: dict):
@@ -306,3 +704,14 @@ def handle_evt_tool_scan(db, payload: dict):
     reader_id = payload.get("reader_id")
     from .routers.rfid import _rfid_set
     _rfid_set(reader_id, "tool", payload)
+
+
+@mqtt_topic("igen/evt/machine/status")
+def handle_evt_machine_status(db, payload: dict):
+    after_commit(db, lambda: status_collector.update_from_mqtt(payload))
+    after_commit(db, lambda: event_stream.publish("machine_status", payload))
+
+
+@mqtt_topic("igen/evt/machine/alert")
+def handle_evt_machine_alert(db, payload: dict):
+    after_commit(db, lambda: event_stream.publish("machine_alert", payload))
@@ -1,30 +1,34 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, Request, Body
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response, Body
+from fastapi.responses import StreamingResponse
 from sqlalchemy import text, select
-from sqlalchemy.orm import Session
-from .deps import get_db, get_mqtt, require_admin
+from sqlalchemy.orm import Session, sessionmaker
+from .deps import get_db, get_read_db, get_read_session_factory, get_mqtt, require_admin
 from .. import schemas
 from .. import models
 from ..usecases import admin_crud as uc
+from ..availability import availability
+from ..cake_state import cake_state
+from ..entity_cache import entity_cache
+from ..metrics import metrics
+from ..machine_status import status_collector
 from ..usecases.user_flow import get_cake_overview, get_cake_current_slot, set_cake_current_slot, normalize_slot
 from ..mqtt import MqttBus
+import csv
+import io
 import uuid
 from datetime import timedelta, datetime
 import json
 import os
 import shutil
 from pathlib import Path
-from urllib import error as urlerror, request as urlrequest
 
-from ..motor_test_store import set_motor_test_status, get_motor_test_status
-from ..cake_cmd_store import set_cake_cmd_status, get_cake_cmd_status
+from ..command_tracker import command_tracker
 from ..services.email_service import send_email, send_template, list_templates
+from ..services.event_retention import EventRetentionService, naive_utc
 
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-MOONRAKER_URL = os.getenv("MOONRAKER_URL", "http://host.docker.internal:7125").rstrip("/")
-
-
 KLIPPER_CONFIG_DIR = Path(os.getenv("KLIPPER_CONFIG_DIR", "/klipper-config"))
 KLIPPER_VARS_FILE = Path(os.getenv("KLIPPER_VARS_FILE", str(KLIPPER_CONFIG_DIR / "vars.cfg")))
 KLIPPER_STEPPERS_FILE = Path(os.getenv("KLIPPER_STEPPERS_FILE", str(KLIPPER_CONFIG_DIR / "steppers.cfg")))
@@ -57,6 +61,35 @@ def _publish_admin_command(
     db: Session | None = None,
 ):
     mqtt = _mqtt_or_503(request)
+    _record_admin_command(payload, event_type, db)
+    mqtt.publish(topic, payload, qos=1)
+    return payload
+
+
+def _request_admin_command(
+    request: Request,
+    *,
+    topic: str,
+    reply_topic: str,
+    payload: dict,
+    event_type: str,
+    db: Session,
+    wait_s: float,
+) -> dict | None:
+    """Like _publish_admin_command, but waits for the bridge's succeeded/failed event and returns it (None on timeout)."""
+    mqtt = _mqtt_or_503(request)
+    _record_admin_command(payload, event_type, db)
+    return mqtt.request(topic, payload, reply_topic=reply_topic, timeout_s=wait_s)
+
+
+def _record_admin_command(payload: dict, event_type: str, db: Session | None):
+    command_tracker.update(payload["request_id"], {
+        "action": payload.get("action"),
+        "cake_id": payload.get("cake_id"),
+        "stage": "queued",
+        "error_code": None,
+        "error_reason": None,
+    })
     if db is not None:
         uc.log_event(
             db,
@@ -68,27 +101,6 @@ def _publish_admin_command(
             payload=payload,
         )
         db.commit()
-    mqtt.publish(topic, payload, qos=1)
-    return payload
-
-
-def _latest_event_payload(db: Session, event_type: str) -> dict | None:
-    row = (
-        db.execute(
-            select(models.Event)
-            .where(models.Event.event_type == event_type)
-            .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
-            .limit(1)
-        )
-        .scalars()
-        .first()
-    )
-    if not row:
-        return None
-    try:
-        return json.loads(row.payload_json or "{}")
-    except Exception:
-        return None
 
 
 def _resolve_cake_key(db: Session, cake_num: int) -> str:
@@ -98,7 +110,7 @@ def _resolve_cake_key(db: Session, cake_num: int) -> str:
     ]
 
     for key in candidates:
-        if db.get(models.CakeState, key) is not None:
+        if cake_state.current_slot(db, key) is not None:
             return key
 
     row = (
@@ -115,71 +127,6 @@ def _resolve_cake_key(db: Session, cake_num: int) -> str:
     return f"cake_{cake_num}"
 
 
-def _moonraker_json(method: str, path: str, payload: dict | None = None, timeout: float = 3.0) -> dict:
-    url = f"{MOONRAKER_URL}{path}"
-    data = None
-    headers = {"Content-Type": "application/json"}
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-    req = urlrequest.Request(url=url, data=data, headers=headers, method=method)
-    try:
-        with urlrequest.urlopen(req, timeout=timeout) as resp:
-            raw = resp.read().decode("utf-8")
-            return json.loads(raw) if raw else {}
-    except Exception:
-        return {}
-
-
-def _direct_machine_status() -> dict | None:
-    q = "toolhead=homed_axes,position&idle_timeout=state&print_stats=state,message"
-    out = _moonraker_json("GET", f"/printer/objects/query?{q}")
-    status = (out.get("result") or {}).get("status") or {}
-    if not status:
-        return None
-    toolhead = status.get("toolhead") or {}
-    idle_timeout = status.get("idle_timeout") or {}
-    print_stats = status.get("print_stats") or {}
-    homed_axes = str(toolhead.get("homed_axes") or "")
-    pos = toolhead.get("position") or []
-    x = pos[0] if len(pos) > 0 else None
-    y = pos[1] if len(pos) > 1 else None
-    z = pos[2] if len(pos) > 2 else None
-    return {
-        "ok": True,
-        "reachable": True,
-        "state": print_stats.get("state") or idle_timeout.get("state") or "unknown",
-        "busy": str(idle_timeout.get("state") or "").lower() != "idle",
-        "homed": bool(homed_axes),
-        "homed_axes": homed_axes,
-        "horizontal_position": x,
-        "vertical_position": z,
-        "active_cake_id": None,
-        "position": pos,
-        "print_message": print_stats.get("message"),
-        "source": "moonraker_direct",
-    }
-
-
-def _coerce_manual_status(payload: dict | None) -> dict:
-    payload = payload or {}
-    pos = payload.get("position") or payload.get("machine", {}).get("position") or []
-    x = pos[0] if isinstance(pos, list) and len(pos) > 0 else payload.get("horizontal_position")
-    z = pos[2] if isinstance(pos, list) and len(pos) > 2 else payload.get("vertical_position")
-    return {
-        "ok": True,
-        "reachable": payload.get("reachable", False),
-        "state": payload.get("state") or payload.get("machine", {}).get("state") or "unknown",
-        "busy": payload.get("busy", False),
-        "homed": payload.get("homed", False),
-        "horizontal_position": x,
-        "vertical_position": z,
-        "active_cake_id": payload.get("active_cake_id"),
-        "position": pos if isinstance(pos, list) else [],
-        "error": payload.get("error"),
-        "source": payload.get("source", "mqtt_cache"),
-    }
-
-
 def _resolve_klipper_file(name: str) -> Path:
     path = ALLOWED_KLIPPER_FILES.get(name)
     if not path:
@@ -212,16 +159,61 @@ def _write_klipper_file_atomic(path: Path, content: str) -> None:
 
 
 
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _encode_export(pages, columns: list[str], fmt: str):
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        yield buf.getvalue()
+        for rows in pages:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows([_export_value(v) for v in row] for row in rows)
+            yield buf.getvalue()
+        return
+    for rows in pages:
+        yield "".join(
+            json.dumps({c: _export_value(v) for c, v in zip(columns, row)}) + "\n" for row in rows
+        )
+
+
+def _export_response(
+    session_factory: sessionmaker, open_pages, columns: list[str], fmt: str, name: str
+) -> StreamingResponse:
+    """
+    Stream keyset batches as NDJSON or CSV. The generator opens its own session
+    from session_factory, so nothing is queried until the client starts reading,
+    and only one batch of rows is in memory at a time.
+    """
+
+    def body():
+        db = session_factory()
+        try:
+            yield from _encode_export(open_pages(db), columns, fmt)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+
 # ------------ TEST ROUTES ------------
 
 @router.post("/test/motor", response_model=schemas.AdminMotorTestResp)
 def test_motor(body: schemas.AdminMotorTestReq, request: Request):
     request_id = uuid.uuid4().hex
 
-    set_motor_test_status(
+    command_tracker.update(
         request_id,
         {
-            "request_id": request_id,
             "motor_id": body.motor_id,
             "action": body.action,
             "stage": "queued",
@@ -232,7 +224,7 @@ def test_motor(body: schemas.AdminMotorTestReq, request: Request):
 
     mqtt = request.app.state.mqtt
     if not mqtt:
-        set_motor_test_status(
+        command_tracker.update(
             request_id,
             {"stage": "failed", "error_code": "MQTT_NOT_READY", "error_reason": "mqtt bus not ready"},
         )
@@ -250,18 +242,36 @@ def test_motor(body: schemas.AdminMotorTestReq, request: Request):
     return schemas.AdminMotorTestResp(request_id=request_id, motor_id=body.motor_id, action=body.action)
 
 
-@router.get("/test/motor/{request_id}/status", response_model=schemas.AdminMotorTestStatus)
-def test_motor_status(request_id: str):
-    st = get_motor_test_status(request_id)
+def _command_status(request_id: str, wait_s: float, stage: str | None) -> dict:
+    st = command_tracker.wait(request_id, wait_s, stage) if wait_s > 0 else command_tracker.get(request_id)
     if not st:
         raise HTTPException(status_code=404, detail="unknown request_id")
     return st
 
 
+@router.get("/test/motor/{request_id}/status", response_model=schemas.AdminMotorTestStatus)
+def test_motor_status(
+    request_id: str,
+    wait_s: float = Query(default=0, ge=0, le=30),
+    stage: str | None = Query(default=None),
+):
+    return _command_status(request_id, wait_s, stage)
+
+
+@router.get("/commands/{request_id}/status")
+def admin_command_status(
+    request_id: str,
+    wait_s: float = Query(default=0, ge=0, le=30),
+    stage: str | None = Query(default=None),
+):
+    """Any admin command's latest stage; wait_s long-polls until it leaves `stage` (or finishes)."""
+    return _command_status(request_id, wait_s, stage)
+
+
 # ---------------- USERS ----------------
 @router.get("/users", response_model=list[schemas.UserOut])
 def list_users(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     search: str | None = Query(default=None),
     role: str | None = Query(default=None),
     status: str | None = Query(default=None),
@@ -276,7 +286,7 @@ def create_user(body: schemas.AdminUserCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/users/{user_id}", response_model=schemas.UserOut)
-def get_user(user_id: str, db: Session = Depends(get_db)):
+def get_user(user_id: str, db: Session = Depends(get_read_db)):
     return uc.get_user(db, user_id)
 
 
@@ -293,7 +303,7 @@ def delete_user(user_id: str, db: Session = Depends(get_db)):
 # ---------------- TOOL MODELS ----------------
 @router.get("/tool-models", response_model=list[schemas.ToolModelOut])
 def list_tool_models(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     search: str | None = Query(default=None),
     category: str | None = Query(default=None),
     limit: int = Query(default=200, ge=1, le=1000),
@@ -307,7 +317,7 @@ def create_tool_model(body: schemas.AdminToolModelCreate, db: Session = Depends(
 
 
 @router.get("/tool-models/{tool_model_id}", response_model=schemas.ToolModelOut)
-def get_tool_model(tool_model_id: str, db: Session = Depends(get_db)):
+def get_tool_model(tool_model_id: str, db: Session = Depends(get_read_db)):
     return uc.get_tool_model(db, tool_model_id)
 
 
@@ -324,7 +334,7 @@ def delete_tool_model(tool_model_id: str, db: Session = Depends(get_db)):
 # ---------------- TOOL ITEMS ----------------
 @router.get("/tool-items", response_model=list[schemas.ToolItemOut])
 def list_tool_items(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     tool_model_id: str | None = Query(default=None),
     cake_id: str | None = Query(default=None),
     is_active: bool | None = Query(default=None),
@@ -340,7 +350,7 @@ def create_tool_item(body: schemas.AdminToolItemCreate, db: Session = Depends(ge
 
 
 @router.get("/tool-items/{tool_item_id}", response_model=schemas.ToolItemOut)
-def get_tool_item(tool_item_id: str, db: Session = Depends(get_db)):
+def get_tool_item(tool_item_id: str, db: Session = Depends(get_read_db)):
     return uc.get_tool_item(db, tool_item_id)
 
 
@@ -362,18 +372,42 @@ def drop_unconfirmed_tool_item(tool_item_id: str, db: Session = Depends(get_db))
 # ---------------- LOANS (admin) ----------------
 @router.get("/loans", response_model=list[schemas.LoanOut])
 def list_loans(
-    db: Session = Depends(get_db),
+    response: Response,
+    db: Session = Depends(get_read_db),
     active_only: bool = Query(default=False),
     overdue_only: bool = Query(default=False),
     user_id: str | None = Query(default=None),
     tool_item_id: str | None = Query(default=None),
     limit: int = Query(default=500, ge=1, le=5000),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor from the previous page"),
 ):
-    return uc.list_loans(db, active_only, overdue_only, user_id, tool_item_id, limit)
+    rows = uc.list_loans(db, active_only, overdue_only, user_id, tool_item_id, limit, cursor)
+    next_cursor = uc.next_cursor(rows, limit, "issued_at", "loan_id")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+@router.get("/loans/export")
+def export_loans(
+    active_only: bool = Query(default=False),
+    overdue_only: bool = Query(default=False),
+    user_id: str | None = Query(default=None),
+    tool_item_id: str | None = Query(default=None),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    session_factory: sessionmaker = Depends(get_read_session_factory),
+):
+    return _export_response(
+        session_factory,
+        lambda db: uc.iter_loan_pages(db, active_only, overdue_only, user_id, tool_item_id),
+        [c.key for c in uc.LOAN_COLUMNS],
+        format,
+        "loans",
+    )
 
 
 @router.get("/loans/{loan_id}", response_model=schemas.LoanOut)
-def get_loan(loan_id: str, db: Session = Depends(get_db)):
+def get_loan(loan_id: str, db: Session = Depends(get_read_db)):
     return uc.get_loan(db, loan_id)
 
 
@@ -400,87 +434,116 @@ def extend_loan(loan_id: str, req: schemas.AdminExtendLoanReq, db: Session = Dep
     return {"ok": True, "loan_id": loan_id, "due_at": loan.due_at.isoformat() + "Z"}
 
 
-@router.get("/cakes/{cake_id}/eeprom")
-def read_cake_eeprom(cake_id: int, db: Session = Depends(get_db)):
-    row = (
-        db.execute(
-            select(models.Event)
-            .where(models.Event.event_type == "mqtt:igen/evt/admin/calibration")
-            .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
-        )
-        .scalars()
-        .all()
-    )
-
-    for ev in row:
-        try:
-            payload = json.loads(ev.payload_json or "{}")
-        except Exception:
-            continue
-
-        if payload.get("action") == "encoder_read_eeprom" and int(payload.get("cake_id", -1)) == cake_id:
-            return {
-                "ok": payload.get("stage") == "succeeded",
-                "cake_id": cake_id,
-                "stage": payload.get("stage"),
-                "request_id": payload.get("request_id"),
-                "error_code": payload.get("error_code"),
-                "error_reason": payload.get("error_reason"),
-                "eeprom": payload.get("eeprom"),
-            }
-
-    return {"ok": False, "cake_id": cake_id, "eeprom": None, "detail": "no_eeprom_read_yet"}
+def _calibration_result(cake_id: int, stage: str | None, payload: dict, field: str) -> dict:
+    return {
+        "ok": stage == "succeeded",
+        "cake_id": cake_id,
+        "stage": stage,
+        "request_id": payload.get("request_id"),
+        "error_code": payload.get("error_code"),
+        "error_reason": payload.get("error_reason"),
+        field: payload.get(field),
+    }
 
 
-@router.post("/cakes/{cake_id}/read-angle")
-def queue_cake_read_angle(cake_id: int, request: Request, db: Session = Depends(get_db)):
+def _queue_calibration_read(
+    request: Request,
+    db: Session,
+    cake_id: int,
+    *,
+    action: str,
+    event_type: str,
+    field: str,
+    wait: bool,
+    wait_s: float,
+) -> dict:
     request_id = _new_request_id("cal")
 
     payload = {
         "request_id": request_id,
-        "action": "encoder_read",
+        "action": action,
         "cake_id": cake_id,
     }
 
-    _publish_admin_command(
+    if not wait:
+        _publish_admin_command(
+            request,
+            topic="igen/cmd/admin/calibration",
+            payload=payload,
+            event_type=event_type,
+            db=db,
+        )
+        return {"ok": True, "request_id": request_id, "cake_id": cake_id}
+
+    reply = _request_admin_command(
         request,
         topic="igen/cmd/admin/calibration",
+        reply_topic="igen/evt/admin/calibration",
         payload=payload,
-        event_type="admin:cake_read_angle_requested",
+        event_type=event_type,
         db=db,
+        wait_s=wait_s,
     )
-
-    return {"ok": True, "request_id": request_id, "cake_id": cake_id}
+    if reply is None:
+        status = command_tracker.get(request_id) or {}
+        return {
+            "ok": False,
+            "cake_id": cake_id,
+            "stage": status.get("stage"),
+            "request_id": request_id,
+            field: None,
+            "detail": "reply_timeout",
+        }
+    return _calibration_result(cake_id, reply.get("stage"), reply, field)
 
 
-@router.get("/cakes/{cake_id}/angle")
-def read_cake_angle(cake_id: int, db: Session = Depends(get_db)):
-    rows = (
-        db.execute(
-            select(models.Event)
-            .where(models.Event.event_type == "mqtt:igen/evt/admin/calibration")
-            .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
+def _latest_calibration_event(db: Session, cake_id: int, actions: tuple[str, ...]) -> models.Event | None:
+    return db.execute(
+        select(models.Event)
+        .where(
+            models.Event.event_type == "mqtt:igen/evt/admin/calibration",
+            models.Event.action.in_(actions),
+            models.Event.cake_id == cake_id,
         )
-        .scalars()
-        .all()
+        .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+@router.get("/cakes/{cake_id}/eeprom")
+def read_cake_eeprom(cake_id: int, db: Session = Depends(get_read_db)):
+    ev = _latest_calibration_event(db, cake_id, ("encoder_read_eeprom",))
+    if ev is not None:
+        return _calibration_result(cake_id, ev.stage, json.loads(ev.payload_json or "{}"), "eeprom")
+
+    return {"ok": False, "cake_id": cake_id, "eeprom": None, "detail": "no_eeprom_read_yet"}
+
+
+@router.post("/cakes/{cake_id}/read-angle")
+def queue_cake_read_angle(
+    cake_id: int,
+    request: Request,
+    wait: bool = Query(default=False),
+    wait_s: float = Query(default=10, gt=0, le=30),
+    db: Session = Depends(get_db),
+):
+    return _queue_calibration_read(
+        request,
+        db,
+        cake_id,
+        action="encoder_read",
+        event_type="admin:cake_read_angle_requested",
+        field="reading",
+        wait=wait,
+        wait_s=wait_s,
     )
 
-    for ev in rows:
-        try:
-            payload = json.loads(ev.payload_json or "{}")
-        except Exception:
-            continue
-
-        if payload.get("action") in {"encoder_read", "encoder_read_angle"} and int(payload.get("cake_id", -1)) == cake_id:
-            return {
-                "ok": payload.get("stage") == "succeeded",
-                "cake_id": cake_id,
-                "stage": payload.get("stage"),
-                "request_id": payload.get("request_id"),
-                "error_code": payload.get("error_code"),
-                "error_reason": payload.get("error_reason"),
-                "reading": payload.get("reading"),
-            }
+
+@router.get("/cakes/{cake_id}/angle")
+def read_cake_angle(cake_id: int, db: Session = Depends(get_read_db)):
+    ev = _latest_calibration_event(db, cake_id, ("encoder_read", "encoder_read_angle"))
+    if ev is not None:
+        return _calibration_result(cake_id, ev.stage, json.loads(ev.payload_json or "{}"), "reading")
 
     return {"ok": False, "cake_id": cake_id, "reading": None, "detail": "no_angle_read_yet"}
 
@@ -498,28 +561,8 @@ def admin_cancel_unconfirmed_loan(loan_id: str, db: Session = Depends(get_db)):
 
 # ---------------- MANUAL CONTROL / MACHINE ----------------
 @router.get("/manual/status", response_model=schemas.ManualControlStatus)
-def manual_status(db: Session = Depends(get_db)):
-    direct = _direct_machine_status()
-    if direct:
-        return direct
-
-    cached = _latest_event_payload(db, "mqtt:igen/evt/machine/status")
-    if cached:
-        return _coerce_manual_status(cached)
-
-    return {
-        "ok": True,
-        "reachable": False,
-        "state": "unknown",
-        "busy": False,
-        "homed": False,
-        "horizontal_position": None,
-        "vertical_position": None,
-        "active_cake_id": None,
-        "position": [],
-        "error": "no_machine_status_yet",
-        "source": "none",
-    }
+def manual_status():
+    return status_collector.snapshot()
 
 
 @router.post("/manual/home-all", response_model=schemas.ManualCommandResp)
@@ -659,26 +702,8 @@ def manual_move_cake(body: schemas.ManualMoveCakeReq, request: Request, db: Sess
 
 
 @router.get("/machine/status", response_model=schemas.ManualControlStatus)
-def machine_status(db: Session = Depends(get_db)):
-    direct = _direct_machine_status()
-    if direct:
-        return direct
-    cached = _latest_event_payload(db, "mqtt:igen/evt/machine/status")
-    if cached:
-        return _coerce_manual_status(cached)
-    return {
-        "ok": True,
-        "reachable": False,
-        "state": "unknown",
-        "busy": False,
-        "homed": False,
-        "horizontal_position": None,
-        "vertical_position": None,
-        "active_cake_id": None,
-        "position": [],
-        "error": "no_machine_status_yet",
-        "source": "none",
-    }
+def machine_status():
+    return status_collector.snapshot()
 
 
 @router.post("/machine/query-status", response_model=schemas.ManualCommandResp)
@@ -767,14 +792,15 @@ def machine_emergency_stop(request: Request, db: Session = Depends(get_db)):
 
 @router.get("/machine/alerts", response_model=list[schemas.MachineAlertOut])
 def machine_alerts(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     limit: int = Query(default=100, ge=1, le=500),
+    severity: str | None = Query(default=None),
 ):
+    q = select(models.Event).where(models.Event.event_type == "mqtt:igen/evt/machine/alert")
+    if severity:
+        q = q.where(models.Event.severity == severity.lower())
     rows = db.execute(
-        select(models.Event)
-        .where(models.Event.event_type == "mqtt:igen/evt/machine/alert")
-        .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
-        .limit(limit)
+        q.order_by(models.Event.ts.desc(), models.Event.event_id.desc()).limit(limit)
     ).scalars().all()
 
     out = []
@@ -786,9 +812,9 @@ def machine_alerts(
         out.append({
             "event_id": row.event_id,
             "ts": row.ts,
-            "severity": payload.get("severity", "warning"),
+            "severity": row.severity or "warning",
             "style": payload.get("style"),
-            "code": payload.get("code"),
+            "code": row.code,
             "message": payload.get("message", ""),
             "related_request_id": payload.get("related_request_id"),
             "data": payload.get("data", {}),
@@ -800,12 +826,11 @@ def machine_alerts(
 
 
 @router.get("/calibration/status")
-def calibration_status(db: Session = Depends(get_db)):
-    cached = _latest_event_payload(db, "mqtt:igen/evt/machine/status") or {}
+def calibration_status():
     return {
         "ok": True,
         "source": "placeholder",
-        "machine_status": _coerce_manual_status(cached),
+        "machine_status": status_collector.mqtt_snapshot(),
         "variables": {},
     }
 
@@ -922,14 +947,6 @@ def klipper_restart(
 def cake_set_home(cake_id: int, request: Request, db: Session = Depends(get_db)):
     request_id = uuid.uuid4().hex
 
-    set_cake_cmd_status(request_id, {
-        "request_id": request_id,
-        "cake_id": cake_id,
-        "stage": "queued",
-        "error_code": None,
-        "error_reason": None,
-    })
-
     payload = {
         "request_id": request_id,
         "action": "set_cake_zero",
@@ -950,68 +967,33 @@ def cake_set_home(cake_id: int, request: Request, db: Session = Depends(get_db))
 
 
 @router.post("/cakes/{cake_id}/read-eeprom")
-def queue_cake_read_eeprom(cake_id: int, request: Request, db: Session = Depends(get_db)):
-    request_id = _new_request_id("cal")
-
-    payload = {
-        "request_id": request_id,
-        "action": "encoder_read_eeprom",
-        "cake_id": cake_id,
-    }
-
-    _publish_admin_command(
+def queue_cake_read_eeprom(
+    cake_id: int,
+    request: Request,
+    wait: bool = Query(default=False),
+    wait_s: float = Query(default=10, gt=0, le=30),
+    db: Session = Depends(get_db),
+):
+    return _queue_calibration_read(
         request,
-        topic="igen/cmd/admin/calibration",
-        payload=payload,
+        db,
+        cake_id,
+        action="encoder_read_eeprom",
         event_type="admin:cake_read_eeprom_requested",
-        db=db,
+        field="eeprom",
+        wait=wait,
+        wait_s=wait_s,
     )
 
-    return {"ok": True, "request_id": request_id, "cake_id": cake_id}
-
 
 @router.get("/cakes/home/{request_id}/status")
-def cake_set_home_status(request_id: str, db: Session = Depends(get_db)):
-    rows = (
-        db.execute(
-            select(models.Event)
-            .where(models.Event.event_type == "mqtt:igen/evt/admin/manual")
-            .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
-            .limit(100)
-        )
-        .scalars()
-        .all()
-    )
-
-    matched_payload = None
-    for row in rows:
-        try:
-            payload = json.loads(row.payload_json or "{}")
-        except Exception:
-            continue
-        if payload.get("request_id") == request_id:
-            matched_payload = payload
-            break
-
-    if matched_payload:
-        stage = matched_payload.get("stage")
-        cake_id = matched_payload.get("cake_id")
-
-        data = matched_payload.get("data") or {}
-        if cake_id is None and isinstance(data, dict):
-            cake_id = data.get("cake_id")
-
-        set_cake_cmd_status(request_id, {
-            "request_id": request_id,
-            "cake_id": cake_id,
-            "stage": stage or "unknown",
-            "error_code": matched_payload.get("error_code"),
-            "error_reason": matched_payload.get("error_reason"),
-        })
-
-    st = get_cake_cmd_status(request_id)
-    if not st:
-        raise HTTPException(status_code=404, detail="unknown request_id")
+def cake_set_home_status(
+    request_id: str,
+    wait_s: float = Query(default=0, ge=0, le=30),
+    stage: str | None = Query(default=None),
+    db: Session = Depends(get_db),
+):
+    st = _command_status(request_id, wait_s, stage)
 
     if st.get("stage") == "succeeded":
         cake_id = st.get("cake_id")
@@ -1107,18 +1089,73 @@ def send_overdue_email_alert(loan_id: str, db: Session = Depends(get_db)):
 # ---------------- EVENTS (read-only) ----------------
 @router.get("/events", response_model=list[schemas.EventOut])
 def list_events(
-    db: Session = Depends(get_db),
+    response: Response,
+    db: Session = Depends(get_read_db),
+    event_type: str | None = Query(default=None),
+    actor_id: str | None = Query(default=None),
+    request_id: str | None = Query(default=None),
+    tool_item_id: str | None = Query(default=None),
+    limit: int = Query(default=500, ge=1, le=5000),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor from the previous page"),
+):
+    rows = uc.list_events(db, event_type, actor_id, request_id, tool_item_id, limit, cursor)
+    next_cursor = uc.next_cursor(rows, limit, "ts", "event_id")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+@router.get("/events/export")
+def export_events(
     event_type: str | None = Query(default=None),
     actor_id: str | None = Query(default=None),
     request_id: str | None = Query(default=None),
     tool_item_id: str | None = Query(default=None),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    session_factory: sessionmaker = Depends(get_read_session_factory),
+):
+    return _export_response(
+        session_factory,
+        lambda db: uc.iter_event_pages(db, event_type, actor_id, request_id, tool_item_id),
+        [c.key for c in uc.EVENT_COLUMNS],
+        format,
+        "events",
+    )
+
+
+def _event_retention(request: Request) -> EventRetentionService:
+    service = getattr(request.app.state, "event_retention", None)
+    if service is None:
+        service = request.app.state.event_retention = EventRetentionService()
+    return service
+
+
+@router.get("/events/retention")
+def event_retention_status(request: Request):
+    return _event_retention(request).status()
+
+
+@router.post("/events/retention/run")
+def event_retention_run(request: Request):
+    return _event_retention(request).run_once()
+
+
+@router.get("/events/archive")
+def list_archived_events(
+    request: Request,
+    start: datetime | None = Query(default=None),
+    end: datetime | None = Query(default=None),
+    event_type: str | None = Query(default=None),
     limit: int = Query(default=500, ge=1, le=5000),
 ):
-    return uc.list_events(db, event_type, actor_id, request_id, tool_item_id, limit)
+    start, end = naive_utc(start), naive_utc(end)
+    if start and end and end <= start:
+        raise HTTPException(400, "end must be after start")
+    return _event_retention(request).archive.query(start, end, event_type, limit)
 
 
 @router.get("/events/{event_id}", response_model=schemas.EventOut)
-def get_event(event_id: int, db: Session = Depends(get_db)):
+def get_event(event_id: int, db: Session = Depends(get_read_db)):
     return uc.get_event(db, event_id)
 
 
@@ -1133,6 +1170,7 @@ def assign_user_card(user_id: str, req: schemas.AssignCardReq, db: Session = Dep
 
     u.card_id = req.card_id
     db.commit()
+    entity_cache.invalidate_user(user_id)
     return {"ok": True, "user_id": user_id, "card_id": req.card_id}
 
 
@@ -1148,60 +1186,56 @@ def assign_tool_tag(tool_item_id: str, req: schemas.AssignToolTagReq, db: Sessio
 
     ti.tool_tag_id = req.tool_tag_id
     db.commit()
+    entity_cache.invalidate_tool_item(tool_item_id)
     return {"ok": True, "tool_item_id": tool_item_id, "tool_tag_id": req.tool_tag_id}
 
 
 @router.get("/inventory")
-def inventory(db: Session = Depends(get_db)):
+def inventory(db: Session = Depends(get_read_db)):
     q = text("""
       SELECT
         tm.tool_model_id AS tool_model_id,
         tm.name AS name,
-        COALESCE(COUNT(ti.tool_item_id), 0) AS total,
-        COALESCE(SUM(CASE WHEN open_loan.tool_item_id IS NULL THEN 1 ELSE 0 END), 0) AS available,
-        COALESCE(SUM(CASE WHEN open_loan.tool_item_id IS NOT NULL THEN 1 ELSE 0 END), 0) AS checked_out
+        COALESCE(a.total, 0) AS total,
+        COALESCE(a.available, 0) AS available,
+        COALESCE(a.checked_out, 0) AS checked_out,
+        COALESCE(a.reserved, 0) AS reserved
       FROM tool_models tm
-      LEFT JOIN tool_items ti
-        ON ti.tool_model_id = tm.tool_model_id
-       AND ti.is_active = 1
-      LEFT JOIN (
-        SELECT tool_item_id
-        FROM loans
-        WHERE returned_at IS NULL
-        GROUP BY tool_item_id
-      ) open_loan
-        ON open_loan.tool_item_id = ti.tool_item_id
-      GROUP BY tm.tool_model_id, tm.name
+      LEFT JOIN tool_model_availability a
+        ON a.tool_model_id = tm.tool_model_id
       ORDER BY tm.name ASC
     """)
     rows = db.execute(q).mappings().all()
     return [dict(r) for r in rows]
 
 
+@router.get("/inventory/consistency")
+def inventory_consistency(repair: bool = Query(default=False)):
+    return availability.check(repair=repair)
+
+
+@router.get("/metrics")
+def metrics_snapshot():
+    return {**metrics.snapshot(), "entity_cache": entity_cache.stats()}
+
+
 @router.get("/metrics/usage")
-def metrics_usage(db: Session = Depends(get_db), days: int = Query(default=14, ge=1, le=365)):
+def metrics_usage(db: Session = Depends(get_read_db), days: int = Query(default=14, ge=1, le=365)):
     q = text("""
-    WITH recent AS (
-      SELECT
-        date(ts) AS day,
-        event_type,
-        payload_json
+    WITH disp AS (
+      SELECT date(ts) AS day, count(*) AS c
       FROM events
-      WHERE ts >= datetime('now', '-' || :days || ' days')
-        AND (event_type = 'mqtt:igen/evt/dispense' OR event_type = 'mqtt:igen/evt/return')
-    ),
-    disp AS (
-      SELECT day, count(*) AS c
-      FROM recent
       WHERE event_type = 'mqtt:igen/evt/dispense'
-        AND json_extract(payload_json, '$.stage') = 'succeeded'
+        AND stage = 'succeeded'
+        AND ts >= datetime('now', '-' || :days || ' days')
       GROUP BY day
     ),
     ret AS (
-      SELECT day, count(*) AS c
-      FROM recent
+      SELECT date(ts) AS day, count(*) AS c
+      FROM events
       WHERE event_type = 'mqtt:igen/evt/return'
-        AND json_extract(payload_json, '$.stage') = 'succeeded'
+        AND stage = 'succeeded'
+        AND ts >= datetime('now', '-' || :days || ' days')
       GROUP BY day
     )
     SELECT
@@ -1218,7 +1252,7 @@ def metrics_usage(db: Session = Depends(get_db), days: int = Query(default=14, g
 
 
 @router.get("/cakes")
-def cakes_overview(db: Session = Depends(get_db)):
+def cakes_overview(db: Session = Depends(get_read_db)):
     return {"cakes": get_cake_overview(db)}
 
 
@@ -3,10 +3,10 @@ from __future__ import annotations
 from typing import Optional
 
 from fastapi import Cookie, Depends, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 
 from ..auth import SESSION_COOKIE_NAME, get_session_user, require_admin_user
-from ..db import SessionLocal
+from ..db import SessionLocal, ReadSessionLocal
 from ..mqtt import MqttBus
 from .. import models
 
@@ -19,6 +19,23 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """Session on the read-only pool, for GET/polling routes that never write."""
+    db: Session = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_session_factory() -> sessionmaker:
+    """
+    The read-only sessionmaker, for streaming routes whose body opens sessions
+    after the handler has returned (a yielded session would be closed by then).
+    """
+    return ReadSessionLocal
+
+
 
 
 def get_mqtt(request: Request) -> MqttBus:
@@ -1,7 +1,10 @@
+from collections import deque
 from typing import Annotated, Literal, Optional
+import os
 import threading
+import time
 
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from .. import schemas
@@ -12,8 +15,19 @@ from .deps import get_db, get_mqtt, get_current_user
 router = APIRouter(prefix="/rfid", tags=["rfid"])
 
 # --- RFID inbox (ephemeral) ---
+# Per (reader_id, kind) ring of recent scans. Every scan gets a process-wide,
+# monotonically increasing seq so clients can consume with since=<seq> and never
+# miss a read that lands between polls. Scans expire after RFID_SCAN_TTL_S.
+RFID_LOG_SIZE = int(os.getenv("RFID_LOG_SIZE", "64"))
+RFID_SCAN_TTL_S = float(os.getenv("RFID_SCAN_TTL_S", "30"))
+RFID_MAX_WAIT_MS = int(os.getenv("RFID_MAX_WAIT_MS", "25000"))
+
 _RFID_LOCK = threading.Lock()
-_RFID_LAST: dict[tuple[str, str], dict] = {}  # key=(reader_id, kind) kind in {"card","tool"}
+_RFID_COND = threading.Condition(_RFID_LOCK)
+_RFID_SEQ = 0
+_RFID_LOG: dict[tuple[str, str], deque[dict]] = {}  # key=(reader_id, kind) kind in {"card","tool"}
+_RFID_CONSUMED: dict[tuple[str, str], int] = {}  # last seq handed out by the cursor-less consume
+_RFID_OVERFLOW: dict[tuple[str, str], int] = {}  # highest seq pushed out by a full ring
 
 
 @router.post("/tool-confirm")
@@ -31,22 +45,73 @@ def tool_confirm(
 
 def _rfid_set(reader_id: str, kind: str, payload: dict) -> None:
     """
-    Store the latest RFID scan for a reader.
+    Append an RFID scan to the reader's log and wake any long-polling consumers.
     kind: "card" | "tool"
     payload: raw MQTT payload (uid, tag_id, reader_id, ts, etc)
     """
+    global _RFID_SEQ
+    with _RFID_COND:
+        _RFID_SEQ += 1
+        key = (reader_id, kind)
+        log = _RFID_LOG.setdefault(key, deque(maxlen=RFID_LOG_SIZE))
+        if len(log) == log.maxlen:
+            _RFID_OVERFLOW[key] = log[0]["seq"]
+        log.append({"seq": _RFID_SEQ, "received_at": time.monotonic(), "scan": payload})
+        _RFID_COND.notify_all()
+
+
+def _live_entries(key: tuple[str, str]) -> list[dict]:
+    """Unexpired entries for a reader (caller holds _RFID_LOCK)."""
+    log = _RFID_LOG.get(key)
+    if not log:
+        return []
+    cutoff = time.monotonic() - RFID_SCAN_TTL_S
+    while log and log[0]["received_at"] < cutoff:
+        log.popleft()
+    return list(log)
+
+
+def _rfid_since(reader_id: str, kind: str, since: int) -> tuple[list[dict], bool]:
+    """Scans after `since`, plus whether the ring overflowed past `since` (scans were lost)."""
+    key = (reader_id, kind)
     with _RFID_LOCK:
-        _RFID_LAST[(reader_id, kind)] = payload
+        newer = [e for e in _live_entries(key) if e["seq"] > since]
+        return newer, since < _RFID_OVERFLOW.get(key, 0)
 
 
-def _rfid_pop(reader_id: str, kind: str) -> Optional[dict]:
+def _rfid_pop_entry(reader_id: str, kind: str) -> Optional[dict]:
+    key = (reader_id, kind)
     with _RFID_LOCK:
-        return _RFID_LAST.pop((reader_id, kind), None)
+        entries = _live_entries(key)
+        consumed = _RFID_CONSUMED.get(key, 0)
+        if not entries or entries[-1]["seq"] <= consumed:
+            return None
+        _RFID_CONSUMED[key] = entries[-1]["seq"]
+        return entries[-1]
 
 
 def _rfid_get(reader_id: str, kind: str) -> Optional[dict]:
+    key = (reader_id, kind)
     with _RFID_LOCK:
-        return _RFID_LAST.get((reader_id, kind))
+        entries = _live_entries(key)
+        if not entries or entries[-1]["seq"] <= _RFID_CONSUMED.get(key, 0):
+            return None
+        return entries[-1]["scan"]
+
+
+def _rfid_wait(reader_id: str, kind: str, since: int, wait_ms: int) -> None:
+    """Block until the reader has a scan newer than `since` or wait_ms passes."""
+    deadline = time.monotonic() + min(wait_ms, RFID_MAX_WAIT_MS) / 1000.0
+    key = (reader_id, kind)
+    with _RFID_COND:
+        while True:
+            entries = _live_entries(key)
+            if entries and entries[-1]["seq"] > since:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            _RFID_COND.wait(remaining)
 
 
 @router.post("/set-mode")
@@ -63,11 +128,38 @@ def rfid_set_mode(
 
 
 @router.get("/consume")
-def rfid_consume(reader_id: str, kind: Literal["card", "tool"]):
-    print(f"{reader_id} READER")
-    scan = _rfid_pop(reader_id, kind)
-    print(f"SCAN : {scan}")
-    return {"ok": bool(scan), "scan": scan}
+def rfid_consume(
+    reader_id: str,
+    kind: Literal["card", "tool"],
+    since: int | None = Query(default=None, ge=0),
+    wait_ms: int = Query(default=0, ge=0),
+):
+    """
+    Without `since`: pop the newest unconsumed scan (legacy single-slot behaviour).
+    With `since`: return every retained scan with seq > since, oldest first; the
+    client passes back `next_since`. `wait_ms` long-polls until a scan arrives.
+    """
+    key = (reader_id, kind)
+    if since is None:
+        if wait_ms:
+            with _RFID_LOCK:
+                consumed = _RFID_CONSUMED.get(key, 0)
+            _rfid_wait(reader_id, kind, consumed, wait_ms)
+        entry = _rfid_pop_entry(reader_id, kind)
+        scan = entry["scan"] if entry else None
+        return {"ok": bool(scan), "scan": scan, "seq": entry["seq"] if entry else None}
+
+    if wait_ms:
+        _rfid_wait(reader_id, kind, since, wait_ms)
+    entries, gap = _rfid_since(reader_id, kind, since)
+    scans = [{"seq": e["seq"], "scan": e["scan"]} for e in entries]
+    return {
+        "ok": bool(scans),
+        "scan": scans[-1]["scan"] if scans else None,
+        "scans": scans,
+        "next_since": scans[-1]["seq"] if scans else since,
+        "gap": gap,
+    }
 
 
 @router.get("/peek")
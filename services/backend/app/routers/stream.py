@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import APIRouter, Cookie, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
+
+from ..auth import SESSION_COOKIE_NAME, get_session_user, is_admin_user
+from ..db import SessionLocal
+from ..event_stream import sse_events
+from .. import models
+
+router = APIRouter(tags=["stream"])
+
+STREAM_EVENTS = {"loan_request", "machine_status", "machine_alert"}
+
+
+def get_stream_user(
+    session_token: Optional[str] = Cookie(default=None, alias=SESSION_COOKIE_NAME),
+) -> models.User:
+    # Plain def so FastAPI runs the sync lookup in its threadpool, on a short-lived
+    # session closed before streaming starts; the stream itself holds no DB connection.
+    with SessionLocal() as db:
+        return get_session_user(db, session_token)
+
+
+@router.get("/stream")
+async def stream(
+    request: Request,
+    batch_id: str | None = Query(default=None),
+    events: str | None = Query(default=None, description="comma separated subset of loan_request,machine_status,machine_alert"),
+    last_event_id: int | None = Query(default=None),
+    last_event_id_header: Optional[str] = Header(default=None, alias="Last-Event-ID"),
+    user: models.User = Depends(get_stream_user),
+):
+    resume_from = last_event_id
+    if last_event_id_header and last_event_id_header.strip().isdigit():
+        resume_from = int(last_event_id_header.strip())
+
+    names = {n.strip() for n in events.split(",") if n.strip()} & STREAM_EVENTS if events else None
+
+    return StreamingResponse(
+        sse_events(
+            resume_from,
+            names=names,
+            batch_id=batch_id,
+            # Admins see every request; everyone else only their own.
+            user_id=None if is_admin_user(user) else user.user_id,
+            is_disconnected=request.is_disconnected,
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
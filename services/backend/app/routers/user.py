@@ -6,12 +6,14 @@ from fastapi import APIRouter, Body, Cookie, Depends, HTTPException, Query, Resp
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from .deps import get_current_user, get_db, get_mqtt
+from .deps import get_current_user, get_db, get_read_db, get_mqtt
 from .. import models, schemas
 from ..auth import SESSION_COOKIE_NAME, clear_session_cookie, create_session, revoke_session
+from ..entity_cache import entity_cache
 from ..mqtt import MqttBus
 from ..usecases.rfid_flow import get_user_by_card
 from ..usecases.user_flow import (
+    BATCH_ORDER,
     build_hw_payload,
     create_dispense_batch,
     create_return_batch,
@@ -26,7 +28,7 @@ def _publish_first_request_for_batch(db: Session, mqtt: MqttBus, batch_id: str):
     lr = (
         db.query(models.LoanRequest)
         .filter(models.LoanRequest.batch_id == batch_id)
-        .order_by(models.LoanRequest.created_at.asc(), models.LoanRequest.request_id.asc())
+        .order_by(*BATCH_ORDER)
         .first()
     )
     if not lr:
@@ -48,7 +50,7 @@ def auth_session_card(
     except ValueError as e:
         raise HTTPException(status_code=403, detail=str(e))
 
-    user = db.get(models.User, card["user_id"])
+    user = entity_cache.user(db, card["user_id"])
     assert user is not None
     return create_session(db, user, response)
 
@@ -104,7 +106,7 @@ def dispense(
 @router.get("/dispense/{batch_id}/status")
 def dispense_status(
     batch_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: models.User = Depends(get_current_user),
 ):
     return {"batch_id": batch_id, "items": get_batch_status(db, batch_id)}
@@ -153,7 +155,7 @@ def do_return(
 @router.get("/return/{batch_id}/status")
 def return_status(
     batch_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: models.User = Depends(get_current_user),
 ):
     return {"batch_id": batch_id, "items": get_batch_status(db, batch_id)}
@@ -180,7 +182,7 @@ def cancel_return_request(
 
 
 @router.get("/loans")
-def loans(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+def loans(db: Session = Depends(get_read_db), user: models.User = Depends(get_current_user)):
     return {"user_id": user.user_id, "loans": list_active_loans(db, user.user_id)}
 
 
@@ -197,7 +199,7 @@ def auth_card(
 
 @router.get("/catalog")
 def catalog(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     search: str | None = Query(default=None),
     category: str | None = Query(default=None),
     limit: int = Query(default=500, ge=1, le=2000),
@@ -208,20 +210,15 @@ def catalog(
         tm.name AS name,
         tm.category AS category,
         tm.description AS description,
-        COUNT(ti.tool_item_id) AS total,
-        SUM(CASE WHEN l.loan_id IS NULL THEN 1 ELSE 0 END) AS available,
-        SUM(CASE WHEN l.loan_id IS NOT NULL THEN 1 ELSE 0 END) AS checked_out
+        COALESCE(a.total, 0) AS total,
+        COALESCE(a.available, 0) AS available,
+        COALESCE(a.checked_out, 0) AS checked_out,
+        COALESCE(a.reserved, 0) AS reserved
       FROM tool_models tm
-      LEFT JOIN tool_items ti
-        ON ti.tool_model_id = tm.tool_model_id
-       AND ti.is_active = 1
-      LEFT JOIN loans l
-        ON l.tool_item_id = ti.tool_item_id
-       AND l.returned_at IS NULL
-       AND l.status IN ('active','overdue','unconfirmed')
+      LEFT JOIN tool_model_availability a
+        ON a.tool_model_id = tm.tool_model_id
       WHERE (:search IS NULL OR lower(tm.name) LIKE '%' || lower(:search) || '%')
         AND (:category IS NULL OR tm.category = :category)
-      GROUP BY tm.tool_model_id, tm.name, tm.category, tm.description
       ORDER BY tm.name ASC
       LIMIT :limit
     """)
@@ -264,6 +264,8 @@ class ManualControlStatus(BaseModel):
     position: list = Field(default_factory=list)
     error: Optional[str] = None
     source: Optional[str] = None
+    updated_at: Optional[datetime] = None  # when this status was reported or probed
+    age_s: Optional[float] = None
 
 
 class MachineAlertOut(BaseModel):
@@ -318,6 +320,7 @@ class DispenseBatchRequest(BaseModel):
 class DispenseBatchResponse(BaseModel):
     batch_id: str
     request_ids: List[str]
+    estimated_motion_s: Optional[float] = None
 
 
 class ToolConfirmRequest(BaseModel):
@@ -95,7 +95,11 @@ class AlertService:
     def _check_machine_alerts(self, db):
         row = db.execute(
             select(models.Event)
-            .where(models.Event.event_type == "mqtt:igen/evt/machine/alert")
+            .where(
+                models.Event.event_type == "mqtt:igen/evt/machine/alert",
+                models.Event.severity.in_(("critical", "error")),
+                models.Event.ts >= utcnow() - timedelta(minutes=5),
+            )
             .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
             .limit(1)
         ).scalar_one_or_none()
@@ -105,6 +109,4 @@ class AlertService:
             payload = json.loads(row.payload_json or "{}")
         except Exception:
             payload = {}
-        sev = str(payload.get("severity", "")).lower()
-        if sev in {"critical", "error"} and (utcnow() - row.ts) < timedelta(minutes=5):
-            self._emit_once(db, "MACHINE_ALERT", payload.get("message", "Machine alert"), payload)
+        self._emit_once(db, "MACHINE_ALERT", payload.get("message", "Machine alert"), payload)
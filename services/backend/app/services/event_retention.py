@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import delete, select, text
+
+from ..db import SessionLocal, engine, IS_SQLITE
+from .. import models
+
+EVENT_RETENTION_INTERVAL_S = int(os.getenv("EVENT_RETENTION_INTERVAL_S", "3600"))
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR", "")
+EVENT_ARCHIVE_SEGMENT_ROWS = int(os.getenv("EVENT_ARCHIVE_SEGMENT_ROWS", "20000"))
+EVENT_ARCHIVE_MAX_SEGMENTS_PER_RUN = int(os.getenv("EVENT_ARCHIVE_MAX_SEGMENTS_PER_RUN", "10"))
+EVENT_VACUUM_PAGES = int(os.getenv("EVENT_VACUUM_PAGES", "2000"))
+
+# Retention in days per event_type prefix; the longest matching prefix wins, "*" is the default.
+# 0 keeps rows forever. Override with EVENT_RETENTION_POLICIES="prefix=days,prefix=days".
+DEFAULT_RETENTION_DAYS: dict[str, float] = {
+    "mqtt:igen/evt/machine/status": 1,
+    "mqtt:igen/evt/system/status": 1,
+    "mqtt:igen/evt/hardware/wait": 7,
+    "mqtt:igen/evt/rfid/": 7,
+    "mqtt:igen/evt/admin": 30,
+    "mqtt:igen/evt/machine/alert": 90,
+    "alert:": 90,
+    "mqtt:igen/evt/dispense": 400,  # metrics_usage looks back up to 365 days
+    "mqtt:igen/evt/return": 400,
+    "loan:": 400,
+    "*": 365,
+}
+
+MANIFEST_NAME = "manifest.json"
+
+
+def utcnow() -> datetime:
+    return datetime.now()
+
+
+def _parse_policies(raw: str) -> dict[str, float]:
+    policies = dict(DEFAULT_RETENTION_DAYS)
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        prefix, days = part.rsplit("=", 1)
+        try:
+            policies[prefix.strip()] = float(days)
+        except ValueError:
+            print(f"[EVENT_RETENTION] ignoring bad policy: {part!r}")
+    return policies
+
+
+def _default_archive_dir() -> Path:
+    if EVENT_ARCHIVE_DIR:
+        return Path(EVENT_ARCHIVE_DIR)
+    database = engine.url.database if IS_SQLITE else None
+    if database:
+        return Path(os.path.abspath(database)).parent / "event_archive"
+    return Path("./data/event_archive")
+
+
+EVENT_COLUMNS = tuple(models.Event.__table__.columns)
+
+
+def _row_to_dict(row) -> dict:
+    return {
+        col.name: value.isoformat() if isinstance(value, datetime) else value
+        for col, value in zip(EVENT_COLUMNS, row)
+    }
+
+
+def naive_utc(value: datetime | None) -> datetime | None:
+    """Event timestamps are stored naive (utcnow()); aware query bounds are converted to match."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _to_dt(value) -> datetime | None:
+    if value is None or isinstance(value, datetime):
+        return naive_utc(value)
+    return naive_utc(datetime.fromisoformat(str(value)))
+
+
+class EventArchive:
+    """
+    Append-only gzip NDJSON segments plus a manifest of their time ranges.
+
+    A segment is listed as pending until the rows it holds have been deleted
+    from the events table (commit()). A pending segment left by a crash is
+    finished on the next run instead of being archived again, and a segment
+    with the same event_id range as a listed one is never written twice.
+    """
+
+    def __init__(self, root: Path | None = None):
+        self.root = Path(root) if root else _default_archive_dir()
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / MANIFEST_NAME
+
+    def segments(self) -> list[dict]:
+        if not self.manifest_path.exists():
+            return []
+        try:
+            return json.loads(self.manifest_path.read_text()).get("segments", [])
+        except Exception as e:
+            print(f"[EVENT_RETENTION] manifest unreadable: {e}")
+            return []
+
+    def _write_manifest(self, segments: list[dict]):
+        manifest_tmp = self.manifest_path.with_suffix(".tmp")
+        manifest_tmp.write_text(json.dumps({"segments": segments}, indent=1))
+        os.replace(manifest_tmp, self.manifest_path)
+
+    def pending(self) -> list[dict]:
+        return [seg for seg in self.segments() if seg.get("pending")]
+
+    def event_ids(self, seg: dict) -> list[int]:
+        with gzip.open(self.root / seg["file"], "rt", encoding="utf-8") as fh:
+            return [json.loads(line)["event_id"] for line in fh]
+
+    def commit(self, name: str):
+        with self._lock:
+            segments = self.segments()
+            for seg in segments:
+                if seg["file"] == name:
+                    seg.pop("pending", None)
+            self._write_manifest(segments)
+
+    def write_segment(self, rows: list[dict]) -> dict:
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            min_ts = min(r["ts"] for r in rows)
+            max_ts = max(r["ts"] for r in rows)
+            first_id = min(r["event_id"] for r in rows)
+            last_id = max(r["event_id"] for r in rows)
+            for seg in self.segments():
+                if (seg["first_event_id"], seg["last_event_id"], seg["rows"]) == (first_id, last_id, len(rows)):
+                    return seg
+            name = f"events_{first_id:012d}_{last_id:012d}_{utcnow().strftime('%Y%m%dT%H%M%S%f')}.ndjson.gz"
+            path = self.root / name
+            tmp = path.with_suffix(".tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8") as fh:
+                for r in sorted(rows, key=lambda r: (r["ts"], r["event_id"])):
+                    fh.write(json.dumps(r, separators=(",", ":")) + "\n")
+            with open(tmp, "rb") as fh:
+                os.fsync(fh.fileno())
+            os.replace(tmp, path)
+
+            types: dict[str, int] = {}
+            for r in rows:
+                types[r["event_type"]] = types.get(r["event_type"], 0) + 1
+            entry = {
+                "file": name,
+                "rows": len(rows),
+                "min_ts": min_ts,
+                "max_ts": max_ts,
+                "first_event_id": first_id,
+                "last_event_id": last_id,
+                "event_types": types,
+                "bytes": path.stat().st_size,
+                "pending": True,
+            }
+            self._write_manifest(self.segments() + [entry])
+            return entry
+
+    def query(
+        self,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        event_type: str | None = None,
+        limit: int = 1000,
+    ) -> list[dict]:
+        start, end = naive_utc(start), naive_utc(end)
+        out: list[dict] = []
+        for seg in sorted(self.segments(), key=lambda s: s["min_ts"]):
+            if seg.get("pending"):
+                continue  # rows are still live in the events table
+            if start is not None and _to_dt(seg["max_ts"]) < start:
+                continue
+            if end is not None and _to_dt(seg["min_ts"]) >= end:
+                continue
+            if event_type is not None and event_type not in seg.get("event_types", {}):
+                continue
+            with gzip.open(self.root / seg["file"], "rt", encoding="utf-8") as fh:
+                for line in fh:
+                    row = json.loads(line)
+                    ts = _to_dt(row["ts"])
+                    if start is not None and ts < start:
+                        continue
+                    if end is not None and ts >= end:
+                        continue
+                    if event_type is not None and row["event_type"] != event_type:
+                        continue
+                    out.append(row)
+                    if len(out) >= limit:
+                        return out
+        return out
+
+
+class EventRetentionService:
+    def __init__(self, archive: EventArchive | None = None, policies: dict[str, float] | None = None):
+        self.archive = archive or EventArchive()
+        self.policies = policies or _parse_policies(os.getenv("EVENT_RETENTION_POLICIES", ""))
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._run_lock = threading.Lock()
+        self.last_run: dict | None = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while not self._stop.wait(EVENT_RETENTION_INTERVAL_S):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[EVENT_RETENTION] run failed: {e}")
+
+    def retention_days(self, event_type: str) -> float:
+        best = None
+        for prefix in self.policies:
+            if prefix != "*" and event_type.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.policies[best] if best is not None else self.policies.get("*", 0)
+
+    def run_once(self, now: datetime | None = None) -> dict:
+        with self._run_lock:
+            now = now or utcnow()
+            archived = 0
+            segments = []
+            with SessionLocal() as db:
+                self._finish_pending(db)
+                types = db.execute(select(models.Event.event_type).distinct()).scalars().all()
+                cutoffs = {}
+                for event_type in types:
+                    days = self.retention_days(event_type)
+                    if days and days > 0:
+                        cutoffs[event_type] = now - timedelta(days=days)
+
+                for _ in range(EVENT_ARCHIVE_MAX_SEGMENTS_PER_RUN):
+                    batch: list = []
+                    for event_type, cutoff in cutoffs.items():
+                        room = EVENT_ARCHIVE_SEGMENT_ROWS - len(batch)
+                        if room <= 0:
+                            break
+                        batch.extend(db.execute(
+                            select(*EVENT_COLUMNS)
+                            .where(models.Event.event_type == event_type, models.Event.ts < cutoff)
+                            .order_by(models.Event.ts.asc(), models.Event.event_id.asc())
+                            .limit(room)
+                        ).all())
+                    if not batch:
+                        break
+
+                    # Segment is durable on disk before the rows leave the table.
+                    entry = self.archive.write_segment([_row_to_dict(r) for r in batch])
+                    db.execute(delete(models.Event).where(models.Event.event_id.in_([r.event_id for r in batch])))
+                    db.commit()
+                    self.archive.commit(entry["file"])
+                    archived += len(batch)
+                    segments.append(entry["file"])
+                    if len(batch) < EVENT_ARCHIVE_SEGMENT_ROWS:
+                        break
+
+            vacuumed = self._incremental_vacuum() if archived else 0
+            self.last_run = {
+                "ts": now.isoformat(),
+                "archived": archived,
+                "segments": segments,
+                "freed_pages": vacuumed,
+            }
+            if archived:
+                print(f"[EVENT_RETENTION] archived={archived} segments={len(segments)} freed_pages={vacuumed}")
+            return self.last_run
+
+    def _finish_pending(self, db):
+        """Delete the rows of segments archived by a run that stopped before its delete committed."""
+        for seg in self.archive.pending():
+            ids = self.archive.event_ids(seg)
+            db.execute(delete(models.Event).where(models.Event.event_id.in_(ids)))
+            db.commit()
+            self.archive.commit(seg["file"])
+            print(f"[EVENT_RETENTION] finished pending segment {seg['file']} rows={len(ids)}")
+
+    def _incremental_vacuum(self) -> int:
+        if not IS_SQLITE:
+            return 0
+        raw = engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # A DB created before auto_vacuum=INCREMENTAL needs one full VACUUM to switch.
+                # Done here, in the background job, rather than blocking startup.
+                print("[EVENT_RETENTION] converting database to incremental auto_vacuum")
+                before = conn.execute("PRAGMA page_count").fetchone()[0]
+                conn.executescript("PRAGMA auto_vacuum=INCREMENTAL; VACUUM;")
+                return int(before - conn.execute("PRAGMA page_count").fetchone()[0])
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # executescript steps the pragma to completion; a plain execute frees a single page.
+            conn.executescript(f"PRAGMA incremental_vacuum({EVENT_VACUUM_PAGES});")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            raw.close()
+        return int(before - after)
+
+    def status(self) -> dict:
+        with SessionLocal() as db:
+            live_rows = db.execute(text("SELECT COUNT(*) FROM events")).scalar()
+        segments = self.archive.segments()
+        return {
+            "policies_days": self.policies,
+            "live_rows": live_rows,
+            "archive_dir": str(self.archive.root),
+            "archive_segments": len(segments),
+            "archive_rows": sum(s["rows"] for s in segments),
+            "archive_bytes": sum(s.get("bytes", 0) for s in segments),
+            "last_run": self.last_run,
+        }
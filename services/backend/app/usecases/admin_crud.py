@@ -1,15 +1,19 @@
 from __future__ import annotations
 
+import base64
 import json
 import uuid
 from datetime import date, datetime
-from typing import Optional
+from typing import Iterator, Optional
 
 from fastapi import HTTPException
-from sqlalchemy import select, or_
+from sqlalchemy import select, or_, tuple_
 from sqlalchemy.orm import Session
 
 from .. import models
+from ..auth import session_cache
+from ..entity_cache import entity_cache
+from ..cake_state import cake_state
 from ..schemas import (
     AdminUserCreate, AdminUserPatch,
     AdminToolModelCreate, AdminToolModelPatch,
@@ -26,6 +30,9 @@ def _conflict(msg: str):
 def _not_found(msg: str):
     raise HTTPException(status_code=404, detail=msg)
 
+def _bad_request(msg: str):
+    raise HTTPException(status_code=400, detail=msg)
+
 
 def _json_safe(value):
     if isinstance(value, datetime):
@@ -76,21 +83,11 @@ def _parse_slot_index(slot_id: str) -> int:
 
 
 def _ensure_cake_state_row(db: Session, cake_id: str):
-    row = db.get(models.CakeState, cake_id)
-    if row is None:
-        row = models.CakeState(cake_id=cake_id, current_slot=0)
-        db.add(row)
-        db.flush()
-    return row
+    cake_state.ensure_cake(db, cake_id)
 
 
 def _ensure_cake_slot_row(db: Session, cake_id: str, slot_index: int):
-    row = db.get(models.CakeSlotState, {"cake_id": cake_id, "slot_index": slot_index})
-    if row is None:
-        row = models.CakeSlotState(cake_id=cake_id, slot_index=slot_index, tool_item_id=None)
-        db.add(row)
-        db.flush()
-    return row
+    cake_state.ensure_slot(db, cake_id, slot_index)
 
 
 def _validate_storage_slot(slot_index: int):
@@ -101,19 +98,16 @@ def _validate_storage_slot(slot_index: int):
 
 
 def _clear_live_slot_for_tool(db: Session, tool_item_id: str):
-    rows = db.execute(
-        select(models.CakeSlotState).where(models.CakeSlotState.tool_item_id == tool_item_id)
-    ).scalars().all()
-    for row in rows:
-        row.tool_item_id = None
+    cake_state.clear_tool(db, tool_item_id)
 
 
 def _occupy_live_slot(db: Session, cake_id: str, slot_index: int, tool_item_id: str):
     _ensure_cake_state_row(db, cake_id)
-    row = _ensure_cake_slot_row(db, cake_id, slot_index)
-    if row.tool_item_id and row.tool_item_id != tool_item_id:
+    _ensure_cake_slot_row(db, cake_id, slot_index)
+    current = cake_state.view(db, cake_id).slots[slot_index]
+    if current and current != tool_item_id:
         _conflict("cake_slot_already_occupied")
-    row.tool_item_id = tool_item_id
+    cake_state.set_slot(db, cake_id, slot_index, tool_item_id)
 
 # ---------------- USERS ----------------
 def list_users(db: Session, search: Optional[str], role: Optional[str], status: Optional[str], limit: int):
@@ -152,6 +146,7 @@ def create_user(db: Session, body: AdminUserCreate):
     db.add(u)
     log_event(db, "admin_user_created", payload=data)
     db.commit()
+    entity_cache.invalidate_user(u.user_id)
     db.refresh(u)
     return u
 
@@ -176,6 +171,8 @@ def patch_user(db: Session, user_id: str, body: AdminUserPatch):
 
     log_event(db, "admin_user_updated", payload={"user_id": user_id, "patch": data})
     db.commit()
+    session_cache.invalidate_user(user_id)
+    entity_cache.invalidate_user(user_id)
     db.refresh(u)
     return u
 
@@ -184,6 +181,8 @@ def delete_user(db: Session, user_id: str):
     db.delete(u)
     log_event(db, "admin_user_deleted", payload={"user_id": user_id})
     db.commit()
+    entity_cache.invalidate_user(user_id)
+    session_cache.invalidate_user(user_id)
     return {"ok": True}
 
 # ---------------- TOOL MODELS ----------------
@@ -210,6 +209,7 @@ def create_tool_model(db: Session, body: AdminToolModelCreate):
     db.add(tm)
     log_event(db, "admin_tool_model_created", payload=data)
     db.commit()
+    entity_cache.invalidate_tool_model(tm.tool_model_id)
     db.refresh(tm)
     return tm
 
@@ -226,6 +226,7 @@ def patch_tool_model(db: Session, tool_model_id: str, body: AdminToolModelPatch)
         setattr(tm, k, v)
     log_event(db, "admin_tool_model_updated", payload={"tool_model_id": tool_model_id, "patch": data})
     db.commit()
+    entity_cache.invalidate_tool_model(tool_model_id)
     db.refresh(tm)
     return tm
 
@@ -237,6 +238,7 @@ def delete_tool_model(db: Session, tool_model_id: str):
     db.delete(tm)
     log_event(db, "admin_tool_model_deleted", payload={"tool_model_id": tool_model_id})
     db.commit()
+    entity_cache.invalidate_tool_model(tool_model_id)
     return {"ok": True}
 
 # ---------------- TOOL ITEMS ----------------
@@ -289,6 +291,7 @@ def create_tool_item(db: Session, body: AdminToolItemCreate):
 
     log_event(db, "admin_tool_item_created", payload=data, tool_item_id=data["tool_item_id"])
     db.commit()
+    entity_cache.invalidate_tool_item(ti.tool_item_id)
     db.refresh(ti)
     return ti
 
@@ -345,6 +348,7 @@ def patch_tool_item(db: Session, tool_item_id: str, body: AdminToolItemPatch):
         tool_item_id=tool_item_id,
     )
     db.commit()
+    entity_cache.invalidate_tool_item(tool_item_id)
     db.refresh(ti)
     return ti
 
@@ -365,6 +369,7 @@ def delete_tool_item(db: Session, tool_item_id: str):
     db.delete(ti)
     log_event(db, "admin_tool_item_deleted", payload={"tool_item_id": tool_item_id}, tool_item_id=tool_item_id)
     db.commit()
+    entity_cache.invalidate_tool_item(tool_item_id)
     return {"ok": True}
 
 # NEW: drop an UNCONFIRMED checked-out item from inventory
@@ -396,11 +401,78 @@ def drop_unconfirmed_tool_item(db: Session, tool_item_id: str):
     log_event(db, "admin_tool_item_deactivated", payload={"tool_item_id": tool_item_id, "reason": "dropped_unconfirmed"}, tool_item_id=tool_item_id)
 
     db.commit()
+    entity_cache.invalidate_tool_item(tool_item_id)
     return {"ok": True, "tool_item_id": tool_item_id, "loan_id": loan.loan_id, "status": "canceled", "item_is_active": False}
 
+# ---------------- keyset cursors (admin lists + exports) ----------------
+# Lists are ordered newest first by (timestamp, primary key). A cursor is the
+# last row's pair, opaque to the client; the next page is everything strictly
+# older, so a page costs an index range scan however deep the client goes.
+EXPORT_BATCH_ROWS = 500
+
+
+def encode_cursor(ts: datetime, key) -> str:
+    raw = json.dumps([ts.isoformat(), key]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, object]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, key = json.loads(raw)
+        return datetime.fromisoformat(ts), key
+    except (ValueError, TypeError):
+        _bad_request("invalid_cursor")
+
+
+def next_cursor(rows: list, limit: int, ts_attr: str, key_attr: str) -> Optional[str]:
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, ts_attr), getattr(last, key_attr))
+
+
+def _iter_pages(db: Session, fetch, ts_attr: str, key_attr: str, batch_rows: int) -> Iterator[list]:
+    """
+    Keyset batches for streaming exports. The session is closed after every
+    batch, so no connection or read snapshot is held while the client drains
+    the response; memory stays at one batch however long the range is.
+    """
+    cursor = None
+    while True:
+        rows = fetch(cursor, batch_rows)
+        db.close()
+        if rows:
+            yield rows
+        cursor = next_cursor(rows, batch_rows, ts_attr, key_attr)
+        if cursor is None:
+            return
+
+
 # ---------------- LOANS (admin view + force patch) ----------------
-def list_loans(db: Session, active_only: bool, overdue_only: bool, user_id: Optional[str], tool_item_id: Optional[str], limit: int):
-    q = select(models.Loan)
+LOAN_COLUMNS = (
+    models.Loan.loan_id,
+    models.Loan.user_id,
+    models.Loan.tool_item_id,
+    models.Loan.issued_at,
+    models.Loan.due_at,
+    models.Loan.confirmed_at,
+    models.Loan.returned_at,
+    models.Loan.status,
+)
+
+
+def list_loans(
+    db: Session,
+    active_only: bool,
+    overdue_only: bool,
+    user_id: Optional[str],
+    tool_item_id: Optional[str],
+    limit: int,
+    cursor: Optional[str] = None,
+):
+    """Loan rows (Core tuples, not ORM instances), newest issued first."""
+    q = select(*LOAN_COLUMNS)
     if active_only:
         q = q.where(models.Loan.returned_at.is_(None))
     if overdue_only:
@@ -409,8 +481,21 @@ def list_loans(db: Session, active_only: bool, overdue_only: bool, user_id: Opti
         q = q.where(models.Loan.user_id == user_id)
     if tool_item_id:
         q = q.where(models.Loan.tool_item_id == tool_item_id)
-    q = q.order_by(models.Loan.issued_at.desc()).limit(limit)
-    return db.execute(q).scalars().all()
+    if cursor:
+        issued_at, loan_id = decode_cursor(cursor)
+        q = q.where(tuple_(models.Loan.issued_at, models.Loan.loan_id) < (issued_at, str(loan_id)))
+    q = q.order_by(models.Loan.issued_at.desc(), models.Loan.loan_id.desc()).limit(limit)
+    return db.execute(q).all()
+
+
+def iter_loan_pages(db: Session, active_only: bool, overdue_only: bool, user_id: Optional[str], tool_item_id: Optional[str], batch_rows: int = EXPORT_BATCH_ROWS):
+    return _iter_pages(
+        db,
+        lambda cursor, limit: list_loans(db, active_only, overdue_only, user_id, tool_item_id, limit, cursor),
+        "issued_at",
+        "loan_id",
+        batch_rows,
+    )
 
 def get_loan(db: Session, loan_id: str):
     loan = db.get(models.Loan, loan_id)
@@ -469,8 +554,34 @@ def admin_cancel_unconfirmed_loan(db: Session, loan_id: str):
     return {"ok": True, "loan_id": loan_id, "status": loan.status, "returned_at": loan.returned_at.isoformat()}
 
 # ---------------- EVENTS (read-only) ----------------
-def list_events(db: Session, event_type: Optional[str], actor_id: Optional[str], request_id: Optional[str], tool_item_id: Optional[str], limit: int):
-    q = select(models.Event)
+EVENT_COLUMNS = (
+    models.Event.event_id,
+    models.Event.ts,
+    models.Event.event_type,
+    models.Event.actor_type,
+    models.Event.actor_id,
+    models.Event.request_id,
+    models.Event.tool_item_id,
+    models.Event.payload_json,
+)
+
+
+def list_events(
+    db: Session,
+    event_type: Optional[str],
+    actor_id: Optional[str],
+    request_id: Optional[str],
+    tool_item_id: Optional[str],
+    limit: int,
+    cursor: Optional[str] = None,
+):
+    """
+    Event rows (Core tuples, not ORM instances), newest first. Unfiltered and
+    event_type/actor/tool filtered pages are one range scan of an index ending
+    in (ts, event_id); request_id goes through ix_events_request_type and only
+    sorts that request's few rows.
+    """
+    q = select(*EVENT_COLUMNS)
     if event_type:
         q = q.where(models.Event.event_type == event_type)
     if actor_id:
@@ -479,8 +590,23 @@ def list_events(db: Session, event_type: Optional[str], actor_id: Optional[str],
         q = q.where(models.Event.request_id == request_id)
     if tool_item_id:
         q = q.where(models.Event.tool_item_id == tool_item_id)
-    q = q.order_by(models.Event.ts.desc()).limit(limit)
-    return db.execute(q).scalars().all()
+    if cursor:
+        ts, event_id = decode_cursor(cursor)
+        if not isinstance(event_id, int):
+            _bad_request("invalid_cursor")
+        q = q.where(tuple_(models.Event.ts, models.Event.event_id) < (ts, event_id))
+    q = q.order_by(models.Event.ts.desc(), models.Event.event_id.desc()).limit(limit)
+    return db.execute(q).all()
+
+
+def iter_event_pages(db: Session, event_type: Optional[str], actor_id: Optional[str], request_id: Optional[str], tool_item_id: Optional[str], batch_rows: int = EXPORT_BATCH_ROWS):
+    return _iter_pages(
+        db,
+        lambda cursor, limit: list_events(db, event_type, actor_id, request_id, tool_item_id, limit, cursor),
+        "ts",
+        "event_id",
+        batch_rows,
+    )
 
 def get_event(db: Session, event_id: int):
     e = db.get(models.Event, event_id)
@@ -0,0 +1,313 @@
+"""
+Motion-cost model and item selection for dispense batches.
+
+A dispense cycle is what bridge.py runs for one request: SA_MOVE_TO_CAKE from
+park, the raw slot rotation that build_rotation_plan() issues (one
+SA_CAKE_ROTATE_SLOTS move along the shortest direction, or one
+MOVE_CAKE_CW_60 / MOVE_CAKE_CCW_60 per slot with ROTATION_SINGLE_MOVE=0),
+SA_ROTATE_TO_DISPENSE, SA_MOVE_TO_DOOR and SA_PARK. After a cycle the cake's
+current slot is the slot that was just dispensed, so which items a batch picks
+changes the rotation cost of every later pick on the same cake. Return
+batches are sequenced with the same model.
+
+Geometry and speeds default to btt-config/stepper-setup (vars.cfg / macros.cfg)
+and can be overridden with PLANNER_* env vars. Time spent waiting for the user
+at the door is not motion and is not counted.
+"""
+from __future__ import annotations
+
+import itertools
+import math
+import os
+from dataclasses import dataclass
+
+SLOTS_PER_CAKE = int(os.getenv("SLOTS_PER_CAKE", "6"))
+
+PLANNER_CAKE_STEPS_PER_SLOT = int(os.getenv("PLANNER_CAKE_STEPS_PER_SLOT", "21333"))
+PLANNER_CAKE_DISPENSE_OFFSET = int(os.getenv("PLANNER_CAKE_DISPENSE_OFFSET", "10666"))
+PLANNER_CAKE_SPEED = float(os.getenv("PLANNER_CAKE_SPEED", "12000"))
+PLANNER_CAKE_ACCEL = float(os.getenv("PLANNER_CAKE_ACCEL", "25000"))
+PLANNER_X_SPEED = float(os.getenv("PLANNER_X_SPEED", "15000"))
+PLANNER_X_ACCEL = float(os.getenv("PLANNER_X_ACCEL", "30000"))
+PLANNER_Z_SPEED = float(os.getenv("PLANNER_Z_SPEED", "12000"))
+PLANNER_Z_ACCEL = float(os.getenv("PLANNER_Z_ACCEL", "30000"))
+PLANNER_CAKE_CENTER_X = int(os.getenv("PLANNER_CAKE_CENTER_X", "49200"))
+PLANNER_DOOR_X = int(os.getenv("PLANNER_DOOR_X", "60000"))
+PLANNER_DOOR_Z = int(os.getenv("PLANNER_DOOR_Z", "0"))
+PLANNER_PARK_X = int(os.getenv("PLANNER_PARK_X", "0"))
+PLANNER_PARK_Z = int(os.getenv("PLANNER_PARK_Z", "0"))
+PLANNER_TRAVEL_Z = int(os.getenv("PLANNER_TRAVEL_Z", "2000"))
+# Comma-separated Z heights for cakes 1..N.
+PLANNER_CAKE_Z = os.getenv("PLANNER_CAKE_Z", "38800,32000,25000,18000,11000,4000")
+# Mirrors the bridge's ROTATION_SINGLE_MOVE: one move for the whole rotation vs one per slot.
+PLANNER_SINGLE_MOVE_ROTATION = os.getenv("PLANNER_SINGLE_MOVE_ROTATION", "1") == "1"
+# Set when the bridge runs with DISPENSE_OVERLAP_ROTATION=1: the slot rotation then
+# runs under the gantry's move to the cake instead of after it.
+PLANNER_OVERLAP_ROTATION = os.getenv("PLANNER_OVERLAP_ROTATION", "0") == "1"
+# Branch-and-bound node budget per batch; the greedy plan is used as-is past it.
+PLANNER_MAX_EXPANSIONS = int(os.getenv("PLANNER_MAX_EXPANSIONS", "20000"))
+
+
+def move_s(distance: float, speed: float, accel: float) -> float:
+    """Duration of one trapezoidal (or triangular) move, as MANUAL_STEPPER plans it."""
+    distance = abs(distance)
+    if distance <= 0:
+        return 0.0
+    if distance <= speed * speed / accel:
+        return 2.0 * math.sqrt(distance / accel)
+    return distance / speed + speed / accel
+
+
+def signed_slot_delta(source: int, target: int) -> int:
+    # Same shortest-direction rule as bridge.signed_slot_delta().
+    source %= SLOTS_PER_CAKE
+    target %= SLOTS_PER_CAKE
+    raw = target - source
+    if raw > SLOTS_PER_CAKE // 2:
+        raw -= SLOTS_PER_CAKE
+    elif raw < -(SLOTS_PER_CAKE // 2):
+        raw += SLOTS_PER_CAKE
+    return raw
+
+
+@dataclass(frozen=True)
+class MotionModel:
+    cake_steps_per_slot: int = PLANNER_CAKE_STEPS_PER_SLOT
+    cake_dispense_offset: int = PLANNER_CAKE_DISPENSE_OFFSET
+    cake_speed: float = PLANNER_CAKE_SPEED
+    cake_accel: float = PLANNER_CAKE_ACCEL
+    x_speed: float = PLANNER_X_SPEED
+    x_accel: float = PLANNER_X_ACCEL
+    z_speed: float = PLANNER_Z_SPEED
+    z_accel: float = PLANNER_Z_ACCEL
+    cake_center_x: int = PLANNER_CAKE_CENTER_X
+    door_x: int = PLANNER_DOOR_X
+    door_z: int = PLANNER_DOOR_Z
+    park_x: int = PLANNER_PARK_X
+    park_z: int = PLANNER_PARK_Z
+    travel_z: int = PLANNER_TRAVEL_Z
+    cake_z: tuple[int, ...] = tuple(int(z) for z in PLANNER_CAKE_Z.split(",") if z.strip())
+    single_move_rotation: bool = PLANNER_SINGLE_MOVE_ROTATION
+    overlap_rotation: bool = PLANNER_OVERLAP_ROTATION
+
+    def _x(self, a: int, b: int) -> float:
+        return move_s(b - a, self.x_speed, self.x_accel)
+
+    def _z(self, a: int, b: int) -> float:
+        return move_s(b - a, self.z_speed, self.z_accel)
+
+    def _cake_height(self, cake_num: int) -> int:
+        if not 1 <= cake_num <= len(self.cake_z):
+            raise ValueError(f"invalid_cake_id:{cake_num}")
+        return self.cake_z[cake_num - 1]
+
+    def rotation_s(self, delta_slots: int) -> float:
+        if self.single_move_rotation:
+            return move_s(abs(delta_slots) * self.cake_steps_per_slot, self.cake_speed, self.cake_accel)
+        # One full accel/cruise/decel move per slot, as the raw 60 degree macros run.
+        return abs(delta_slots) * move_s(self.cake_steps_per_slot, self.cake_speed, self.cake_accel)
+
+    def dispense_s(self) -> float:
+        pulse = self.cake_steps_per_slot + self.cake_dispense_offset
+        return (
+            move_s(pulse, self.cake_speed, self.cake_accel)
+            + move_s(self.cake_dispense_offset, self.cake_speed, self.cake_accel)
+        )
+
+    def to_cake_s(self, cake_num: int) -> float:
+        return self._x(self.park_x, self.cake_center_x) + self._z(self.park_z, self._cake_height(cake_num))
+
+    def gantry_s(self, cake_num: int) -> float:
+        """Park -> cake -> door -> park for one cycle."""
+        z = self._cake_height(cake_num)
+        to_cake = self.to_cake_s(cake_num)
+        to_door = self._z(z, self.travel_z) + self._x(self.cake_center_x, self.door_x) + self._z(self.travel_z, self.door_z)
+        to_park = self._z(self.door_z, self.travel_z) + self._x(self.door_x, self.park_x) + self._z(self.travel_z, self.park_z)
+        return to_cake + to_door + to_park
+
+    def cycle_s(self, cake_num: int, source_slot: int, target_slot: int) -> float:
+        rotation = self.rotation_s(signed_slot_delta(source_slot, target_slot))
+        if self.overlap_rotation:
+            # Only the part of the rotation that outlasts the move to the cake is on the clock.
+            rotation = max(0.0, rotation - self.to_cake_s(cake_num))
+        return self.gantry_s(cake_num) + rotation + self.dispense_s()
+
+
+DEFAULT_MOTION = MotionModel()
+
+
+@dataclass(frozen=True)
+class Candidate:
+    tool_item_id: str
+    tool_model_id: str
+    cake_num: int
+    live_slot: int
+
+
+@dataclass(frozen=True)
+class BatchPlan:
+    picks: list[Candidate]
+    estimated_s: float
+    cake_slots: dict[int, int]  # current slot per cake after the batch
+
+
+def estimate_duration(
+    picks: list[Candidate],
+    cake_slots: dict[int, int],
+    motion: MotionModel = DEFAULT_MOTION,
+) -> BatchPlan:
+    """Total motion time of dispensing `picks` in order, starting from `cake_slots`."""
+    slots = dict(cake_slots)
+    total = 0.0
+    for c in picks:
+        total += motion.cycle_s(c.cake_num, slots.get(c.cake_num, 0), c.live_slot)
+        slots[c.cake_num] = c.live_slot
+    return BatchPlan(picks=list(picks), estimated_s=total, cake_slots=slots)
+
+
+def _ordered(candidates: list[Candidate]) -> list[Candidate]:
+    return sorted(candidates, key=lambda c: (c.cake_num, c.live_slot, c.tool_item_id))
+
+
+def _greedy(need, pools, cake_slots, motion) -> list[Candidate]:
+    need = dict(need)
+    slots = dict(cake_slots)
+    used: set[str] = set()
+    picks: list[Candidate] = []
+    for _ in range(sum(need.values())):
+        best = None
+        best_cost = 0.0
+        for tool_model_id, n in need.items():
+            if n <= 0:
+                continue
+            for c in pools[tool_model_id]:
+                if c.tool_item_id in used:
+                    continue
+                cost = motion.cycle_s(c.cake_num, slots.get(c.cake_num, 0), c.live_slot)
+                if best is None or cost < best_cost:
+                    best, best_cost = c, cost
+        need[best.tool_model_id] -= 1
+        used.add(best.tool_item_id)
+        slots[best.cake_num] = best.live_slot
+        picks.append(best)
+    return picks
+
+
+def plan_batch(
+    units: list[str],
+    candidates: list[Candidate],
+    cake_slots: dict[int, int],
+    motion: MotionModel = DEFAULT_MOTION,
+    *,
+    max_expansions: int = PLANNER_MAX_EXPANSIONS,
+) -> BatchPlan | None:
+    """
+    Pick one candidate per unit (a tool_model_id) and the order to dispense
+    them in, minimising total motion time. The returned picks are in
+    execution order and are meant to be persisted as-is.
+
+    Every cycle starts and ends at park, so the gantry legs cost the same in
+    any order; order only matters through each cake's rotation from the slot
+    its previous pick left it at. Picks on different cakes therefore commute,
+    and the depth-first branch-and-bound only walks sequences grouped by cake
+    number, starting from the greedy cheapest-next-cycle plan, until the node
+    budget runs out. Returns None if some model does not have enough candidates.
+    """
+    pools: dict[str, list[Candidate]] = {}
+    for c in _ordered(candidates):
+        pools.setdefault(c.tool_model_id, []).append(c)
+    need: dict[str, int] = {}
+    for tool_model_id in units:
+        need[tool_model_id] = need.get(tool_model_id, 0) + 1
+    if any(len(pools.get(m, [])) < n for m, n in need.items()):
+        return None
+    if not units:
+        return BatchPlan(picks=[], estimated_s=0.0, cake_slots=dict(cake_slots))
+
+    best_picks = _greedy(need, pools, cake_slots, motion)
+    best_cost = estimate_duration(best_picks, cake_slots, motion).estimated_s
+
+    # Lower bound per remaining unit: cheapest gantry + dispense of its model, no rotation.
+    floor = {m: min(motion.gantry_s(c.cake_num) for c in pools[m]) + motion.dispense_s() for m in need}
+
+    budget = [max_expansions]
+    slots = dict(cake_slots)
+    used: set[str] = set()
+    path: list[Candidate] = []
+
+    def dfs(left: int, cost: float, floor_left: float):
+        nonlocal best_cost, best_picks
+        if cost + floor_left >= best_cost - 1e-9:
+            return
+        if left == 0:
+            best_cost, best_picks = cost, list(path)
+            return
+        last_cake = path[-1].cake_num if path else 0
+        options = []
+        for tool_model_id, n in need.items():
+            if n <= 0:
+                continue
+            for c in pools[tool_model_id]:
+                if c.cake_num >= last_cake and c.tool_item_id not in used:
+                    options.append((motion.cycle_s(c.cake_num, slots.get(c.cake_num, 0), c.live_slot), c))
+        options.sort(key=lambda o: o[0])
+        for step, c in options:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+            prev = slots.get(c.cake_num, 0)
+            need[c.tool_model_id] -= 1
+            used.add(c.tool_item_id)
+            slots[c.cake_num] = c.live_slot
+            path.append(c)
+            dfs(left - 1, cost + step, floor_left - floor[c.tool_model_id])
+            path.pop()
+            slots[c.cake_num] = prev
+            used.discard(c.tool_item_id)
+            need[c.tool_model_id] += 1
+
+    dfs(len(units), 0.0, sum(floor[m] * n for m, n in need.items()))
+    return estimate_duration(best_picks, cake_slots, motion)
+
+
+def _rotation_order(picks: list[Candidate], start_slot: int, motion: MotionModel) -> list[Candidate]:
+    if len(picks) <= 1:
+        return list(picks)
+    if len(picks) <= SLOTS_PER_CAKE:
+        best, best_cost = None, 0.0
+        for perm in itertools.permutations(picks):
+            slot, cost = start_slot, 0.0
+            for c in perm:
+                cost += motion.rotation_s(signed_slot_delta(slot, c.live_slot))
+                slot = c.live_slot
+            if best is None or cost < best_cost - 1e-9:
+                best, best_cost = list(perm), cost
+        return best
+    remaining, slot, out = list(picks), start_slot, []
+    while remaining:
+        nxt = min(remaining, key=lambda c: abs(signed_slot_delta(slot, c.live_slot)))
+        remaining.remove(nxt)
+        out.append(nxt)
+        slot = nxt.live_slot
+    return out
+
+
+def order_picks(
+    picks: list[Candidate],
+    cake_slots: dict[int, int],
+    motion: MotionModel = DEFAULT_MOTION,
+) -> BatchPlan:
+    """
+    Execution order for already-chosen picks (return batches, where the slot
+    for each item is fixed up front): grouped by cake in cake-number order,
+    and within a cake the slot order needing the least rotation from the
+    cake's current slot. Gantry legs cost the same in any order, so only the
+    per-cake rotation order changes the estimate. Ties keep the given order.
+    """
+    by_cake: dict[int, list[Candidate]] = {}
+    for c in picks:
+        by_cake.setdefault(c.cake_num, []).append(c)
+    ordered: list[Candidate] = []
+    for cake_num in sorted(by_cake):
+        ordered.extend(_rotation_order(by_cake[cake_num], cake_slots.get(cake_num, 0), motion))
+    return estimate_duration(ordered, cake_slots, motion)
@@ -2,6 +2,7 @@ from datetime import datetime
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from .. import models
+from ..entity_cache import entity_cache
 
 
 def now():
@@ -34,7 +35,7 @@ def apply_dispense_event(db: Session, payload: dict):
     elif stage == "succeeded":
         req.hw_status = "dispensed_ok"
 
-        tool = db.get(models.ToolItem, req.tool_item_id)
+        tool = entity_cache.tool_item(db, req.tool_item_id)
         if tool:
             slot_index = _parse_slot(req.slot_id)
             slot_state = db.get(models.CakeSlotState, {"cake_id": tool.cake_id, "slot_index": slot_index})
@@ -106,7 +107,7 @@ def apply_return_event(db: Session, payload: dict):
             loan.returned_at = now()
             loan.status = "returned"
 
-        tool = db.get(models.ToolItem, req.tool_item_id)
+        tool = entity_cache.tool_item(db, req.tool_item_id)
         if tool:
             slot_index = _parse_slot(req.slot_id)
             slot_state = db.get(models.CakeSlotState, {"cake_id": tool.cake_id, "slot_index": slot_index})
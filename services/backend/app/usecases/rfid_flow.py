@@ -3,6 +3,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from .. import models
+from ..entity_cache import entity_cache
 
 
 def now():
@@ -10,9 +11,7 @@ def now():
 
 
 def get_user_by_card(db: Session, card_id: str):
-    u = db.execute(
-        select(models.User).where(models.User.card_id == card_id)
-    ).scalar_one_or_none()
+    u = entity_cache.user_by_card(db, card_id)
     print(f"FOUND USER: {u}")
     if not u:
         raise ValueError("card_not_recognized")
@@ -27,9 +26,7 @@ def get_user_by_card(db: Session, card_id: str):
 
 
 def confirm_tool_receipt(db: Session, user_id: str, tool_tag_id: str):
-    tool = db.execute(
-        select(models.ToolItem).where(models.ToolItem.tool_tag_id == tool_tag_id)
-    ).scalar_one_or_none()
+    tool = entity_cache.tool_item_by_tag(db, tool_tag_id)
     if not tool:
         raise ValueError("unknown_tool_tag")
 
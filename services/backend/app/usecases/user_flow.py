@@ -1,17 +1,30 @@
 from __future__ import annotations
 
+import os
 import re
 from datetime import datetime
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from .. import models
+from ..cake_state import cake_state
+from ..entity_cache import entity_cache
+from . import dispense_planner
 
 ALLOWED_USER_STATUSES = ("good", "active", "delinquent")
 ACTIVE_LOAN_STATUSES = ("active", "overdue", "unconfirmed")
 RESERVED_HW_STATUSES = ("pending", "accepted", "in_progress", "waiting_user_confirm", "waiting_user_insert", "waiting_user_place")
 SLOTS_PER_CAKE = 6
 STORAGE_SLOT_MIN = 1
+# "motion": pick items that minimise estimated batch motion time (dispense_planner).
+# "legacy": per-model preferred (next slot) / fallback ordering by cake number.
+DISPENSE_PLANNER = os.getenv("DISPENSE_PLANNER", "motion")
+# Execution order of a batch's requests; created_at/request_id order legacy rows.
+BATCH_ORDER = (
+    models.LoanRequest.sequence.asc(),
+    models.LoanRequest.created_at.asc(),
+    models.LoanRequest.request_id.asc(),
+)
 
 
 def now() -> datetime:
@@ -65,7 +78,7 @@ def storage_slots() -> list[int]:
 
 
 def must_user_active(db: Session, user_id: str) -> models.User:
-    u = db.get(models.User, user_id)
+    u = entity_cache.user(db, user_id)
     if not u:
         raise ValueError("invalid_user")
     if u.status == "banned" or u.status not in ALLOWED_USER_STATUSES:
@@ -73,68 +86,23 @@ def must_user_active(db: Session, user_id: str) -> models.User:
     return u
 
 
-def _pending_cake_slot_state(db: Session, cake_id: str, slot_index: int) -> models.CakeSlotState | None:
-    for obj in db.new:
-        if isinstance(obj, models.CakeSlotState) and obj.cake_id == cake_id and int(obj.slot_index) == int(slot_index):
-            return obj
-    return None
-
-
-def _pending_cake_state(db: Session, cake_id: str) -> models.CakeState | None:
-    for obj in db.new:
-        if isinstance(obj, models.CakeState) and obj.cake_id == cake_id:
-            return obj
-    return None
-
-
 def _ensure_slot_state_seeded(db: Session, tool: models.ToolItem):
-    slot_index = parse_slot_index(tool.slot_id)
-
-    pending = _pending_cake_slot_state(db, tool.cake_id, slot_index)
-    if pending is not None:
-        return pending
-
-    state = db.get(models.CakeSlotState, {"cake_id": tool.cake_id, "slot_index": slot_index})
-    if state is None:
-        state = models.CakeSlotState(
-            cake_id=tool.cake_id,
-            slot_index=slot_index,
-            tool_item_id=tool.tool_item_id,
-        )
-        db.add(state)
-        return state
-
     # IMPORTANT:
     # Do NOT repopulate an existing empty live slot from ToolItem.slot_id.
     # CakeSlotState is now the live source of truth.
-    return state
+    cake_state.ensure_slot(db, tool.cake_id, parse_slot_index(tool.slot_id), tool.tool_item_id)
 
 
 def _ensure_cake_state_seeded(db: Session, cake_id: str):
-    pending = _pending_cake_state(db, cake_id)
-    if pending is not None:
-        return pending
-
-    row = db.get(models.CakeState, cake_id)
-    if row is None:
-        row = models.CakeState(cake_id=cake_id, current_slot=0)
-        db.add(row)
-        return row
-    return row
+    cake_state.ensure_cake(db, cake_id)
 
 
 def get_cake_current_slot(db: Session, cake_id: str) -> int:
-    row = _ensure_cake_state_seeded(db, cake_id)
-    db.flush()
-    assert row is not None
-    return int(row.current_slot)
+    return cake_state.ensure_cake(db, cake_id)
 
 
 def set_cake_current_slot(db: Session, cake_id: str, slot: int):
-    row = _ensure_cake_state_seeded(db, cake_id)
-    db.flush()
-    assert row is not None
-    row.current_slot = normalize_slot(slot)
+    cake_state.set_current_slot(db, cake_id, normalize_slot(slot))
 
 
 def _is_tool_item_available(db: Session, tool_item_id: str) -> bool:
@@ -158,72 +126,119 @@ def _is_tool_item_available(db: Session, tool_item_id: str) -> bool:
 
 
 def _current_slot_for_tool(db: Session, tool_item_id: str) -> int:
-    rows = db.execute(
-        select(models.CakeSlotState)
-        .where(models.CakeSlotState.tool_item_id == tool_item_id)
-        .order_by(models.CakeSlotState.slot_index.asc())
-    ).scalars().all()
-    if not rows:
-        tool = db.get(models.ToolItem, tool_item_id)
+    slot_indexes = [slot_index for _, slot_index in cake_state.tool_slots(db, tool_item_id)]
+    tool = None
+    if not slot_indexes:
+        tool = entity_cache.tool_item(db, tool_item_id)
         if not tool:
             raise ValueError("invalid_tool_item")
-        return parse_slot_index(tool.slot_id)
+    return _live_slot_from_indexes(slot_indexes, tool)
+
 
-    for row in rows:
-        slot_index = int(row.slot_index)
+def _live_slot_from_indexes(slot_indexes: list[int], tool: models.ToolItem | None) -> int:
+    # First non-home live slot, else the normalized home slot, else the static slot_id.
+    if not slot_indexes:
+        return parse_slot_index(tool.slot_id)
+    slot_indexes = sorted(slot_indexes)
+    for slot_index in slot_indexes:
         if slot_index != 0:
             return slot_index
-    return normalize_storage_slot(int(rows[0].slot_index))
+    return normalize_storage_slot(slot_indexes[0])
 
 
-def _allocate_tool_item_for_model(
+def _dispense_candidates(
     db: Session,
     tool_model_id: str,
     *,
     reserved_tool_item_ids: set[str] | None = None,
-) -> models.ToolItem | None:
+) -> list[tuple[models.ToolItem, int, int]]:
+    """
+    Available items of a model as (tool_item, live_slot, cake_current_slot).
+
+    Availability is loaded with one joined query for all candidates; cake current
+    slot and live slot positions come from the in-memory cake state.
+    """
     reserved_tool_item_ids = reserved_tool_item_ids or set()
 
-    candidates = db.execute(
-        select(models.ToolItem).where(
+    active_loan = (
+        select(models.Loan.loan_id)
+        .where(
+            models.Loan.tool_item_id == models.ToolItem.tool_item_id,
+            models.Loan.returned_at.is_(None),
+            models.Loan.status.in_(ACTIVE_LOAN_STATUSES),
+        )
+        .exists()
+    )
+    inflight = (
+        select(models.LoanRequest.request_id)
+        .where(
+            models.LoanRequest.tool_item_id == models.ToolItem.tool_item_id,
+            models.LoanRequest.request_type == "dispense",
+            models.LoanRequest.hw_status.in_(RESERVED_HW_STATUSES),
+        )
+        .exists()
+    )
+    candidate_rows = db.execute(
+        select(models.ToolItem, active_loan, inflight).where(
             models.ToolItem.tool_model_id == tool_model_id,
             models.ToolItem.is_active.is_(True),
         )
-    ).scalars().all()
+    ).all()
 
-    preferred: list[tuple[int, models.ToolItem]] = []
-    fallback: list[tuple[int, models.ToolItem]] = []
-    for ti in candidates:
+    out: list[tuple[models.ToolItem, int, int]] = []
+    for ti, has_active_loan, is_inflight in candidate_rows:
         if ti.tool_item_id in reserved_tool_item_ids:
             continue
         _ensure_slot_state_seeded(db, ti)
-        _ensure_cake_state_seeded(db, ti.cake_id)
-        if not _is_tool_item_available(db, ti.tool_item_id):
-            continue
         current_cake_slot = get_cake_current_slot(db, ti.cake_id)
-        target_slot = next_storage_slot(current_cake_slot)
-        entry = (parse_cake_num(ti.cake_id), ti)
-        if _current_slot_for_tool(db, ti.tool_item_id) == target_slot:
+        if has_active_loan or is_inflight:
+            continue
+        out.append((ti, _current_slot_for_tool(db, ti.tool_item_id), current_cake_slot))
+    return out
+
+
+def _allocate_tool_items_for_model(
+    db: Session,
+    tool_model_id: str,
+    qty: int,
+    *,
+    reserved_tool_item_ids: set[str] | None = None,
+) -> list[tuple[models.ToolItem, int]]:
+    """
+    Pick up to `qty` available items of a model in one pass, using the
+    preferred (live slot == next storage slot) / fallback ordering of the
+    per-item path. Returns (tool_item, live_slot) pairs.
+    """
+    preferred: list[tuple[int, models.ToolItem, int]] = []
+    fallback: list[tuple[int, models.ToolItem, int]] = []
+    for ti, live_slot, current_cake_slot in _dispense_candidates(
+        db, tool_model_id, reserved_tool_item_ids=reserved_tool_item_ids
+    ):
+        entry = (parse_cake_num(ti.cake_id), ti, live_slot)
+        if live_slot == next_storage_slot(current_cake_slot):
             preferred.append(entry)
         else:
             fallback.append(entry)
 
-    if preferred:
-        preferred.sort(key=lambda x: x[0])
-        return preferred[0][1]
-    if fallback:
-        fallback.sort(key=lambda x: x[0])
-        return fallback[0][1]
-    return None
+    preferred.sort(key=lambda x: x[0])
+    fallback.sort(key=lambda x: x[0])
+    return [(ti, live_slot) for _, ti, live_slot in (preferred + fallback)[:qty]]
+
+
+def _allocate_tool_item_for_model(
+    db: Session,
+    tool_model_id: str,
+    *,
+    reserved_tool_item_ids: set[str] | None = None,
+) -> models.ToolItem | None:
+    picked = _allocate_tool_items_for_model(db, tool_model_id, 1, reserved_tool_item_ids=reserved_tool_item_ids)
+    return picked[0][0] if picked else None
 
 def remap_cake_home(db: Session, cake_id: str, old_home_slot: int):
     old_home_slot = normalize_slot(old_home_slot)
 
-    rows = db.execute(
-        select(models.CakeSlotState).where(models.CakeSlotState.cake_id == cake_id)
-    ).scalars().all()
-
-    old_map = {int(r.slot_index): r.tool_item_id for r in rows}
+    view = cake_state.view(db, cake_id)
+    old_map = {idx: tool_item_id for idx, tool_item_id in enumerate(view.slots) if view.rows[idx]} if view else {}
     new_map = {}
 
     # compute rotated mapping
@@ -237,11 +252,7 @@ def remap_cake_home(db: Session, cake_id: str, old_home_slot: int):
 
     # rewrite slot state
     for slot in range(SLOTS_PER_CAKE):
-        row = db.get(models.CakeSlotState, {"cake_id": cake_id, "slot_index": slot})
-        if row is None:
-            row = models.CakeSlotState(cake_id=cake_id, slot_index=slot, tool_item_id=None)
-            db.add(row)
-        row.tool_item_id = new_map.get(slot)
+        cake_state.set_slot(db, cake_id, slot, new_map.get(slot))
 
     # set new logical home
     set_cake_current_slot(db, cake_id, 0)
@@ -252,15 +263,7 @@ def _allocate_return_slot(db: Session, cake_id: str, *, reserved_slots: set[int]
     current = get_cake_current_slot(db, cake_id)
 
     occupied = set(int(slot) for slot in reserved_slots)
-    occupied.update(
-        int(row.slot_index)
-        for row in db.execute(
-            select(models.CakeSlotState).where(
-                models.CakeSlotState.cake_id == cake_id,
-                models.CakeSlotState.tool_item_id.is_not(None),
-            )
-        ).scalars().all()
-    )
+    occupied.update(cake_state.view(db, cake_id).occupied())
 
     # Normal bounded case: current slot is a storage slot.
     if current in {1, 2, 3, 4, 5}:
@@ -276,6 +279,90 @@ def _allocate_return_slot(db: Session, cake_id: str, *, reserved_slots: set[int]
 
     raise ValueError(f"invalid_current_slot:{cake_id}:{current}")
 
+def plan_dispense(
+    db: Session,
+    items: list[dict],
+    *,
+    strategy: str | None = None,
+) -> tuple[list[tuple[models.ToolItem, int]], float]:
+    """
+    Choose concrete tool items for a dispense batch, in dispense order.
+
+    Returns (tool_item, target_slot) pairs and the estimated motion time of the
+    batch in seconds, so both strategies can be compared on the same state.
+    """
+    strategy = strategy or DISPENSE_PLANNER
+    units: list[str] = []
+    for item in items:
+        units.extend([item.get("tool_model_id")] * int(item.get("qty", 1)))
+
+    cake_slots: dict[int, int] = {}
+    by_id: dict[str, models.ToolItem] = {}
+    candidates: list[dispense_planner.Candidate] = []
+    if strategy == "legacy":
+        reserved_tool_item_ids: set[str] = set()
+        for item in items:
+            tool_model_id = item.get("tool_model_id")
+            qty = int(item.get("qty", 1))
+            picked = _allocate_tool_items_for_model(db, tool_model_id, qty, reserved_tool_item_ids=reserved_tool_item_ids)
+            if len(picked) < qty:
+                raise ValueError(f"not_enough_available_items:{tool_model_id}")
+            for ti, live_slot in picked:
+                reserved_tool_item_ids.add(ti.tool_item_id)
+                by_id[ti.tool_item_id] = ti
+                cake_num = parse_cake_num(ti.cake_id)
+                cake_slots.setdefault(cake_num, get_cake_current_slot(db, ti.cake_id))
+                candidates.append(dispense_planner.Candidate(ti.tool_item_id, tool_model_id, cake_num, live_slot))
+        plan = dispense_planner.estimate_duration(candidates, cake_slots)
+    else:
+        for tool_model_id in dict.fromkeys(units):
+            for ti, live_slot, current_cake_slot in _dispense_candidates(db, tool_model_id):
+                by_id[ti.tool_item_id] = ti
+                cake_num = parse_cake_num(ti.cake_id)
+                cake_slots[cake_num] = current_cake_slot
+                candidates.append(dispense_planner.Candidate(ti.tool_item_id, tool_model_id, cake_num, live_slot))
+        plan = dispense_planner.plan_batch(units, candidates, cake_slots)
+        if plan is None:
+            for tool_model_id in dict.fromkeys(units):
+                have = sum(1 for c in candidates if c.tool_model_id == tool_model_id)
+                if have < units.count(tool_model_id):
+                    raise ValueError(f"not_enough_available_items:{tool_model_id}")
+
+    return [(by_id[c.tool_item_id], c.live_slot) for c in plan.picks], plan.estimated_s
+
+
+def resequence_batch(db: Session, batch_id: str) -> float:
+    """
+    Renumber a batch's requests so the pending ones run in the cheapest order
+    under the motion model: grouped by cake, least rotation within a cake.
+    Used for return batches; dispense batches keep plan_batch's sequence.
+    Requests that already left "pending" keep their place ahead of them.
+    Returns the estimated motion time of the pending requests.
+    """
+    rows = db.execute(
+        select(models.LoanRequest).where(models.LoanRequest.batch_id == batch_id).order_by(*BATCH_ORDER)
+    ).scalars().all()
+    started = [r for r in rows if r.hw_status != "pending"]
+    pending: dict[str, models.LoanRequest] = {}
+    cake_slots: dict[int, int] = {}
+    picks: list[dispense_planner.Candidate] = []
+    for r in rows:
+        if r.hw_status != "pending":
+            continue
+        tool = entity_cache.tool_item(db, r.tool_item_id)
+        if not tool:
+            raise ValueError("invalid_tool_item")
+        cake_num = parse_cake_num(tool.cake_id)
+        cake_slots.setdefault(cake_num, get_cake_current_slot(db, tool.cake_id))
+        pending[r.tool_item_id] = r
+        picks.append(dispense_planner.Candidate(r.tool_item_id, tool.tool_model_id, cake_num, parse_slot_index(r.slot_id)))
+
+    plan = dispense_planner.order_picks(picks, cake_slots)
+    for seq, r in enumerate(started + [pending[c.tool_item_id] for c in plan.picks], start=1):
+        r.sequence = seq
+    return plan.estimated_s
+
+
 def create_dispense_batch(db: Session, user_id: str, items: list[dict], loan_period_hours: int):
     user = must_user_active(db, user_id)
     if not items:
@@ -283,7 +370,6 @@ def create_dispense_batch(db: Session, user_id: str, items: list[dict], loan_per
 
     batch_id = models.new_id("batch")
     request_ids: list[str] = []
-    reserved_tool_item_ids: set[str] = set()
     model_counts: dict[str, int] = {}
     idx = 0
 
@@ -295,7 +381,7 @@ def create_dispense_batch(db: Session, user_id: str, items: list[dict], loan_per
         if qty <= 0:
             raise ValueError("invalid_qty")
 
-        tm = db.get(models.ToolModel, tool_model_id)
+        tm = entity_cache.tool_model(db, tool_model_id)
         if not tm:
             raise ValueError(f"invalid_tool_model_id:{tool_model_id}")
 
@@ -315,33 +401,27 @@ def create_dispense_batch(db: Session, user_id: str, items: list[dict], loan_per
         if getattr(tm, "max_loan_hours", None) and int(loan_period_hours) > int(tm.max_loan_hours):
             raise ValueError(f"loan_period_exceeds_model_limit:{tool_model_id}")
 
-    for item in items:
-        tool_model_id = item.get("tool_model_id")
-        qty = int(item.get("qty", 1))
-        for _ in range(qty):
-            ti = _allocate_tool_item_for_model(db, tool_model_id, reserved_tool_item_ids=reserved_tool_item_ids)
-            if not ti:
-                raise ValueError(f"not_enough_available_items:{tool_model_id}")
-
-            reserved_tool_item_ids.add(ti.tool_item_id)
-            idx += 1
-            rid = f"{batch_id}_item_{idx}"
-            request_ids.append(rid)
-            target_slot = _current_slot_for_tool(db, ti.tool_item_id)
-            db.add(models.LoanRequest(
-                request_id=rid,
-                batch_id=batch_id,
-                request_type="dispense",
-                user_id=user.user_id,
-                tool_item_id=ti.tool_item_id,
-                slot_id=str(target_slot),
-                loan_period_hours=loan_period_hours,
-                hw_status="pending",
-                created_at=now(),
-            ))
+    # The planner already chose the execution order; persist it as-is.
+    picked, estimated_s = plan_dispense(db, items)
+    for ti, target_slot in picked:
+        idx += 1
+        rid = f"{batch_id}_item_{idx}"
+        request_ids.append(rid)
+        db.add(models.LoanRequest(
+            request_id=rid,
+            batch_id=batch_id,
+            request_type="dispense",
+            user_id=user.user_id,
+            tool_item_id=ti.tool_item_id,
+            slot_id=str(target_slot),
+            loan_period_hours=loan_period_hours,
+            hw_status="pending",
+            sequence=idx,
+            created_at=now(),
+        ))
 
     db.commit()
-    return {"batch_id": batch_id, "request_ids": request_ids}
+    return {"batch_id": batch_id, "request_ids": request_ids, "estimated_motion_s": round(estimated_s, 2)}
 
 
 def create_return_batch(db: Session, user_id: str, items: list[dict]):
@@ -373,7 +453,7 @@ def create_return_batch(db: Session, user_id: str, items: list[dict]):
         if not loan:
             raise ValueError("invalid_loan")
 
-        tool = db.get(models.ToolItem, tool_item_id)
+        tool = entity_cache.tool_item(db, tool_item_id)
         if not tool:
             raise ValueError("invalid_tool_item")
 
@@ -396,6 +476,8 @@ def create_return_batch(db: Session, user_id: str, items: list[dict]):
             created_at=now(),
         ))
 
+    db.flush()
+    resequence_batch(db, batch_id)
     db.commit()
     return {"batch_id": batch_id, "request_ids": request_ids}
 
@@ -404,7 +486,7 @@ def build_hw_payload(db: Session, request_id: str) -> dict:
     lr = db.get(models.LoanRequest, request_id)
     if not lr:
         raise ValueError("invalid_request")
-    tool = db.get(models.ToolItem, lr.tool_item_id)
+    tool = entity_cache.tool_item(db, lr.tool_item_id)
     if not tool:
         raise ValueError("invalid_tool_item")
     current_slot = get_cake_current_slot(db, tool.cake_id)
@@ -424,9 +506,12 @@ def build_hw_payload(db: Session, request_id: str) -> dict:
 
 
 def get_batch_status(db: Session, batch_id: str):
-    rows = db.execute(select(models.LoanRequest).where(models.LoanRequest.batch_id == batch_id)).scalars().all()
+    rows = db.execute(
+        select(models.LoanRequest).where(models.LoanRequest.batch_id == batch_id).order_by(*BATCH_ORDER)
+    ).scalars().all()
     return [{
         "request_id": r.request_id,
+        "sequence": r.sequence,
         "request_type": r.request_type,
         "tool_item_id": r.tool_item_id,
         "slot_id": r.slot_id,
@@ -462,18 +547,16 @@ def list_active_loans(db: Session, user_id: str):
 
 
 def get_cake_overview(db: Session):
-    cakes = db.execute(select(models.CakeState).order_by(models.CakeState.cake_id.asc())).scalars().all()
     out = []
-    for cake in cakes:
-        slot_rows = db.execute(
-            select(models.CakeSlotState).where(models.CakeSlotState.cake_id == cake.cake_id).order_by(models.CakeSlotState.slot_index.asc())
-        ).scalars().all()
-        slot_map = {int(s.slot_index): s.tool_item_id for s in slot_rows}
+    for cake_id in cake_state.cake_ids(db):
+        cake = cake_state.view(db, cake_id)
+        if cake is None or cake.current_slot is None:
+            continue
         slots = []
         for idx in range(SLOTS_PER_CAKE):
             slots.append({
                 "slot_index": idx,
-                "tool_item_id": None if idx == 0 else slot_map.get(idx),
+                "tool_item_id": None if idx == 0 else cake.slots[idx],
                 "is_storage_slot": idx != 0,
             })
         out.append({
@@ -481,4 +564,4 @@ def get_cake_overview(db: Session):
             "current_slot": cake.current_slot,
             "slots": slots,
         })
-    return out
\ No newline at end of file
+    return out
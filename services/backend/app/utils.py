@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import json
+from contextlib import contextmanager
 from functools import wraps
 from typing import Any, Callable, Dict, Optional, Tuple
 
+from sqlalchemy import event
+
 from .db import SessionLocal
 from . import models
 
@@ -22,6 +25,63 @@ def with_db(fn: Handler) -> Handler:
     return wrapper
 
 
+_UOW_KEY = "unit_of_work"
+_AFTER_COMMIT_KEY = "after_commit_callbacks"
+
+
+@contextmanager
+def unit_of_work(db):
+    """
+    Group everything done on `db` inside the block into one transaction.
+    Code that calls commit_or_flush() only flushes while the block is open;
+    the block commits once at the end, or rolls back if it raises.
+    """
+    db.info[_UOW_KEY] = True
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.info.pop(_UOW_KEY, None)
+
+
+def in_unit_of_work(db) -> bool:
+    return bool(db.info.get(_UOW_KEY))
+
+
+def commit_or_flush(db) -> None:
+    if in_unit_of_work(db):
+        db.flush()
+    else:
+        db.commit()
+
+
+def after_commit(db, fn: Callable[[], Any]) -> None:
+    """Run fn once the open unit of work commits (dropped on rollback); immediately otherwise."""
+    if in_unit_of_work(db):
+        db.info.setdefault(_AFTER_COMMIT_KEY, []).append(fn)
+    else:
+        fn()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _run_after_commit(db):
+    callbacks = db.info.pop(_AFTER_COMMIT_KEY, None) or []
+    for fn in callbacks:
+        try:
+            fn()
+        except Exception as e:
+            print(f"[UTILS] after_commit callback failed: {e}")
+
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _drop_after_commit(db, transaction):
+    if transaction.parent is None:
+        db.info.pop(_AFTER_COMMIT_KEY, None)
+
+
 def log_event(event_type: str, *, actor_type: str = "system") -> Callable[[Handler], Handler]:
     """Decorator to append an audit event entry after a function runs."""
     def deco(fn: Handler) -> Handler:
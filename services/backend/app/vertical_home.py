@@ -5,7 +5,10 @@ import sys
 import time
 from typing import Dict, Any
 
-import requests
+try:
+    from .moonraker import MoonrakerError, MoonrakerHttpClient
+except ImportError:  # run as /app/vertical_home.py by the bridge
+    from moonraker import MoonrakerError, MoonrakerHttpClient
 
 MOONRAKER_URL = os.getenv("MOONRAKER_URL", "http://host.docker.internal:7125").rstrip("/")
 TIMEOUT_S = float(os.getenv("MOONRAKER_TIMEOUT_S", "10"))
@@ -22,7 +25,14 @@ RIGHT_STEPPER = os.getenv("VERTICAL_RIGHT_STEPPER", "gantry2")
 LEFT_ENDSTOP_NAME = os.getenv("VERTICAL_LEFT_ENDSTOP_NAME", "manual_stepper gantry1").strip().lower()
 RIGHT_ENDSTOP_NAME = os.getenv("VERTICAL_RIGHT_ENDSTOP_NAME", "manual_stepper gantry2").strip().lower()
 
-session = requests.Session()
+# One keep-alive connection for the whole jog loop; no TTL cache, every endstop read must be live.
+client = MoonrakerHttpClient(
+    MOONRAKER_URL,
+    read_timeout_s=TIMEOUT_S,
+    endpoint_timeouts_s={"/printer/gcode/script": TIMEOUT_S},
+    pool_size=1,
+    cache_ttl_s=0.0,
+)
 
 
 def log(msg: str) -> None:
@@ -30,9 +40,7 @@ def log(msg: str) -> None:
 
 
 def get_printer_info() -> Dict[str, Any]:
-    r = session.get(f"{MOONRAKER_URL}/printer/info", timeout=TIMEOUT_S)
-    r.raise_for_status()
-    payload = r.json()
+    payload = client.get("/printer/info")
     return payload.get("result", payload)
 
 
@@ -48,26 +56,15 @@ def assert_printer_ready() -> None:
 def send_script(lines: list[str] | str) -> Dict[str, Any]:
     script = lines if isinstance(lines, str) else "\n".join(lines)
     log(f"[GCODE]\n{script}")
-    r = session.post(
-        f"{MOONRAKER_URL}/printer/gcode/script",
-        json={"script": script},
-        timeout=TIMEOUT_S,
-    )
     try:
-        r.raise_for_status()
-    except requests.HTTPError:
-        raise RuntimeError(f"G-code request failed:\nstatus={r.status_code}\nbody={r.text}") from None
-    payload = r.json()
+        payload = client.post("/printer/gcode/script", {"script": script})
+    except MoonrakerError as e:
+        raise RuntimeError(f"G-code request failed:\ncode={e.code}\nstatus={e.status}\nbody={e.reason}") from None
     return payload.get("result", payload)
 
 
 def query_endstops_raw() -> Dict[str, str]:
-    r = session.get(
-        f"{MOONRAKER_URL}/printer/query_endstops/status",
-        timeout=TIMEOUT_S,
-    )
-    r.raise_for_status()
-    payload = r.json()
+    payload = client.get("/printer/query_endstops/status")
     return payload.get("result", payload)
 
 
@@ -0,0 +1,111 @@
+"""
+Admin event listing: ORM list through EventOut vs Core keyset pages and the streaming export.
+
+Run from services/backend:
+
+    python -m bench.bench_admin_export --events 100000
+
+Seeds a throwaway SQLite database with --events rows and reports wall time
+and peak Python allocations (tracemalloc) for:
+
+  orm_list      what /admin/events did before: 5000 ORM Events validated into EventOut
+  core_page     one keyset page (limit 500) from deep in the table via a cursor
+  export_all    the NDJSON export of every row, drained batch by batch
+  orm_export    the same export built from one ORM query over every row
+
+The export's peak should stay flat as --events grows; the ORM export's grows with it.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+def _measure(fn) -> tuple[float, float, int]:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000.0, peak / 1e6, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=100000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmpdir) / 'bench.db'}"
+        os.environ["MACHINE_STATUS_PROBE_INTERVAL_S"] = "0"
+        from sqlalchemy import select
+
+        from app import db as app_db, models, schemas
+        from app.routers.admin import _encode_export
+        from app.usecases import admin_crud as uc
+
+        app_db.init_db()
+        start = datetime.now() - timedelta(days=30)
+        with app_db.SessionLocal() as db:
+            db.add_all(
+                models.Event(
+                    ts=start + timedelta(seconds=i),
+                    event_type="mqtt:igen/evt/dispense" if i % 3 else "admin:manual_home_all",
+                    actor_id="admin_1" if i % 3 == 0 else None,
+                    request_id=f"req_{i // 4}",
+                    payload_json=json.dumps({"request_id": f"req_{i // 4}", "stage": "succeeded", "i": i}),
+                )
+                for i in range(args.events)
+            )
+            db.commit()
+
+        columns = [c.key for c in uc.EVENT_COLUMNS]
+
+        def orm_list() -> int:
+            with app_db.ReadSessionLocal() as db:
+                rows = db.execute(select(models.Event).order_by(models.Event.ts.desc()).limit(5000)).scalars().all()
+                return len([schemas.EventOut.model_validate(r).model_dump() for r in rows])
+
+        with app_db.ReadSessionLocal() as db:
+            middle = db.execute(
+                select(models.Event.ts, models.Event.event_id).order_by(models.Event.ts.desc(), models.Event.event_id.desc()).offset(args.events // 2).limit(1)
+            ).one()
+        deep_cursor = uc.encode_cursor(middle.ts, middle.event_id)
+
+        def core_page() -> int:
+            with app_db.ReadSessionLocal() as db:
+                return len(uc.list_events(db, None, None, None, None, 500, deep_cursor))
+
+        def export_all() -> int:
+            db = app_db.ReadSessionLocal()
+            try:
+                return sum(len(chunk) for chunk in _encode_export(uc.iter_event_pages(db, None, None, None, None), columns, "ndjson"))
+            finally:
+                db.close()
+
+        def orm_export() -> int:
+            with app_db.ReadSessionLocal() as db:
+                rows = db.execute(select(models.Event).order_by(models.Event.ts.desc())).scalars().all()
+                return len("".join(json.dumps(schemas.EventOut.model_validate(r).model_dump(mode="json")) + "\n" for r in rows))
+
+        results = [(name, *_measure(fn)) for name, fn in (
+            ("orm_list", orm_list),
+            ("core_page", core_page),
+            ("export_all", export_all),
+            ("orm_export", orm_export),
+        )]
+
+    print(f"[BENCH] events={args.events}")
+    for name, ms, peak_mb, out in results:
+        print(f"[BENCH] {name:<11} {ms:9.1f}ms peak={peak_mb:7.2f}MB out={out}")
+
+
+if __name__ == "__main__":
+    main()
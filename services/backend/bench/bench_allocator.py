@@ -0,0 +1,165 @@
+"""
+Allocator benchmark: per-item legacy loop vs set-based allocation.
+
+Run from services/backend:
+
+    python -m bench.bench_allocator --items 3000 --qty 5
+
+Seeds a throwaway SQLite database with one tool model spread over many cakes,
+then times a qty-N allocation with both strategies and counts SQL statements.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def _setup(tmpdir: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmpdir) / 'bench.db'}"
+    from app import db as app_db
+    from app import models
+    from app.usecases import user_flow
+
+    app_db.init_db()
+    return app_db, models, user_flow
+
+
+def _seed(SessionLocal, models, user_flow, n_items: int, n_loaned: int):
+    s = SessionLocal()
+    s.add(models.User(user_id="bench_user", card_id="BENCH", first_name="B", last_name="U", role="student", status="good"))
+    s.add(models.ToolModel(tool_model_id="tm_bench", name="Bench Tool", category="Bench"))
+    storage = user_flow.storage_slots()
+    for i in range(n_items):
+        cake_id = f"cake_{i // len(storage) + 1}"
+        slot = storage[i % len(storage)]
+        tool_item_id = f"ti_{i}"
+        s.add(models.ToolItem(
+            tool_item_id=tool_item_id,
+            tool_model_id="tm_bench",
+            tool_tag_id=f"TAG-{i}",
+            cake_id=cake_id,
+            slot_id=str(slot),
+            is_active=True,
+        ))
+        s.add(models.CakeSlotState(cake_id=cake_id, slot_index=slot, tool_item_id=tool_item_id))
+        if slot == storage[0]:
+            s.add(models.CakeState(cake_id=cake_id, current_slot=(i // len(storage)) % user_flow.SLOTS_PER_CAKE))
+        if i < n_loaned:
+            s.add(models.Loan(
+                loan_id=f"loan_{i}",
+                user_id="bench_user",
+                tool_item_id=tool_item_id,
+                issued_at=models.utcnow(),
+                due_at=models.utcnow(),
+                status="active",
+            ))
+    s.commit()
+    s.close()
+
+
+def _legacy_allocate(db, user_flow, tool_model_id: str, qty: int):
+    # The original per-unit loop, reproduced from the helpers it called.
+    from sqlalchemy import select
+    from app import models
+
+    reserved: set[str] = set()
+    picked = []
+    for _ in range(qty):
+        candidates = db.execute(
+            select(models.ToolItem).where(
+                models.ToolItem.tool_model_id == tool_model_id,
+                models.ToolItem.is_active.is_(True),
+            )
+        ).scalars().all()
+        preferred, fallback = [], []
+        for ti in candidates:
+            if ti.tool_item_id in reserved:
+                continue
+            user_flow._ensure_slot_state_seeded(db, ti)
+            user_flow._ensure_cake_state_seeded(db, ti.cake_id)
+            if not user_flow._is_tool_item_available(db, ti.tool_item_id):
+                continue
+            target = user_flow.next_storage_slot(user_flow.get_cake_current_slot(db, ti.cake_id))
+            entry = (user_flow.parse_cake_num(ti.cake_id), ti)
+            if user_flow._current_slot_for_tool(db, ti.tool_item_id) == target:
+                preferred.append(entry)
+            else:
+                fallback.append(entry)
+        preferred.sort(key=lambda x: x[0])
+        fallback.sort(key=lambda x: x[0])
+        pool = preferred or fallback
+        if not pool:
+            break
+        ti = pool[0][1]
+        reserved.add(ti.tool_item_id)
+        picked.append((ti, user_flow._current_slot_for_tool(db, ti.tool_item_id)))
+    return picked
+
+
+def _set_allocate(db, user_flow, tool_model_id: str, qty: int):
+    return user_flow._allocate_tool_items_for_model(db, tool_model_id, qty)
+
+
+def _measure(engine, SessionLocal, fn, *args, repeat: int):
+    from sqlalchemy import event
+
+    counter = {"n": 0}
+
+    def _count(*_a, **_kw):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    timings = []
+    picked = []
+    try:
+        for _ in range(repeat):
+            db = SessionLocal()
+            counter["n"] = 0
+            t0 = time.perf_counter()
+            result = fn(db, *args)
+            timings.append((time.perf_counter() - t0) * 1000.0)
+            picked = [(ti.tool_item_id, slot) for ti, slot in result]
+            db.rollback()
+            db.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    timings.sort()
+    return {
+        "queries": counter["n"],
+        "p50_ms": timings[len(timings) // 2],
+        "max_ms": timings[-1],
+        "picked": picked,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=3000)
+    ap.add_argument("--loaned", type=int, default=500)
+    ap.add_argument("--qty", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app_db, models, user_flow = _setup(tmpdir)
+        _seed(app_db.SessionLocal, models, user_flow, args.items, args.loaned)
+
+        results = {}
+        if not args.skip_legacy:
+            results["legacy"] = _measure(app_db.engine, app_db.SessionLocal, lambda db: _legacy_allocate(db, user_flow, "tm_bench", args.qty), repeat=args.repeat)
+        results["set_based"] = _measure(app_db.engine, app_db.SessionLocal, lambda db: _set_allocate(db, user_flow, "tm_bench", args.qty), repeat=args.repeat)
+
+        print(f"[BENCH] items={args.items} loaned={args.loaned} qty={args.qty} repeat={args.repeat}")
+        for name, r in results.items():
+            print(f"[BENCH] {name:10s} queries={r['queries']:6d} p50={r['p50_ms']:9.2f}ms max={r['max_ms']:9.2f}ms")
+        if "legacy" in results:
+            same = results["legacy"]["picked"] == results["set_based"]["picked"]
+            print(f"[BENCH] same_selection={same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Per-dispense cycle time through Bridge2: sequential vs overlapped cake rotation.
+
+Run from services/backend:
+
+    python -m bench.bench_dispense_cycle --dispenses 60
+    python -m bench.bench_dispense_cycle --sim-step-s 0.2 --time-scale 0.02
+
+Runs the same random dispenses (cake, current slot, target slot) twice per
+backend, once with DISPENSE_OVERLAP_ROTATION off and once on:
+
+  sim        Bridge2 in SIM mode; every stage sleeps --sim-step-s.
+  emulator   Bridge2 in MOONRAKER mode against bench/moonraker_emulator.py,
+             which answers each gcode script after the machine time the SA_*
+             macros would take (sleeps scaled by --time-scale). Reported times
+             are unscaled machine seconds.
+
+The door confirmation is given as soon as the bridge waits for it, so the
+numbers are motion only.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import threading
+import time
+
+from app import bridge
+from bench.moonraker_emulator import MoonrakerEmulator
+
+
+def _dispenses(rng: random.Random, n: int) -> list[dict]:
+    out = []
+    for i in range(n):
+        out.append({
+            "request_id": f"bench_{i}",
+            "cake_id": rng.randint(1, 6),
+            "current_slot": rng.randrange(bridge.SLOTS_PER_CAKE),
+            "target_slot": rng.randrange(bridge.SLOTS_PER_CAKE),
+        })
+    return out
+
+
+def _run_one(br: bridge.Bridge2, payload: dict, timeout_s: float) -> str:
+    request_id = payload["request_id"]
+    done = threading.Event()
+    result = {}
+
+    def publish(topic: str, msg: dict):
+        if msg.get("request_id") != request_id:
+            return
+        if topic == bridge.TOPIC_EVT_HW_WAIT:
+            br._resolve_user_confirm(request_id, True)
+        elif topic == bridge.TOPIC_EVT_DISPENSE and msg.get("stage") in {"succeeded", "failed"}:
+            result["stage"] = msg["stage"]
+            result["error"] = msg.get("error_code")
+            done.set()
+
+    br._publish = publish
+    if br.cfg.mode == "SIM":
+        br._simulate_request_flow("dispense", dict(payload))
+    else:
+        threading.Thread(target=br._execute_request, args=("dispense", dict(payload)), daemon=True).start()
+    if not done.wait(timeout_s):
+        raise RuntimeError(f"{request_id} did not finish")
+    if result["stage"] != "succeeded":
+        raise RuntimeError(f"{request_id} failed: {result['error']}")
+    # The machine is released just after the final stage is published.
+    while br._active is not None:
+        time.sleep(0.001)
+    return result["stage"]
+
+
+def _bench_sim(dispenses: list[dict], step_s: float) -> dict[bool, list[float]]:
+    bridge.SIM_FAIL_RATE = 0.0
+    bridge.SIM_MIN_TIME_S = step_s
+    bridge.SIM_ACK_DELAY_S = 0.0
+    br = bridge.Bridge2(bridge.BridgeConfig(mode="SIM", moonraker_url="http://127.0.0.1:1", done_timeout_ms=30000))
+    out: dict[bool, list[float]] = {}
+    for overlap in (False, True):
+        bridge.DISPENSE_OVERLAP_ROTATION = overlap
+        times = []
+        for payload in dispenses:
+            t0 = time.perf_counter()
+            _run_one(br, payload, 60.0)
+            times.append(time.perf_counter() - t0)
+        out[overlap] = times
+    return out
+
+
+def _bench_emulator(dispenses: list[dict], time_scale: float) -> dict[bool, list[float]]:
+    emulator = MoonrakerEmulator(time_scale=time_scale).start()
+    try:
+        br = bridge.Bridge2(bridge.BridgeConfig(mode="MOONRAKER", moonraker_url=emulator.url, done_timeout_ms=30000))
+        out: dict[bool, list[float]] = {}
+        for overlap in (False, True):
+            bridge.DISPENSE_OVERLAP_ROTATION = overlap
+            emulator.reset()
+            times = []
+            for payload in dispenses:
+                before = emulator.busy_s
+                _run_one(br, payload, 600.0)
+                times.append(emulator.busy_s - before)
+            out[overlap] = times
+        return out
+    finally:
+        emulator.stop()
+
+
+def _report(name: str, unit: str, times: dict[bool, list[float]]):
+    seq, ovl = statistics.mean(times[False]), statistics.mean(times[True])
+    print(
+        f"[BENCH] {name:8s} sequential={seq:7.2f}{unit} overlapped={ovl:7.2f}{unit} "
+        f"saved={seq - ovl:6.2f}{unit} ({100.0 * (seq - ovl) / seq:4.1f}%)"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dispenses", type=int, default=60)
+    ap.add_argument("--sim-step-s", type=float, default=0.2)
+    ap.add_argument("--time-scale", type=float, default=0.02)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--skip-sim", action="store_true")
+    args = ap.parse_args()
+
+    dispenses = _dispenses(random.Random(args.seed), args.dispenses)
+    rotating = sum(1 for d in dispenses if bridge.signed_slot_delta(d["current_slot"], d["target_slot"]) != 0)
+    print(f"[BENCH] dispenses={len(dispenses)} with_rotation={rotating}")
+    # Bridge2 logs every stage and gcode line; keep the report readable.
+    if not args.skip_sim:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim = _bench_sim(dispenses, args.sim_step_s)
+        _report("sim", "s", sim)
+    with contextlib.redirect_stdout(io.StringIO()):
+        emulated = _bench_emulator(dispenses, args.time_scale)
+    _report("emulator", "s", emulated)
+
+
+if __name__ == "__main__":
+    main()
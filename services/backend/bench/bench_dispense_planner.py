@@ -0,0 +1,158 @@
+"""
+Dispense planner benchmark: legacy next-slot/cake-order picks vs motion-cost picks.
+
+Run from services/backend:
+
+    python -m bench.bench_dispense_planner --batches 500
+    python -m bench.bench_dispense_planner --db /path/to/copy-of-prod.db
+
+Without --db, seeds a throwaway SQLite database with six cakes of randomly
+placed tools and replays random batches, re-randomising the cake positions
+before each batch. With --db, the database is copied and every recorded
+dispense batch (loan_requests grouped by batch_id) is replayed against the
+copy's current inventory and cake state. Both strategies plan every batch from
+the same state; the reported durations are the motion model's estimates.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+
+def _setup(db_path: Path):
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    from app import db as app_db
+    from app import models
+    from app.usecases import user_flow
+
+    app_db.init_db()
+    return app_db, models, user_flow
+
+
+def _seed(SessionLocal, models, user_flow, rng: random.Random, n_cakes: int, n_models: int, fill: float):
+    s = SessionLocal()
+    for m in range(n_models):
+        s.add(models.ToolModel(tool_model_id=f"tm_{m}", name=f"Tool {m}", category="Bench"))
+    n = 0
+    for cake in range(1, n_cakes + 1):
+        cake_id = f"cake_{cake}"
+        s.add(models.CakeState(cake_id=cake_id, current_slot=0))
+        for slot in user_flow.storage_slots():
+            tool_item_id = None
+            if rng.random() < fill:
+                tool_item_id = f"ti_{n}"
+                n += 1
+                s.add(models.ToolItem(
+                    tool_item_id=tool_item_id,
+                    tool_model_id=f"tm_{rng.randrange(n_models)}",
+                    tool_tag_id=f"TAG-{tool_item_id}",
+                    cake_id=cake_id,
+                    slot_id=str(slot),
+                    is_active=True,
+                ))
+            s.add(models.CakeSlotState(cake_id=cake_id, slot_index=slot, tool_item_id=tool_item_id))
+    s.commit()
+    s.close()
+
+
+def _synthetic_batches(rng: random.Random, n_batches: int, n_models: int):
+    for _ in range(n_batches):
+        chosen = rng.sample(range(n_models), rng.randint(1, min(3, n_models)))
+        yield [{"tool_model_id": f"tm_{m}", "qty": rng.randint(1, 2)} for m in chosen]
+
+
+def _recorded_batches(db_path: Path):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT lr.batch_id, ti.tool_model_id, COUNT(*)
+            FROM loan_requests lr
+            JOIN tool_items ti ON ti.tool_item_id = lr.tool_item_id
+            WHERE lr.request_type = 'dispense'
+            GROUP BY lr.batch_id, ti.tool_model_id
+            ORDER BY MIN(lr.created_at), lr.batch_id
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    batches: dict[str, list[dict]] = {}
+    for batch_id, tool_model_id, qty in rows:
+        batches.setdefault(batch_id, []).append({"tool_model_id": tool_model_id, "qty": qty})
+    return list(batches.values())
+
+
+def _shuffle_cakes(SessionLocal, user_flow, rng: random.Random):
+    s = SessionLocal()
+    for cake_id in user_flow.cake_state.cake_ids(s):
+        user_flow.set_cake_current_slot(s, cake_id, rng.randrange(user_flow.SLOTS_PER_CAKE))
+    s.commit()
+    s.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", type=Path, default=None, help="replay recorded batches from a copy of this database")
+    ap.add_argument("--batches", type=int, default=500)
+    ap.add_argument("--cakes", type=int, default=6)
+    ap.add_argument("--models", type=int, default=8)
+    ap.add_argument("--fill", type=float, default=0.8)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = Path(tmpdir) / "bench.db"
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        app_db, models, user_flow = _setup(db_path)
+        if args.db:
+            batches = _recorded_batches(db_path)
+        else:
+            _seed(app_db.SessionLocal, models, user_flow, rng, args.cakes, args.models, args.fill)
+            batches = list(_synthetic_batches(rng, args.batches, args.models))
+
+        totals = {"legacy": 0.0, "motion": 0.0}
+        plan_ms = {"legacy": 0.0, "motion": 0.0}
+        planned = skipped = wins = 0
+        for items in batches:
+            if not args.db:
+                _shuffle_cakes(app_db.SessionLocal, user_flow, rng)
+            estimates = {}
+            try:
+                for strategy in ("legacy", "motion"):
+                    db = app_db.SessionLocal()
+                    try:
+                        t0 = time.perf_counter()
+                        _, estimates[strategy] = user_flow.plan_dispense(db, items, strategy=strategy)
+                        plan_ms[strategy] += (time.perf_counter() - t0) * 1000.0
+                    finally:
+                        db.rollback()
+                        db.close()
+            except ValueError:
+                skipped += 1
+                continue
+            planned += 1
+            for strategy, est in estimates.items():
+                totals[strategy] += est
+            if estimates["motion"] < estimates["legacy"] - 1e-9:
+                wins += 1
+
+        print(f"[BENCH] source={'replay:' + str(args.db) if args.db else 'synthetic'} batches={planned} skipped={skipped}")
+        for strategy, total in totals.items():
+            mean = total / planned if planned else 0.0
+            mean_ms = plan_ms[strategy] / planned if planned else 0.0
+            print(f"[BENCH] {strategy:7s} total_motion={total:10.1f}s mean_batch={mean:7.2f}s plan={mean_ms:6.2f}ms")
+        if planned and totals["legacy"]:
+            saved = 100.0 * (totals["legacy"] - totals["motion"]) / totals["legacy"]
+            print(f"[BENCH] motion_saves={saved:.1f}% improved_batches={wins}/{planned}")
+
+
+if __name__ == "__main__":
+    main()
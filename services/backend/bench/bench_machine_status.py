@@ -0,0 +1,108 @@
+"""
+Admin machine-status read: inline Moonraker probe + events fallback vs the collector.
+
+Run from services/backend:
+
+    python -m bench.bench_machine_status --events 50000 --reps 300
+
+Seeds a throwaway SQLite database with --events rows, a tenth of them
+machine-status reports, then times what /admin/manual/status did per request
+before the collector:
+
+  probe_up     one HTTP objects query to bench/moonraker_emulator.py
+  probe_down   Moonraker refusing connections, then the latest-status events query
+
+against MachineStatusCollector.snapshot(). A real unreachable Moonraker can
+also hang for the 3 s timeout on every request; that is not measured here.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib import request
+
+from bench.moonraker_emulator import MoonrakerEmulator
+
+_QUERY = "/printer/objects/query?toolhead=homed_axes,position&idle_timeout=state&print_stats=state,message"
+
+
+def _inline_probe(base_url: str) -> dict:
+    try:
+        with request.urlopen(f"{base_url}{_QUERY}", timeout=3.0) as resp:
+            return json.loads(resp.read().decode("utf-8") or "{}")
+    except Exception:
+        return {}
+
+
+def _time_us(fn, reps: int) -> float:
+    fn()
+    times = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=50000)
+    ap.add_argument("--reps", type=int, default=300)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmpdir) / 'bench.db'}"
+        os.environ["MACHINE_STATUS_PROBE_INTERVAL_S"] = "0"
+        from sqlalchemy import select
+
+        from app import db as app_db, models
+        from app.machine_status import STATUS_EVENT_TYPE, MachineStatusCollector, coerce_status, parse_objects_query
+
+        app_db.init_db()
+        start = datetime.now() - timedelta(days=1)
+        with app_db.SessionLocal() as db:
+            db.add_all(
+                models.Event(
+                    ts=start + timedelta(seconds=i),
+                    event_type=STATUS_EVENT_TYPE if i % 10 == 0 else "mqtt:igen/evt/dispense",
+                    payload_json=json.dumps({"state": "idle", "reachable": True, "position": [i, 0, 0]}),
+                )
+                for i in range(args.events)
+            )
+            db.commit()
+
+        def events_fallback() -> dict:
+            with app_db.SessionLocal() as db:
+                row = db.execute(
+                    select(models.Event)
+                    .where(models.Event.event_type == STATUS_EVENT_TYPE)
+                    .order_by(models.Event.ts.desc(), models.Event.event_id.desc())
+                    .limit(1)
+                ).scalars().first()
+                return coerce_status(json.loads(row.payload_json))
+
+        emulator = MoonrakerEmulator(time_scale=0.0).start()
+        try:
+            up = _time_us(lambda: parse_objects_query(_inline_probe(emulator.url)), args.reps)
+            down = _time_us(lambda: parse_objects_query(_inline_probe("http://127.0.0.1:1")) or events_fallback(), args.reps)
+        finally:
+            emulator.stop()
+
+        collector = MachineStatusCollector()
+        collector.load()
+        snap = _time_us(collector.snapshot, args.reps)
+
+    print(f"[BENCH] events={args.events} median per read")
+    print(f"[BENCH] inline probe_up   {up:9.1f}us")
+    print(f"[BENCH] inline probe_down {down:9.1f}us")
+    print(f"[BENCH] collector         {snap:9.1f}us")
+
+
+if __name__ == "__main__":
+    main()
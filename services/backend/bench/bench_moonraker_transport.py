@@ -0,0 +1,88 @@
+"""
+Moonraker transport overhead: urllib per call, pooled HTTP, one JSON-RPC websocket.
+
+Run from services/backend:
+
+    python -m bench.bench_moonraker_transport --reps 200
+
+Against bench/moonraker_emulator.py, times Bridge2._query_machine_status (four
+HTTP GETs, or two RPCs plus the subscribed status mirror) and a zero-motion
+gcode round trip (M400) through:
+
+  urllib        a new connection per call (MoonrakerClient before app/moonraker.py)
+  http_pooled   MoonrakerClient on the keep-alive pool, query cache off
+  http_cached   the same with the default object-query TTL cache
+  websocket     MoonrakerWsClient
+
+The emulator answers instantly, so the numbers are pure transport cost.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import statistics
+import json
+import time
+from urllib import request
+
+from app import bridge
+from bench.moonraker_emulator import MoonrakerEmulator
+
+
+class UrllibClient(bridge.MoonrakerClient):
+    def _json_request(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = request.Request(url=f"{self.base_url}{path}", data=data, headers={"Content-Type": "application/json"}, method=method)
+        with request.urlopen(req, timeout=self.http_timeout_s) as resp:
+            raw = resp.read().decode("utf-8")
+            return json.loads(raw) if raw else {}
+
+
+def _time_ms(fn, reps: int) -> tuple[float, float]:
+    fn()
+    times = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    times.sort()
+    return statistics.mean(times), times[int(0.95 * (len(times) - 1))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reps", type=int, default=200)
+    args = ap.parse_args()
+
+    emulator = MoonrakerEmulator(time_scale=0.0).start()
+    try:
+        br = bridge.Bridge2(bridge.BridgeConfig(mode="MOONRAKER", moonraker_url=emulator.url, done_timeout_ms=30000))
+        pooled = bridge.MoonrakerClient(emulator.url, 5.0)
+        pooled.http.cache_ttl_s = 0.0
+        clients = {
+            "urllib": UrllibClient(emulator.url, 5.0),
+            "http_pooled": pooled,
+            "http_cached": bridge.MoonrakerClient(emulator.url, 5.0),
+            "websocket": bridge.MoonrakerWsClient(emulator.url, 5.0, 30.0),
+        }
+        results = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, client in clients.items():
+                br.moonraker = client
+                results[name] = (
+                    _time_ms(br._query_machine_status, args.reps),
+                    _time_ms(lambda: client.send_gcode("M400"), args.reps),
+                )
+            clients["websocket"].close()
+        for name, ((status_mean, status_p95), (gcode_mean, gcode_p95)) in results.items():
+            print(
+                f"[BENCH] {name:11s} machine_status mean={status_mean:6.2f}ms p95={status_p95:6.2f}ms "
+                f"gcode mean={gcode_mean:6.2f}ms p95={gcode_p95:6.2f}ms"
+            )
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
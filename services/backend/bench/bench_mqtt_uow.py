@@ -0,0 +1,115 @@
+"""
+Inbound MQTT stage-event throughput: commit-per-step vs one unit of work per message.
+
+Run from services/backend:
+
+    python -m bench.bench_mqtt_uow --requests 200
+
+Each simulated request goes through the stage events the bridge emits for a
+dispense (accepted -> move_to_cake -> rotate_cake -> move_to_door ->
+waiting_user_confirm -> succeeded) and is fed through _handle_mqtt_message
+against a file-backed SQLite database. Outbound publishes are dropped.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+STAGES = ["accepted", "move_to_cake", "rotate_cake", "move_to_door", "waiting_user_confirm", "succeeded"]
+BATCH_SIZE = 5
+
+
+def _setup(tmpdir: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmpdir) / 'bench.db'}"
+    from app import db as app_db
+    from app import models
+    from app import mqtt as mqtt_mod
+
+    app_db.init_db()
+    mqtt_mod._publish = lambda *args, **kwargs: None
+    return app_db, models, mqtt_mod
+
+
+def _seed(SessionLocal, models, n_requests: int, prefix: str):
+    s = SessionLocal()
+    if s.get(models.User, "bench_user") is None:
+        s.add(models.User(user_id="bench_user", card_id="BENCH", first_name="B", last_name="U", role="student", status="good"))
+        s.add(models.ToolModel(tool_model_id="tm_bench", name="Bench Tool", category="Bench"))
+        s.commit()
+    for i in range(n_requests):
+        tool_item_id = f"{prefix}_ti_{i}"
+        s.add(models.ToolItem(
+            tool_item_id=tool_item_id,
+            tool_model_id="tm_bench",
+            tool_tag_id=f"{prefix}-TAG-{i}",
+            cake_id=f"cake_{i % 6 + 1}",
+            slot_id=str(i % 5 + 1),
+            is_active=True,
+        ))
+        s.add(models.LoanRequest(
+            request_id=f"{prefix}_batch_{i // BATCH_SIZE}_item_{i % BATCH_SIZE + 1}",
+            batch_id=f"{prefix}_batch_{i // BATCH_SIZE}",
+            request_type="dispense",
+            user_id="bench_user",
+            tool_item_id=tool_item_id,
+            slot_id=str(i % 5 + 1),
+            loan_period_hours=24,
+            hw_status="pending",
+        ))
+    s.commit()
+    s.close()
+
+
+def _run(mqtt_mod, n_requests: int, prefix: str) -> tuple[int, float]:
+    events = 0
+    t0 = time.perf_counter()
+    for i in range(n_requests):
+        request_id = f"{prefix}_batch_{i // BATCH_SIZE}_item_{i % BATCH_SIZE + 1}"
+        for stage in STAGES:
+            mqtt_mod._handle_mqtt_message("igen/evt/dispense", {"request_id": request_id, "stage": stage, "cake_id": i % 6 + 1})
+            events += 1
+    return events, time.perf_counter() - t0
+
+
+def _count_commits(engine):
+    from sqlalchemy import event
+
+    counter = {"n": 0}
+
+    def _on_commit(conn):
+        counter["n"] += 1
+
+    event.listen(engine, "commit", _on_commit)
+    return counter
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app_db, models, mqtt_mod = _setup(tmpdir)
+        commits = _count_commits(app_db.engine)
+
+        results = {}
+        for name, uow in (("commit_per_step", False), ("unit_of_work", True)):
+            _seed(app_db.SessionLocal, models, args.requests, name)
+            mqtt_mod.MQTT_UNIT_OF_WORK = uow
+            commits["n"] = 0
+            events, elapsed = _run(mqtt_mod, args.requests, name)
+            results[name] = (events, elapsed, commits["n"])
+
+        print(f"[BENCH] requests={args.requests} stages_per_request={len(STAGES)}")
+        for name, (events, elapsed, n_commits) in results.items():
+            print(
+                f"[BENCH] {name:16s} events={events} commits={n_commits} "
+                f"commits/event={n_commits / events:.2f} events/s={events / elapsed:8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
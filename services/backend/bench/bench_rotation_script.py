@@ -0,0 +1,62 @@
+"""
+Cake rotation cost: one MOVE_CAKE_*_60 per slot vs a single SA_CAKE_ROTATE_SLOTS move.
+
+Run from services/backend:
+
+    python -m bench.bench_rotation_script --reps 20
+
+For 1, 2 and 3 slot rotations, builds the bridge's rotation plan with
+ROTATION_SINGLE_MOVE off and on and runs it through Bridge2._execute_rotation_plan
+in MOONRAKER mode against bench/moonraker_emulator.py. The emulator charges
+each macro the machine time it would take (per-slot macros pay a full
+accelerate/decelerate cycle each); reported times are unscaled machine
+seconds, plus the number of gcode commands Klipper has to parse.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import statistics
+
+from app import bridge
+from bench.moonraker_emulator import MoonrakerEmulator
+
+
+def _measure(br: bridge.Bridge2, emulator: MoonrakerEmulator, slots: int, single: bool, reps: int) -> tuple[float, int]:
+    bridge.ROTATION_SINGLE_MOVE = single
+    times = []
+    lines = 0
+    for rep in range(reps):
+        plan = bridge.build_rotation_plan(1 + rep % 6, 0, slots)
+        emulator.reset()
+        br._execute_rotation_plan(f"bench_{slots}_{rep}", plan)
+        times.append(emulator.busy_s)
+        lines = sum(len([ln for ln in s.splitlines() if ln.strip()]) for s in emulator.scripts)
+    return statistics.mean(times), lines
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reps", type=int, default=20)
+    ap.add_argument("--time-scale", type=float, default=0.02)
+    args = ap.parse_args()
+
+    emulator = MoonrakerEmulator(time_scale=args.time_scale).start()
+    try:
+        br = bridge.Bridge2(bridge.BridgeConfig(mode="MOONRAKER", moonraker_url=emulator.url, done_timeout_ms=30000))
+        for slots in (1, 2, 3):
+            with contextlib.redirect_stdout(io.StringIO()):
+                per_slot_s, per_slot_lines = _measure(br, emulator, slots, False, args.reps)
+                single_s, single_lines = _measure(br, emulator, slots, True, args.reps)
+            print(
+                f"[BENCH] slots={slots} per_slot={per_slot_s:5.2f}s ({per_slot_lines} cmd) "
+                f"single_move={single_s:5.2f}s ({single_lines} cmd) "
+                f"saved={per_slot_s - single_s:5.2f}s ({100.0 * (per_slot_s - single_s) / per_slot_s:4.1f}%)"
+            )
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
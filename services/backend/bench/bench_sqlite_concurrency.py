@@ -0,0 +1,196 @@
+"""
+SQLite concurrency benchmark: kiosk/admin polling mixed with MQTT stage writes.
+
+Run from services/backend:
+
+    python -m bench.bench_sqlite_concurrency --seconds 10 --pollers 4
+
+Runs the same workload twice in fresh processes, once with the old engine
+settings (rollback journal, driver defaults, reads on the write engine) and
+once with the tuned profile from app/db.py (WAL, synchronous=NORMAL,
+busy_timeout, mmap, cache, temp_store, read-only pool). The profile is read
+at import time, hence the subprocesses.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+PROFILES = {
+    "default": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "",
+        "SQLITE_BUSY_TIMEOUT_MS": "",
+        "SQLITE_MMAP_SIZE": "",
+        "SQLITE_CACHE_SIZE_KB": "",
+        "SQLITE_TEMP_STORE": "",
+        "SQLITE_READ_POOL_SIZE": "0",
+    },
+    "tuned": {},
+}
+
+STAGES = ["accepted", "move_to_cake", "rotate_cake", "move_to_door", "waiting_user_confirm", "succeeded"]
+
+
+def _pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def _seed(SessionLocal, models, n_items: int):
+    s = SessionLocal()
+    s.add(models.User(user_id="bench_user", card_id="BENCH", first_name="B", last_name="U", role="student", status="good"))
+    for m in range(20):
+        s.add(models.ToolModel(tool_model_id=f"tm_{m}", name=f"Tool {m}", category="Bench"))
+    for i in range(n_items):
+        s.add(models.ToolItem(
+            tool_item_id=f"ti_{i}",
+            tool_model_id=f"tm_{i % 20}",
+            tool_tag_id=f"TAG-{i}",
+            cake_id=f"cake_{i % 6 + 1}",
+            slot_id=str(i % 5 + 1),
+            is_active=True,
+        ))
+        s.add(models.LoanRequest(
+            request_id=f"batch_{i // 5}_item_{i % 5 + 1}",
+            batch_id=f"batch_{i // 5}",
+            request_type="dispense",
+            user_id="bench_user",
+            tool_item_id=f"ti_{i}",
+            slot_id=str(i % 5 + 1),
+            loan_period_hours=24,
+            hw_status="pending",
+        ))
+    s.commit()
+    s.close()
+
+
+def _run_profile(args) -> dict:
+    from sqlalchemy.exc import OperationalError
+
+    from app import db as app_db
+    from app import models
+    from app import mqtt as mqtt_mod
+    from app.routers.user import catalog
+    from app.usecases.user_flow import get_batch_status
+
+    app_db.init_db()
+    mqtt_mod._publish = lambda *a, **kw: None
+    _seed(app_db.SessionLocal, models, args.items)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {"read_ms": [], "write_ms": [], "locked_errors": 0, "writes": 0, "reads": 0}
+
+    def record(kind: str, ms: float):
+        with lock:
+            stats[f"{kind}_ms"].append(ms)
+            stats[f"{kind}s"] += 1
+
+    def poller(idx: int):
+        n = 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with app_db.ReadSessionLocal() as db:
+                    catalog(db, search=None, category=None, limit=500)
+                    get_batch_status(db, f"batch_{(idx + n) % (args.items // 5)}")
+            except OperationalError as e:
+                if "locked" in str(e):
+                    with lock:
+                        stats["locked_errors"] += 1
+                    continue
+                raise
+            record("read", (time.perf_counter() - t0) * 1000.0)
+            n += 1
+            time.sleep(args.poll_interval_ms / 1000.0)
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            request_id = f"batch_{(i // len(STAGES)) % (args.items // 5)}_item_{(i // len(STAGES)) % 5 + 1}"
+            stage = STAGES[i % len(STAGES)]
+            t0 = time.perf_counter()
+            try:
+                mqtt_mod._handle_mqtt_message("igen/evt/dispense", {"request_id": request_id, "stage": stage})
+            except OperationalError as e:
+                if "locked" in str(e):
+                    with lock:
+                        stats["locked_errors"] += 1
+                    i += 1
+                    continue
+                raise
+            record("write", (time.perf_counter() - t0) * 1000.0)
+            i += 1
+
+    threads = [threading.Thread(target=poller, args=(i,), daemon=True) for i in range(args.pollers)]
+    threads.append(threading.Thread(target=writer, daemon=True))
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join(timeout=30)
+
+    slow = args.slow_ms
+    return {
+        "reads": stats["reads"],
+        "writes": stats["writes"],
+        "reads_per_s": stats["reads"] / args.seconds,
+        "writes_per_s": stats["writes"] / args.seconds,
+        "read_p95_ms": _pct(stats["read_ms"], 0.95),
+        "read_max_ms": max(stats["read_ms"] or [0.0]),
+        "write_p95_ms": _pct(stats["write_ms"], 0.95),
+        "write_max_ms": max(stats["write_ms"] or [0.0]),
+        "lock_waits": sum(1 for ms in stats["read_ms"] + stats["write_ms"] if ms > slow),
+        "locked_errors": stats["locked_errors"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--pollers", type=int, default=4)
+    ap.add_argument("--poll-interval-ms", type=float, default=5.0)
+    ap.add_argument("--items", type=int, default=500)
+    ap.add_argument("--slow-ms", type=float, default=50.0, help="ops slower than this count as lock waits")
+    ap.add_argument("--profile", choices=sorted(PROFILES), default=None)
+    args = ap.parse_args()
+
+    if args.profile:
+        print(json.dumps(_run_profile(args)))
+        return
+
+    results = {}
+    for name, overrides in PROFILES.items():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(os.environ)
+            env.update(overrides)
+            env["DATABASE_URL"] = f"sqlite:///{Path(tmpdir) / 'bench.db'}"
+            cmd = [sys.executable, "-m", "bench.bench_sqlite_concurrency", "--profile", name]
+            for flag in ("seconds", "pollers", "poll_interval_ms", "items", "slow_ms"):
+                cmd += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+            out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+            results[name] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"[BENCH] seconds={args.seconds} pollers={args.pollers} items={args.items} slow_ms={args.slow_ms}")
+    for name, r in results.items():
+        print(
+            f"[BENCH] {name:8s} reads/s={r['reads_per_s']:8.1f} writes/s={r['writes_per_s']:7.1f} "
+            f"read_p95={r['read_p95_ms']:7.2f}ms read_max={r['read_max_ms']:8.2f}ms "
+            f"write_p95={r['write_p95_ms']:7.2f}ms write_max={r['write_max_ms']:8.2f}ms "
+            f"lock_waits={r['lock_waits']} locked_errors={r['locked_errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Minimal Moonraker emulator for bench runs of bridge.py in MOONRAKER mode.
+
+Serves the endpoints Bridge2 touches (/server/info, /printer/info,
+/printer/objects/query, /printer/query_endstops/status, /printer/gcode/script)
+and the same methods as JSON-RPC on /websocket, including
+printer.objects.subscribe with notify_status_update after every script and
+notify_gcode_response for RESPOND lines. It answers each gcode script after the time the SA_* macros in
+btt-config/stepper-setup/macros-final.cfg would take on the machine. Durations
+come from the dispense planner's MotionModel. Scripts run one at a time, as
+Klipper's gcode mutex does.
+
+Gantry moves and cake moves are tracked on separate timelines: a cake move
+started with SA_CAKE_ROTATE_ASYNC keeps running while the gantry macros that
+follow it execute, and SA_CAKE_ROTATE_WAIT (or any blocking move on the same
+cake) waits for it. TIME_SCALE shrinks every sleep so a bench finishes quickly;
+`busy_s` reports unscaled machine time.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from app.bridge import WebSocket, ws_accept_key
+from app.usecases.dispense_planner import DEFAULT_MOTION, MotionModel, move_s
+
+
+def _params(parts: list[str]) -> dict[str, str]:
+    out = {}
+    for part in parts:
+        key, sep, value = part.partition("=")
+        if sep:
+            out[key.upper()] = value
+    return out
+
+
+class MachineTimeline:
+    """Machine time each SA_* macro line costs, with per-cake async moves."""
+
+    def __init__(self, motion: MotionModel = DEFAULT_MOTION):
+        self.motion = motion
+        self.x = motion.park_x
+        self.z = motion.park_z
+        self.cake_free_at: dict[int, float] = {}
+
+    def _x_to(self, x: int) -> float:
+        t = move_s(x - self.x, self.motion.x_speed, self.motion.x_accel)
+        self.x = x
+        return t
+
+    def _z_to(self, z: int) -> float:
+        t = move_s(z - self.z, self.motion.z_speed, self.motion.z_accel)
+        self.z = z
+        return t
+
+    def _via_travel(self, x: int, z: int) -> float:
+        return self._z_to(self.motion.travel_z) + self._x_to(x) + self._z_to(z)
+
+    def _cake_steps_s(self, steps: int) -> float:
+        return move_s(steps, self.motion.cake_speed, self.motion.cake_accel)
+
+    def run(self, script: str) -> float:
+        """Machine seconds until the script returns; async cake moves may still be running."""
+        now = 0.0
+        for line in script.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            name, p = parts[0].upper(), _params(parts[1:])
+            cake = int(p.get("CAKE", 0) or 0)
+            if name == "SA_MOVE_TO_CAKE":
+                now += self._x_to(self.motion.cake_center_x) + self._z_to(self.motion._cake_height(cake))
+            elif name == "SA_MOVE_TO_DOOR":
+                now += self._via_travel(self.motion.door_x, self.motion.door_z)
+            elif name == "SA_PARK":
+                now += self._via_travel(self.motion.park_x, self.motion.park_z)
+            elif name in {"MOVE_CAKE_CW_60", "MOVE_CAKE_CCW_60"}:
+                now = max(now, self.cake_free_at.get(cake, 0.0))
+                now += self._cake_steps_s(self.motion.cake_steps_per_slot)
+            elif name == "SA_CAKE_ROTATE_SLOTS":
+                now = max(now, self.cake_free_at.get(cake, 0.0))
+                now += self._cake_steps_s(abs(int(p.get("SLOTS", 0))) * self.motion.cake_steps_per_slot)
+            elif name == "SA_CAKE_ROTATE_ASYNC":
+                start = max(now, self.cake_free_at.get(cake, 0.0))
+                slots = abs(int(p.get("SLOTS", 0)))
+                self.cake_free_at[cake] = start + self._cake_steps_s(slots * self.motion.cake_steps_per_slot)
+            elif name == "SA_CAKE_ROTATE_WAIT":
+                now = max(now, self.cake_free_at.pop(cake, 0.0))
+            elif name == "SA_ROTATE_TO_DISPENSE":
+                now = max(now, self.cake_free_at.pop(cake, 0.0))
+                now += self.motion.dispense_s()
+        # Whatever is still turning carries over into the next script.
+        self.cake_free_at = {c: t - now for c, t in self.cake_free_at.items() if t > now}
+        return now
+
+
+class MoonrakerEmulator:
+    def __init__(self, time_scale: float = 0.01, motion: MotionModel = DEFAULT_MOTION, host: str = "127.0.0.1", port: int = 0):
+        self.time_scale = time_scale
+        self.timeline = MachineTimeline(motion)
+        self.scripts: list[str] = []
+        self.busy_s = 0.0
+        # Object fields set through notify_status(); later queries report them too.
+        self.status_overrides: dict[str, dict] = {}
+        # Command name -> Klipper error message; a script using it fails like action_raise_error.
+        self.errors: dict[str, str] = {}
+        # POSTs left to handle and then drop the connection on without replying,
+        # like a Moonraker restart between running a script and answering it.
+        self.drop_post_replies = 0
+        self._gcode_lock = threading.Lock()
+        self._ws_clients: set[WebSocket] = set()
+        self._ws_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MoonrakerEmulator":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._ws_lock:
+            clients = list(self._ws_clients)
+        for ws in clients:
+            ws.close()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._gcode_lock:
+            self.timeline = MachineTimeline(self.timeline.motion)
+            self.scripts.clear()
+            self.busy_s = 0.0
+
+    def run_script(self, script: str):
+        for line in script.splitlines():
+            parts = line.split()
+            if parts and parts[0].upper() in self.errors:
+                raise RuntimeError(self.errors[parts[0].upper()])
+        with self._gcode_lock:
+            machine_s = self.timeline.run(script)
+            self.scripts.append(script)
+            self.busy_s += machine_s
+            time.sleep(machine_s * self.time_scale)
+        for line in script.splitlines():
+            parts = line.split()
+            if parts and parts[0].upper() == "RESPOND":
+                p = _params(parts[1:])
+                self.notify("notify_gcode_response", [f"{p.get('PREFIX', 'echo:')} {p.get('MSG', '')}".strip()])
+        sa_state = self._status()["gcode_macro SA_STATE"]
+        self.notify_status({"gcode_macro SA_STATE": {"x_pos": sa_state["x_pos"], "z_pos": sa_state["z_pos"]}})
+
+    def notify(self, method: str, params: list):
+        raw = json.dumps({"jsonrpc": "2.0", "method": method, "params": params})
+        with self._ws_lock:
+            clients = list(self._ws_clients)
+        for ws in clients:
+            try:
+                ws.send_text(raw)
+            except OSError:
+                pass
+
+    def notify_status(self, changes: dict):
+        for name, fields in changes.items():
+            self.status_overrides.setdefault(name, {}).update(fields)
+        self.notify("notify_status_update", [changes, time.monotonic()])
+
+    def rpc(self, method: str, params: dict):
+        if method == "server.info":
+            return {"klippy_state": "ready", "klippy_connected": True}
+        if method == "printer.info":
+            return {"state": "ready", "state_message": "Printer is ready"}
+        if method in {"printer.objects.query", "printer.objects.subscribe"}:
+            return {"eventtime": time.monotonic(), "status": self._status()}
+        if method == "printer.query_endstops.status":
+            return {"manual_stepper gantry1": "open", "manual_stepper gantry2": "open", "manual_stepper horiz": "open"}
+        if method == "printer.gcode.script":
+            self.run_script(str(params.get("script", "")))
+            return "ok"
+        if method in {"printer.emergency_stop", "printer.firmware_restart", "machine.services.restart"}:
+            return "ok"
+        raise LookupError(f"Method not found: {method}")
+
+    def _serve_websocket(self, ws: WebSocket):
+        with self._ws_lock:
+            self._ws_clients.add(ws)
+        try:
+            while True:
+                raw = ws.recv_text()
+                if raw is None:
+                    return
+                threading.Thread(target=self._answer_rpc, args=(ws, json.loads(raw)), daemon=True).start()
+        except (ConnectionError, OSError):
+            return
+        finally:
+            with self._ws_lock:
+                self._ws_clients.discard(ws)
+
+    def _answer_rpc(self, ws: WebSocket, msg: dict):
+        reply: dict = {"jsonrpc": "2.0", "id": msg.get("id")}
+        try:
+            reply["result"] = self.rpc(str(msg.get("method", "")), msg.get("params") or {})
+        except LookupError as e:
+            reply["error"] = {"code": -32601, "message": str(e)}
+        except Exception as e:
+            reply["error"] = {"code": 400, "message": str(e)}
+        try:
+            ws.send_text(json.dumps(reply))
+        except OSError:
+            pass
+
+    def _status(self) -> dict:
+        status = {
+            "toolhead": {"homed_axes": "", "position": [0.0, 0.0, 0.0, 0.0]},
+            "idle_timeout": {"state": "Idle"},
+            "print_stats": {"state": "standby", "message": ""},
+            "gcode_macro SA_STATE": {"homed": 1, "current_slot": 0},
+        }
+        for name, fields in self.status_overrides.items():
+            status.setdefault(name, {}).update(fields)
+        status["gcode_macro SA_STATE"].update({"x_pos": self.timeline.x, "z_pos": self.timeline.z})
+        return status
+
+    def _handler(self):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like Moonraker's tornado server.
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body: dict, status: int = 200):
+                raw = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/websocket" and self.headers.get("Upgrade", "").lower() == "websocket":
+                    self.send_response(101)
+                    self.send_header("Upgrade", "websocket")
+                    self.send_header("Connection", "Upgrade")
+                    self.send_header("Sec-WebSocket-Accept", ws_accept_key(self.headers.get("Sec-WebSocket-Key", "")))
+                    self.end_headers()
+                    self.wfile.flush()
+                    self.close_connection = True
+                    emulator._serve_websocket(WebSocket(self.connection, mask=False))
+                elif path == "/server/info":
+                    self._reply({"result": {"klippy_state": "ready", "klippy_connected": True}})
+                elif path == "/printer/info":
+                    self._reply({"result": {"state": "ready", "state_message": "Printer is ready"}})
+                elif path == "/printer/objects/query":
+                    self._reply({"result": {"eventtime": time.monotonic(), "status": emulator._status()}})
+                elif path == "/printer/query_endstops/status":
+                    self._reply({"result": {"manual_stepper gantry1": "open", "manual_stepper gantry2": "open", "manual_stepper horiz": "open"}})
+                else:
+                    self._reply({"error": {"code": 404, "message": f"Not found: {path}"}}, status=404)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if path == "/printer/gcode/script":
+                    try:
+                        emulator.run_script(str(body.get("script", "")))
+                    except RuntimeError as e:
+                        self._reply({"error": {"code": 400, "message": str(e)}}, status=400)
+                        return
+                    if emulator.drop_post_replies > 0:
+                        emulator.drop_post_replies -= 1
+                        self.close_connection = True
+                        return
+                    self._reply({"result": "ok"})
+                else:
+                    self._reply({"result": "ok"})
+
+        return Handler
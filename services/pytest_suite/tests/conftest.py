@@ -40,6 +40,7 @@ def backend_modules(tmp_path, monkeypatch):
     monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
     monkeypatch.setenv("MQTT_HOST", "test-mqtt")
     monkeypatch.setenv("MQTT_PORT", "1883")
+    monkeypatch.setenv("MACHINE_STATUS_PROBE_INTERVAL_S", "0")
 
     fake_mfrc = types.ModuleType("mfrc522")
     fake_mfrc.SimpleMFRC522 = object
@@ -48,6 +49,7 @@ def backend_modules(tmp_path, monkeypatch):
     _purge_app_modules()
 
     db = importlib.import_module("app.db")
+    db_migrations = importlib.import_module("app.db_migrations")
     models = importlib.import_module("app.models")
     mqtt = importlib.import_module("app.mqtt")
     user_flow = importlib.import_module("app.usecases.user_flow")
@@ -60,6 +62,7 @@ def backend_modules(tmp_path, monkeypatch):
 
     return types.SimpleNamespace(
         db=db,
+        db_migrations=db_migrations,
         models=models,
         mqtt=mqtt,
         user_flow=user_flow,
@@ -1,6 +1,7 @@
-
 from fastapi import HTTPException
 import importlib
+import json
+import pytest
 
 from .helpers import create_open_loan
 
@@ -77,3 +78,344 @@ def test_admin_inventory_endpoint_counts_checked_out_items(client, seeded_db, ba
     assert rows["tm_hex"]["total"] == 2
     assert rows["tm_hex"]["available"] == 1
     assert rows["tm_hex"]["checked_out"] == 1
+
+
+def test_sqlite_profile_uses_wal_and_read_only_pool(seeded_db, backend_modules):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    db = backend_modules.db
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar().lower() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == int(db.SQLITE_BUSY_TIMEOUT_MS)
+
+    with db.ReadSessionLocal() as read_db:
+        assert read_db.execute(text("SELECT COUNT(*) FROM tool_items")).scalar() == 3
+        try:
+            read_db.execute(text("DELETE FROM tool_items"))
+            raise AssertionError("read-only session accepted a write")
+        except OperationalError:
+            read_db.rollback()
+
+
+def test_event_retention_archives_expired_rows_and_serves_them_by_range(client, seeded_db, backend_modules, tmp_path):
+    from datetime import datetime, timedelta
+    from app.services.event_retention import EventArchive, EventRetentionService
+
+    models = backend_modules.models
+    now = datetime(2030, 1, 10, 12, 0, 0)
+    seeded_db.add_all([
+        models.Event(ts=now - timedelta(days=3), event_type="mqtt:igen/evt/machine/status", payload_json="{}"),
+        models.Event(ts=now - timedelta(hours=2), event_type="mqtt:igen/evt/machine/status", payload_json="{}"),
+        models.Event(ts=now - timedelta(days=30), event_type="mqtt:igen/evt/dispense", payload_json="{}"),
+    ])
+    seeded_db.commit()
+
+    service = EventRetentionService(archive=EventArchive(tmp_path / "archive"))
+    result = service.run_once(now=now)
+    assert result["archived"] == 1
+
+    live = seeded_db.query(models.Event).filter(models.Event.event_type.like("mqtt:%")).all()
+    assert sorted(e.event_type for e in live) == ["mqtt:igen/evt/dispense", "mqtt:igen/evt/machine/status"]
+    with backend_modules.db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+
+    client.app.state.event_retention = service
+    resp = client.get(
+        "/api/admin/events/archive",
+        params={"start": (now - timedelta(days=4)).isoformat(), "end": (now - timedelta(days=2)).isoformat()},
+    )
+    assert resp.status_code == 200, resp.text
+    rows = resp.json()
+    assert len(rows) == 1
+    assert rows[0]["event_type"] == "mqtt:igen/evt/machine/status"
+
+    resp = client.get("/api/admin/events/archive", params={"start": now.isoformat()})
+    assert resp.json() == []
+
+    # FastAPI parses a Z suffix as an aware datetime; stored timestamps are naive UTC.
+    resp = client.get(
+        "/api/admin/events/archive",
+        params={"start": (now - timedelta(days=4)).isoformat() + "Z", "end": (now - timedelta(days=2)).isoformat() + "+00:00"},
+    )
+    assert resp.status_code == 200, resp.text
+    assert len(resp.json()) == 1
+
+
+def test_event_retention_finishes_a_segment_whose_delete_never_committed(seeded_db, backend_modules, tmp_path):
+    from datetime import datetime, timedelta
+    from sqlalchemy import select
+    from app.services.event_retention import EVENT_COLUMNS, EventArchive, EventRetentionService, _row_to_dict
+
+    models = backend_modules.models
+    now = datetime(2030, 1, 10, 12, 0, 0)
+    seeded_db.add_all(
+        models.Event(ts=now - timedelta(days=3, minutes=i), event_type="mqtt:igen/evt/machine/status", payload_json="{}")
+        for i in range(3)
+    )
+    seeded_db.commit()
+
+    # A run that crashed after writing its segment but before deleting the rows.
+    archive = EventArchive(tmp_path / "archive")
+    rows = seeded_db.execute(select(*EVENT_COLUMNS).where(models.Event.event_type == "mqtt:igen/evt/machine/status")).all()
+    crashed = archive.write_segment([_row_to_dict(r) for r in rows])
+    assert archive.query(event_type="mqtt:igen/evt/machine/status") == []
+
+    result = EventRetentionService(archive=archive).run_once(now=now)
+
+    assert result["archived"] == 0
+    assert [seg["file"] for seg in archive.segments()] == [crashed["file"]]
+    assert archive.pending() == []
+    assert len(archive.query(event_type="mqtt:igen/evt/machine/status")) == 3
+    seeded_db.expire_all()
+    assert seeded_db.query(models.Event).filter(models.Event.event_type == "mqtt:igen/evt/machine/status").count() == 0
+
+
+def test_event_fields_extracted_on_insert_back_calibration_lookups(client, seeded_db, backend_modules):
+    models = backend_modules.models
+    seeded_db.add_all([
+        models.Event(
+            event_type="mqtt:igen/evt/admin/calibration",
+            payload_json='{"action": "encoder_read", "cake_id": 1, "stage": "succeeded", "reading": {"deg": 12.5}}',
+        ),
+        models.Event(
+            event_type="mqtt:igen/evt/admin/calibration",
+            payload_json='{"action": "encoder_read", "cake_id": "2", "stage": "failed", "error_code": "E_ENC"}',
+        ),
+    ])
+    seeded_db.commit()
+
+    ev = seeded_db.query(models.Event).filter(models.Event.cake_id == 2).one()
+    assert (ev.action, ev.stage, ev.code) == ("encoder_read", "failed", "E_ENC")
+
+    resp = client.get("/api/admin/cakes/1/angle")
+    assert resp.status_code == 200
+    assert resp.json()["ok"] is True
+    assert resp.json()["reading"] == {"deg": 12.5}
+    assert client.get("/api/admin/cakes/2/angle").json()["stage"] == "failed"
+    assert client.get("/api/admin/cakes/3/angle").json()["detail"] == "no_angle_read_yet"
+
+
+def test_entity_cache_serves_lookups_and_is_invalidated_by_assign_routes(client, seeded_db, backend_modules):
+    from app.entity_cache import entity_cache
+    from app.usecases.rfid_flow import confirm_tool_receipt, get_user_by_card
+
+    entity_cache.warm()
+    assert get_user_by_card(seeded_db, "CARD-1")["user_id"] == "user_1"
+    assert entity_cache.tool_item_by_tag(seeded_db, "TAG-1").tool_item_id == "tool_1"
+    stats = entity_cache.stats()
+    assert stats["hits"] == {"user": 1, "tool_item": 1}
+    assert stats["misses"] == {}
+
+    resp = client.put("/api/admin/users/user_1/card", json={"card_id": "CARD-NEW"})
+    assert resp.status_code == 200
+    seeded_db.expire_all()
+    with pytest.raises(ValueError, match="card_not_recognized"):
+        get_user_by_card(seeded_db, "CARD-1")
+    assert get_user_by_card(seeded_db, "CARD-NEW")["user_id"] == "user_1"
+
+    resp = client.put("/api/admin/tools/items/tool_1/tag", json={"tool_tag_id": "TAG-NEW"})
+    assert resp.status_code == 200
+    with pytest.raises(ValueError, match="unknown_tool_tag"):
+        confirm_tool_receipt(seeded_db, "user_1", "TAG-1")
+    assert entity_cache.tool_item_by_tag(seeded_db, "TAG-NEW").tool_item_id == "tool_1"
+    assert client.get("/api/admin/metrics").json()["entity_cache"]["misses"]["card_id"] >= 1
+
+
+def test_machine_status_routes_serve_collected_status(client, seeded_db, backend_modules, monkeypatch):
+    import json
+    from datetime import timedelta
+
+    machine_status = importlib.import_module("app.machine_status")
+    collector = machine_status.status_collector
+    models = backend_modules.models
+    collector.clear()
+
+    empty = client.get("/api/admin/manual/status").json()
+    assert empty["state"] == "unknown"
+    assert empty["age_s"] is None
+
+    seeded_db.add(models.Event(
+        ts=models.utcnow() - timedelta(minutes=5),
+        event_type="mqtt:igen/evt/machine/status",
+        payload_json=json.dumps({"reachable": True, "state": "idle", "homed": True, "position": [10.0, 0.0, 20.0]}),
+    ))
+    seeded_db.commit()
+    collector.load()
+    loaded = client.get("/api/admin/machine/status").json()
+    assert (loaded["state"], loaded["horizontal_position"], loaded["vertical_position"]) == ("idle", 10.0, 20.0)
+    assert loaded["age_s"] >= 299
+
+    backend_modules.mqtt._handle_mqtt_message(
+        "igen/evt/machine/status",
+        {"reachable": True, "state": "moving", "busy": True, "position": [1.0, 0.0, 2.0], "active_cake_id": 2},
+    )
+    live = client.get("/api/admin/manual/status").json()
+    assert (live["state"], live["busy"], live["active_cake_id"]) == ("moving", True, 2)
+    assert live["age_s"] < 5
+    assert client.get("/api/admin/calibration/status").json()["machine_status"]["state"] == "moving"
+
+    class FakeMoonraker:
+        fail = False
+
+        def get(self, path, timeout_s=None):
+            if self.fail:
+                raise machine_status.MoonrakerError("KLIPPER_NOT_RESPONDING", "down")
+            return {"result": {"status": {
+                "toolhead": {"homed_axes": "xz", "position": [5.0, 0.0, 6.0, 0.0]},
+                "idle_timeout": {"state": "Idle"},
+                "print_stats": {"state": "standby"},
+            }}}
+
+    fake = FakeMoonraker()
+    monkeypatch.setattr(machine_status, "shared_client", lambda url: fake)
+    collector.probe()
+    probed = client.get("/api/admin/machine/status").json()
+    assert (probed["source"], probed["horizontal_position"], probed["busy"]) == ("moonraker_direct", 5.0, False)
+
+    fake.fail = True
+    collector.probe()
+    assert client.get("/api/admin/machine/status").json()["state"] == "moving"
+
+
+def test_admin_command_status_is_tracked_from_mqtt_and_long_polls(client, seeded_db, backend_modules):
+    import threading
+    import time
+
+    tracker_mod = importlib.import_module("app.command_tracker")
+    tracker = tracker_mod.command_tracker
+    tracker.clear()
+
+    resp = client.post("/api/admin/cakes/1/home")
+    assert resp.status_code == 200, resp.text
+    request_id = resp.json()["request_id"]
+    queued = client.get(f"/api/admin/cakes/home/{request_id}/status").json()
+    assert (queued["stage"], queued["cake_id"]) == ("queued", 1)
+
+    def report():
+        time.sleep(0.2)
+        backend_modules.mqtt._handle_mqtt_message(
+            "igen/evt/admin/manual",
+            {"request_id": request_id, "stage": "succeeded", "data": {"cake_id": 1, "action": "set_cake_zero"}},
+        )
+
+    threading.Thread(target=report).start()
+    started = time.monotonic()
+    done = client.get(f"/api/admin/commands/{request_id}/status", params={"wait_s": 5, "stage": "queued"}).json()
+    assert done["stage"] == "succeeded"
+    assert time.monotonic() - started < 4
+    assert client.get(f"/api/admin/cakes/home/{request_id}/status").json()["stage"] == "succeeded"
+    assert client.get("/api/admin/commands/nope/status").status_code == 404
+
+    motor = client.post("/api/admin/test/motor", json={"motor_id": 2, "action": "dispense"}).json()
+    backend_modules.mqtt._handle_mqtt_message("igen/evt/admin_test/motor", {"request_id": motor["request_id"], "stage": "in_progress"})
+    status = client.get(f"/api/admin/test/motor/{motor['request_id']}/status").json()
+    assert (status["stage"], status["motor_id"], status["action"]) == ("in_progress", 2, "dispense")
+
+    bounded = tracker_mod.CommandTracker(ttl_s=60, max_entries=3)
+    for i in range(5):
+        bounded.update(f"r{i}", {"stage": "queued"})
+    assert len(bounded) == 3
+    assert bounded.get("r0") is None and bounded.get("r4")["stage"] == "queued"
+    bounded.ttl_s = 0
+    assert bounded.get("r4") is None
+
+
+def test_calibration_read_waits_for_correlated_reply(client, seeded_db, backend_modules):
+    import threading
+    import time
+    from types import SimpleNamespace
+
+    bus = backend_modules.mqtt.MqttBus()
+    client.app.state.mqtt = bus
+    sent = []
+    bus.publish = lambda topic, payload, qos=1: sent.append(payload)
+
+    def deliver(topic, payload):
+        msg = SimpleNamespace(topic=topic, payload=json.dumps(payload).encode("utf-8"))
+        bus._on_message(None, None, msg)
+
+    def bridge():
+        while not sent:
+            time.sleep(0.01)
+        rid = sent[0]["request_id"]
+        deliver("igen/evt/admin/calibration", {"request_id": "cal_other", "stage": "succeeded", "reading": {"deg": 1.0}})
+        deliver("igen/evt/admin/calibration", {"request_id": rid, "stage": "accepted"})
+        deliver("igen/evt/admin/calibration", {"request_id": rid, "stage": "succeeded", "action": "encoder_read", "cake_id": 2, "reading": {"deg": 42.5}})
+
+    threading.Thread(target=bridge).start()
+    started = time.monotonic()
+    resp = client.post("/api/admin/cakes/2/read-angle", params={"wait": "true", "wait_s": 5})
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert time.monotonic() - started < 4
+    assert (body["ok"], body["stage"], body["reading"]) == (True, "succeeded", {"deg": 42.5})
+    assert body["request_id"] == sent[0]["request_id"]
+    assert client.get("/api/admin/cakes/2/angle").json()["reading"] == {"deg": 42.5}
+
+    timed_out = client.post("/api/admin/cakes/2/read-eeprom", params={"wait": "true", "wait_s": 0.2}).json()
+    assert (timed_out["ok"], timed_out["stage"], timed_out["detail"]) == (False, "queued", "reply_timeout")
+    assert bus._replies._waiters == {}
+
+    queued = client.post("/api/admin/cakes/2/read-eeprom").json()
+    assert queued["ok"] is True and "eeprom" not in queued
+
+
+def test_events_and_loans_page_by_cursor_and_export_as_streams(client, seeded_db, db_session, backend_modules):
+    import csv
+    import io
+    from datetime import datetime, timedelta
+
+    models = backend_modules.models
+    base = datetime(2030, 1, 1)
+    for i in range(7):
+        # The last four rows share a timestamp, so pages must break ties on event_id.
+        db_session.add(models.Event(ts=base + timedelta(seconds=min(i, 3)), event_type="test:page", actor_id="admin_1", payload_json=json.dumps({"i": i})))
+    db_session.commit()
+    for i, tool in enumerate(("tool_1", "tool_2", "tool_3")):
+        create_open_loan(db_session, models, loan_id=f"loan_{i}", user_id="user_1", tool_item_id=tool)
+
+    seen, cursor = [], None
+    while True:
+        params = {"event_type": "test:page", "limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        resp = client.get("/api/admin/events", params=params)
+        assert resp.status_code == 200, resp.text
+        seen.extend(json.loads(e["payload_json"])["i"] for e in resp.json())
+        cursor = resp.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == [6, 5, 4, 3, 2, 1, 0]
+    assert client.get("/api/admin/events", params={"cursor": "garbage"}).status_code == 400
+
+    first = client.get("/api/admin/loans", params={"user_id": "user_1", "limit": 2})
+    second = client.get("/api/admin/loans", params={"user_id": "user_1", "limit": 2, "cursor": first.headers["x-next-cursor"]})
+    loan_ids = [l["loan_id"] for l in first.json() + second.json()]
+    assert sorted(loan_ids) == ["loan_0", "loan_1", "loan_2"] and "x-next-cursor" not in second.headers
+
+    ndjson = client.get("/api/admin/events/export", params={"actor_id": "admin_1"})
+    assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in ndjson.text.splitlines()]
+    assert [json.loads(r["payload_json"])["i"] for r in lines] == [6, 5, 4, 3, 2, 1, 0]
+    assert lines[0]["ts"] == "2030-01-01T00:00:03"
+
+    exported = list(csv.reader(io.StringIO(client.get("/api/admin/loans/export", params={"format": "csv"}).text)))
+    assert exported[0][:3] == ["loan_id", "user_id", "tool_item_id"]
+    assert sorted(r[0] for r in exported[1:]) == ["loan_0", "loan_1", "loan_2"]
+    assert client.get("/api/admin/events/export", params={"format": "xml"}).status_code == 422
+
+    # The export body opens its sessions through the dependency, so overrides apply.
+    deps = importlib.import_module("app.routers.deps")
+    opened = []
+
+    def factory():
+        opened.append(1)
+        return backend_modules.db.ReadSessionLocal()
+
+    client.app.dependency_overrides[deps.get_read_session_factory] = lambda: factory
+    try:
+        assert len(client.get("/api/admin/events/export", params={"actor_id": "admin_1"}).text.splitlines()) == 7
+    finally:
+        client.app.dependency_overrides.pop(deps.get_read_session_factory)
+    assert opened
@@ -1,3 +1,8 @@
+import importlib
+import time
+
+import pytest
+
 
 class CaptureBridgeMixin:
     def _publish(self, topic, payload, qos=1):
@@ -63,3 +68,192 @@ def test_zero_ok_routes_to_cake_home_topic(backend_modules):
 
     assert bridge.published[-1]["topic"] == backend_modules.bridge.TOPIC_EVT_CAKE_HOME
     assert bridge.published[-1]["payload"]["stage"] == "succeeded"
+
+
+def test_overlapped_dispense_rotates_cake_under_gantry_move(backend_modules, monkeypatch):
+    bridge_mod = backend_modules.bridge
+
+    class CaptureBridge(CaptureBridgeMixin, bridge_mod.Bridge2):
+        def __init__(self, cfg):
+            super().__init__(cfg)
+            self.published = []
+            self.scripts = []
+
+        def _run_gcode(self, request_id, script):
+            self.scripts.append(script)
+
+        def _ensure_machine_ready(self):
+            return {}
+
+        def _wait_for_user_confirm(self, *args, **kwargs):
+            pass
+
+        def _publish_machine_status(self, extra=None):
+            pass
+
+    monkeypatch.setattr(bridge_mod, "DISPENSE_OVERLAP_ROTATION", True)
+    bridge = CaptureBridge(bridge_mod.BridgeConfig(mode="MOONRAKER", moonraker_url="http://127.0.0.1:1", done_timeout_ms=1000))
+
+    bridge._execute_request("dispense", {"request_id": "req_1", "cake_id": 2, "current_slot": 5, "target_slot": 1})
+
+    assert bridge.scripts[:2] == [
+        "SA_CAKE_ROTATE_ASYNC CAKE=2 SLOTS=2\nSA_MOVE_TO_CAKE CAKE=2\nSA_CAKE_ROTATE_WAIT CAKE=2 SLOTS=2",
+        "SA_ROTATE_TO_DISPENSE CAKE=2",
+    ]
+    assert not any("MOVE_CAKE_CW_60" in s for s in bridge.scripts)
+    stages = [p["payload"]["stage"] for p in bridge.published if p["topic"] == bridge_mod.TOPIC_EVT_DISPENSE]
+    assert stages[-1] == "succeeded"
+
+
+def test_dispense_fails_when_its_cake_was_left_unknown_by_a_prefetch(backend_modules, monkeypatch):
+    bridge_mod = backend_modules.bridge
+
+    class CaptureBridge(CaptureBridgeMixin, bridge_mod.Bridge2):
+        def __init__(self, cfg):
+            super().__init__(cfg)
+            self.published = []
+            self.scripts = []
+
+        def _run_gcode(self, request_id, script):
+            self.scripts.append(script)
+
+        def _ensure_machine_ready(self):
+            return {}
+
+        def _wait_for_user_confirm(self, *args, **kwargs):
+            pass
+
+        def _publish_machine_status(self, extra=None):
+            pass
+
+    def outcome(bridge, request_id):
+        last = [p["payload"] for p in bridge.published if p["topic"] == bridge_mod.TOPIC_EVT_DISPENSE and p["payload"]["request_id"] == request_id][-1]
+        return last["stage"], last.get("error_code")
+
+    monkeypatch.setattr(bridge_mod, "PREFETCH_WAIT_TIMEOUT_S", 0.01)
+    cfg = bridge_mod.BridgeConfig(mode="MOONRAKER", moonraker_url="http://127.0.0.1:1", done_timeout_ms=1000)
+
+    # The prefetch for req_2 failed part-way: no rotation from the stale current_slot.
+    bridge = CaptureBridge(cfg)
+    failed = bridge_mod.Prefetch("req_2", "req_1", 2, 1, 3, ok=False)
+    failed.done.set()
+    bridge._prefetch = failed
+    bridge._execute_request("dispense", {"request_id": "req_2", "cake_id": 2, "current_slot": 1, "target_slot": 3})
+    assert outcome(bridge, "req_2") == ("failed", "PREFETCH_FAILED")
+    assert not any("CAKE=2 SLOTS" in s for s in bridge.scripts)
+
+    # req_1 waits on a prefetch of its own cake that never finishes: it does not report target_slot.
+    bridge = CaptureBridge(cfg)
+    bridge._prefetch = bridge_mod.Prefetch("req_2", "req_1", 2, 1, 3)
+    bridge._execute_request("dispense", {"request_id": "req_1", "cake_id": 2, "current_slot": 0, "target_slot": 1})
+    assert outcome(bridge, "req_1") == ("failed", "PREFETCH_TIMEOUT")
+
+    # A prefetch on another cake does not move this one.
+    bridge = CaptureBridge(cfg)
+    bridge._prefetch = bridge_mod.Prefetch("req_2", "req_1", 3, 1, 3)
+    bridge._execute_request("dispense", {"request_id": "req_1", "cake_id": 2, "current_slot": 0, "target_slot": 1})
+    assert outcome(bridge, "req_1") == ("succeeded", None)
+
+
+def test_rotation_plan_uses_one_multi_slot_move(backend_modules, monkeypatch):
+    bridge_mod = backend_modules.bridge
+
+    plan = bridge_mod.build_rotation_plan(3, 1, 4)
+    assert plan.script == "SA_CAKE_ROTATE_SLOTS CAKE=3 SLOTS=3"
+    assert plan.expected_signed_deg == 3 * bridge_mod.DEG_PER_SLOT
+    assert bridge_mod.build_rotation_plan(3, 1, 5).script == "SA_CAKE_ROTATE_SLOTS CAKE=3 SLOTS=-2"
+    assert bridge_mod.build_rotation_plan(3, 1, 1).script == ""
+
+    monkeypatch.setattr(bridge_mod, "ROTATION_SINGLE_MOVE", False)
+    assert bridge_mod.build_rotation_plan(3, 1, 5).script == "MOVE_CAKE_CCW_60 CAKE=3\nMOVE_CAKE_CCW_60 CAKE=3"
+
+
+def test_websocket_client_mirrors_subscribed_status_and_tracks_gcode(backend_modules):
+    bridge_mod = backend_modules.bridge
+    emulator = importlib.import_module("bench.moonraker_emulator").MoonrakerEmulator(time_scale=0.0).start()
+    client = bridge_mod.MoonrakerWsClient(emulator.url, rpc_timeout_s=2.0, gcode_timeout_s=5.0)
+    try:
+        sa_state = client.get_sa_state()["result"]["status"]["gcode_macro SA_STATE"]
+        assert sa_state["homed"] == 1
+        assert client.ws_url.endswith("/websocket")
+
+        assert client.send_gcode("SA_MOVE_TO_DOOR") == {"result": "ok"}
+        assert emulator.scripts[-1].startswith("SA_MOVE_TO_DOOR\nRESPOND PREFIX=sa_done MSG=")
+
+        emulator.notify_status({"idle_timeout": {"state": "Printing"}, "toolhead": {"position": [1.0, 2.0, 3.0, 0.0]}})
+        deadline = time.monotonic() + 2.0
+        while client.get_printer_status()["result"]["status"]["idle_timeout"].get("state") != "Printing":
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        status = client.get_printer_status()["result"]["status"]
+        assert status["toolhead"]["position"] == [1.0, 2.0, 3.0, 0.0]
+        assert client.get_sa_state()["result"]["status"]["gcode_macro SA_STATE"]["x_pos"] == emulator.timeline.x
+        with pytest.raises(bridge_mod.BridgeError) as busy:
+            client.wait_until_idle(0.1)
+        assert busy.value.code == "KLIPPER_TIMEOUT"
+
+        emulator.errors["SA_JAM"] = "!! Gantry jammed"
+        with pytest.raises(bridge_mod.BridgeError) as failed:
+            client.send_gcode("SA_JAM")
+        assert failed.value.code == "KLIPPER_GCODE_ERROR"
+        assert "Gantry jammed" in failed.value.reason
+    finally:
+        client.close()
+        emulator.stop()
+
+
+def test_pooled_moonraker_client_reuses_connections_and_caches_object_queries(backend_modules):
+    moonraker = importlib.import_module("app.moonraker")
+    metrics = importlib.import_module("app.metrics").metrics
+    emulator = importlib.import_module("bench.moonraker_emulator").MoonrakerEmulator(time_scale=0.0).start()
+    client = moonraker.MoonrakerHttpClient(emulator.url, read_timeout_s=2.0, cache_ttl_s=60.0)
+    metrics.reset()
+    try:
+        for _ in range(3):
+            assert client.get("/printer/info")["result"]["state"] == "ready"
+        first = client.query_objects({"gcode_macro SA_STATE": "x_pos"})
+        assert client.query_objects({"gcode_macro SA_STATE": "x_pos"}) is first
+
+        client.post("/printer/gcode/script", {"script": "SA_MOVE_TO_DOOR"})
+        moved = client.query_objects({"gcode_macro SA_STATE": "x_pos"})
+        assert moved is not first
+        assert moved["result"]["status"]["gcode_macro SA_STATE"]["x_pos"] == emulator.timeline.x
+
+        snap = metrics.snapshot()
+        assert snap["counters"]["moonraker_http_connects_total"] == 1
+        assert snap["counters"]["moonraker_query_cache_hits_total"] == 1
+        assert snap["summaries"]["moonraker_http_ms:/printer/info"]["count"] == 3
+        assert client.timeout_for("/printer/gcode/script") == moonraker.MOONRAKER_SCRIPT_TIMEOUT_S
+        assert client.timeout_for("/printer/objects/query?toolhead") == 2.0
+
+        emulator.errors["SA_JAM"] = "!! Gantry jammed"
+        with pytest.raises(moonraker.MoonrakerError) as failed:
+            client.post("/printer/gcode/script", {"script": "SA_JAM"})
+        assert failed.value.code == "MOONRAKER_HTTP_ERROR"
+        assert failed.value.status == 400
+    finally:
+        client.close()
+        emulator.stop()
+
+
+def test_pooled_moonraker_client_does_not_resend_a_delivered_gcode_script(backend_modules):
+    moonraker = importlib.import_module("app.moonraker")
+    metrics = importlib.import_module("app.metrics").metrics
+    emulator = importlib.import_module("bench.moonraker_emulator").MoonrakerEmulator(time_scale=0.0).start()
+    client = moonraker.MoonrakerHttpClient(emulator.url, read_timeout_s=2.0)
+    metrics.reset()
+    try:
+        assert client.get("/printer/info")["result"]["state"] == "ready"
+
+        # Moonraker reads and runs the script, then drops the reused connection unanswered.
+        emulator.drop_post_replies = 1
+        with pytest.raises(moonraker.MoonrakerError) as failed:
+            client.post("/printer/gcode/script", {"script": "SA_MOVE_TO_DOOR"})
+        assert failed.value.code == "KLIPPER_NOT_RESPONDING"
+        assert emulator.scripts == ["SA_MOVE_TO_DOOR"]
+        assert "moonraker_http_stale_retries_total" not in metrics.snapshot()["counters"]
+
+        assert client.get("/printer/info")["result"]["state"] == "ready"
+    finally:
+        client.close()
+        emulator.stop()
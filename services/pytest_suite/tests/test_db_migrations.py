@@ -0,0 +1,201 @@
+import sqlite3
+
+import pytest
+
+
+HOT_QUERIES = [
+    (
+        "ix_loans_tool_open",
+        "SELECT 1 FROM loans WHERE tool_item_id = ? AND returned_at IS NULL AND status IN ('active','overdue','unconfirmed')",
+        ("tool_1",),
+    ),
+    (
+        "ix_loans_user_open",
+        "SELECT * FROM loans WHERE user_id = ? AND returned_at IS NULL",
+        ("user_1",),
+    ),
+    (
+        "ix_loans_open_due",
+        "SELECT * FROM loans WHERE returned_at IS NULL AND due_at < ? AND status IN ('active','unconfirmed','overdue')",
+        ("2030-01-01",),
+    ),
+    (
+        "ix_loan_requests_batch_created",
+        "SELECT * FROM loan_requests WHERE batch_id = ? ORDER BY created_at ASC, request_id ASC",
+        ("batch_1",),
+    ),
+    (
+        "ix_loan_requests_batch_sequence",
+        "SELECT * FROM loan_requests WHERE batch_id = ? ORDER BY sequence ASC, created_at ASC, request_id ASC",
+        ("batch_1",),
+    ),
+    (
+        "ix_loan_requests_tool_type_status",
+        "SELECT 1 FROM loan_requests WHERE tool_item_id = ? AND request_type = 'dispense' AND hw_status IN ('pending','accepted','in_progress')",
+        ("tool_1",),
+    ),
+    (
+        "ix_events_type_ts",
+        "SELECT * FROM events WHERE event_type = ? ORDER BY ts DESC, event_id DESC LIMIT 1",
+        ("mqtt:igen/evt/machine/status",),
+    ),
+    (
+        "ix_events_type_cake_ts",
+        "SELECT * FROM events WHERE event_type = ? AND action IN ('encoder_read', 'encoder_read_angle') AND cake_id = ?"
+        " ORDER BY ts DESC, event_id DESC LIMIT 1",
+        ("mqtt:igen/evt/admin/calibration", 1),
+    ),
+    (
+        "ix_events_type_stage_ts",
+        "SELECT count(*) FROM events WHERE event_type = ? AND stage = 'succeeded' AND ts >= ?",
+        ("mqtt:igen/evt/dispense", "2030-01-01"),
+    ),
+    (
+        "ix_events_type_severity_ts",
+        "SELECT * FROM events WHERE event_type = ? AND severity = ? ORDER BY ts DESC, event_id DESC LIMIT 100",
+        ("mqtt:igen/evt/machine/alert", "critical"),
+    ),
+    (
+        "ix_events_request_type",
+        "SELECT * FROM events WHERE request_id = ? AND event_type = ? ORDER BY ts DESC, event_id DESC LIMIT 1",
+        ("home_1", "mqtt:igen/evt/admin/manual"),
+    ),
+    (
+        "ix_events_ts",
+        "SELECT event_id FROM events WHERE (ts, event_id) < (?, ?) ORDER BY ts DESC, event_id DESC LIMIT 500",
+        ("2030-01-01", 100),
+    ),
+    (
+        "ix_events_actor_ts",
+        "SELECT event_id FROM events WHERE actor_id = ? AND (ts, event_id) < (?, ?) ORDER BY ts DESC, event_id DESC LIMIT 500",
+        ("admin_1", "2030-01-01", 100),
+    ),
+    (
+        "ix_events_tool_ts",
+        "SELECT event_id FROM events WHERE tool_item_id = ? AND (ts, event_id) < (?, ?) ORDER BY ts DESC, event_id DESC LIMIT 500",
+        ("tool_1", "2030-01-01", 100),
+    ),
+    (
+        "ix_loans_issued",
+        "SELECT loan_id FROM loans WHERE (issued_at, loan_id) < (?, ?) ORDER BY issued_at DESC, loan_id DESC LIMIT 500",
+        ("2030-01-01", "loan_1"),
+    ),
+]
+
+
+def _db_path(backend_modules):
+    return backend_modules.db.engine.url.database
+
+
+@pytest.mark.parametrize("index_name,sql,params", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_queries_use_composite_indexes(backend_modules, index_name, sql, params):
+    conn = sqlite3.connect(_db_path(backend_modules))
+    try:
+        plan = " | ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall())
+    finally:
+        conn.close()
+
+    assert index_name in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_migrations_upgrade_legacy_db_and_are_idempotent(backend_modules, tmp_path):
+    db_migrations = backend_modules.db_migrations
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE tool_models (tool_model_id VARCHAR PRIMARY KEY, name VARCHAR);
+        CREATE TABLE loans (loan_id VARCHAR PRIMARY KEY, user_id VARCHAR, tool_item_id VARCHAR,
+                            issued_at DATETIME, due_at DATETIME, returned_at DATETIME, status VARCHAR);
+        CREATE TABLE loan_requests (request_id VARCHAR PRIMARY KEY, batch_id VARCHAR, request_type VARCHAR,
+                                    tool_item_id VARCHAR, hw_status VARCHAR, created_at DATETIME);
+        CREATE TABLE events (event_id INTEGER PRIMARY KEY, ts DATETIME, event_type VARCHAR,
+                             request_id VARCHAR, payload_json TEXT);
+        CREATE TABLE auth_sessions (session_id VARCHAR PRIMARY KEY, session_token VARCHAR, expires_at DATETIME);
+        INSERT INTO events (ts, event_type, payload_json) VALUES
+          ('2030-01-01 00:00:00', 'mqtt:igen/evt/admin/calibration',
+           '{"action": "encoder_read", "cake_id": "2", "stage": "succeeded"}'),
+          ('2030-01-01 00:00:01', 'mqtt:igen/evt/machine/alert',
+           '{"severity": "CRITICAL", "data": {"cake_id": 3}, "error_code": "E_JAM"}'),
+          ('2030-01-01 00:00:02', 'mqtt:igen/evt/machine/status', 'not json');
+        INSERT INTO loan_requests (request_id, batch_id, request_type, tool_item_id, hw_status, created_at) VALUES
+          ('b1_item_2', 'b1', 'dispense', 'tool_2', 'pending', '2030-01-01 00:00:01'),
+          ('b1_item_1', 'b1', 'dispense', 'tool_1', 'succeeded', '2030-01-01 00:00:00'),
+          ('b2_item_1', 'b2', 'return', 'tool_3', 'pending', '2030-01-01 00:00:00');
+        """
+    )
+    conn.commit()
+    conn.close()
+
+    first = db_migrations.run_migrations(path)
+    second = db_migrations.run_migrations(path)
+
+    assert first == [m.version for m in db_migrations.MIGRATIONS]
+    assert second == []
+
+    conn = sqlite3.connect(path)
+    try:
+        assert {"max_loan_hours", "max_qty_per_user"} <= db_migrations._cols(conn, "tool_models")
+        assert "ix_loans_tool_open" in db_migrations._indexes(conn, "loans")
+        assert db_migrations.applied_versions(conn) == {m.version for m in db_migrations.MIGRATIONS}
+        rows = conn.execute("SELECT stage, action, cake_id, severity, code FROM events ORDER BY event_id").fetchall()
+        assert rows == [
+            ("succeeded", "encoder_read", 2, None, None),
+            (None, None, 3, "critical", "E_JAM"),
+            (None, None, None, None, None),
+        ]
+        rows = conn.execute("SELECT request_id, sequence FROM loan_requests ORDER BY request_id").fetchall()
+        assert rows == [("b1_item_1", 1), ("b1_item_2", 2), ("b2_item_1", 1)]
+    finally:
+        conn.close()
+
+
+def test_event_field_backfill_matches_insert_rules_and_drops_redundant_indexes(backend_modules, tmp_path):
+    import json
+
+    db_migrations = backend_modules.db_migrations
+    fields = backend_modules.models.event_fields_from_payload
+    payloads = [
+        {"code": "", "error_code": "E1"},
+        {"code": "  ", "error_code": "E1"},
+        {"code": 0, "error_code": "E1"},
+        {"code": False, "error_code": "E1"},
+        {"error_code": "E2", "severity": "CRIT"},
+        {"cake_id": True, "stage": True},
+        {"cake_id": " 2 ", "action": {"a": 1}},
+        {"data": {"cake_id": "3"}},
+    ]
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE tool_models (tool_model_id VARCHAR PRIMARY KEY, name VARCHAR);
+        CREATE TABLE loans (loan_id VARCHAR PRIMARY KEY, user_id VARCHAR, tool_item_id VARCHAR,
+                            issued_at DATETIME, due_at DATETIME, returned_at DATETIME, status VARCHAR);
+        CREATE TABLE loan_requests (request_id VARCHAR PRIMARY KEY, batch_id VARCHAR, request_type VARCHAR,
+                                    tool_item_id VARCHAR, hw_status VARCHAR, created_at DATETIME);
+        CREATE TABLE auth_sessions (session_id VARCHAR PRIMARY KEY, session_token VARCHAR, expires_at DATETIME);
+        CREATE TABLE events (event_id INTEGER PRIMARY KEY, ts DATETIME, event_type VARCHAR,
+                             request_id VARCHAR, payload_json TEXT, stage VARCHAR);
+        CREATE INDEX ix_events_event_type ON events (event_type);
+        CREATE INDEX ix_events_request_id ON events (request_id);
+        CREATE INDEX ix_events_type_stage_ts ON events (event_type, stage, ts);
+        """
+    )
+    conn.executemany("INSERT INTO events (ts, event_type, payload_json) VALUES ('2030-01-01', 't', ?)", [(json.dumps(p),) for p in payloads])
+    conn.commit()
+    conn.close()
+
+    db_migrations.run_migrations(path)
+
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT stage, action, cake_id, severity, code FROM events ORDER BY event_id").fetchall()
+        indexes = db_migrations._indexes(conn, "events")
+        stage_columns = db_migrations._index_columns(conn, "ix_events_type_stage_ts")
+    finally:
+        conn.close()
+    assert rows == [tuple(fields(p).values()) for p in payloads]
+    assert not indexes & {"ix_events_event_type", "ix_events_request_id"}
+    assert stage_columns == ("event_type", "stage", "ts", "event_id")
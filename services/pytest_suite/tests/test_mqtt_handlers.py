@@ -1,5 +1,11 @@
-
+import importlib
 import json
+import threading
+import time
+import types
+
+import pytest
+from sqlalchemy import select
 
 from .helpers import create_open_loan, create_loan_request
 
@@ -114,3 +120,278 @@ def test_return_failure_records_error(seeded_db, backend_modules):
     req = seeded_db.get(backend_modules.models.LoanRequest, "ret_fail")
     assert req.hw_status == "failed"
     assert req.hw_error_code == "BUSY"
+
+
+class _FakePahoClient:
+    def __init__(self):
+        self.sent = []
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, payload, qos=1):
+        self.sent.append((topic, json.loads(payload), qos))
+        return types.SimpleNamespace(mid=len(self.sent), rc=0)
+
+
+def test_batch_release_uses_bus_outbox_and_records_latency(seeded_db, backend_modules):
+    mqtt_mod = backend_modules.mqtt
+    metrics = importlib.import_module("app.metrics").metrics
+    for request_id, tool_item_id in (("req_a", "tool_1"), ("req_b", "tool_2")):
+        create_loan_request(
+            seeded_db,
+            backend_modules.models,
+            request_id=request_id,
+            batch_id="batch_bus",
+            request_type="dispense",
+            user_id="user_1",
+            tool_item_id=tool_item_id,
+            slot_id="1" if tool_item_id == "tool_1" else "2",
+        )
+
+    bus = mqtt_mod.MqttBus()
+    fake = _FakePahoClient()
+    bus._client = fake
+    bus.start()
+    try:
+        mqtt_mod.handle_evt_dispense(seeded_db, {"request_id": "req_a", "stage": "succeeded"})
+
+        deadline = time.monotonic() + 2
+        while not bus._inflight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [(t, p["request_id"]) for t, p, _ in fake.sent] == [("igen/cmd/dispense", "req_b")]
+
+        bus._on_publish(fake, None, 1)
+        summary = metrics.snapshot()["summaries"]["batch_release_latency_ms"]
+        assert summary["count"] == 1
+        assert not bus._inflight
+    finally:
+        bus.stop()
+
+
+def test_publisher_does_not_hold_ack_lock_while_paho_acks_from_its_network_thread(backend_modules):
+    mqtt_mod = backend_modules.mqtt
+
+    class _MutexPahoClient(_FakePahoClient):
+        # Like paho: publish() takes the message mutex the network thread holds while firing on_publish.
+        def __init__(self):
+            super().__init__()
+            self.mutex = threading.Lock()
+            self.entered = threading.Event()
+            self.ack_inside = False
+
+        def publish(self, topic, payload, qos=1):
+            self.entered.set()
+            with self.mutex:
+                info = super().publish(topic, payload, qos)
+            if self.ack_inside:
+                # A fast broker: the PUBACK is handled before publish() returns.
+                acker = threading.Thread(target=bus._on_publish, args=(self, None, info.mid))
+                acker.start()
+                acker.join(timeout=2)
+            return info
+
+    bus = mqtt_mod.MqttBus()
+    fake = _MutexPahoClient()
+    bus._client = fake
+    bus.start()
+    try:
+        first = bus.publish("igen/cmd/dispense", {"request_id": "req_1"})
+        deadline = time.monotonic() + 2
+        while 1 not in bus._inflight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        fake.entered.clear()
+
+        def network_thread():
+            with fake.mutex:
+                fake.entered.wait(2)
+                time.sleep(0.05)  # the publisher is now blocked on the mutex
+                bus._on_publish(fake, None, 1)
+
+        net = threading.Thread(target=network_thread, daemon=True)
+        net.start()
+        second = bus.publish("igen/cmd/dispense", {"request_id": "req_2"})
+        net.join(timeout=2)
+        assert not net.is_alive()
+        assert first.wait(2)
+
+        fake.ack_inside = True
+        third = bus.publish("igen/cmd/dispense", {"request_id": "req_3"})
+        assert third.wait(2)
+
+        deadline = time.monotonic() + 2
+        while 2 not in bus._inflight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        threading.Thread(target=bus._on_publish, args=(fake, None, 2)).start()
+        assert second.wait(2)
+        assert not bus._inflight and not bus._early_acks
+    finally:
+        bus.stop()
+
+
+def test_door_wait_prefetches_next_dispense_and_tracks_prefetched_slot(seeded_db, backend_modules, monkeypatch):
+    mqtt_mod = backend_modules.mqtt
+    for request_id, tool_item_id in (("req_a", "tool_1"), ("req_b", "tool_2")):
+        create_loan_request(
+            seeded_db,
+            backend_modules.models,
+            request_id=request_id,
+            batch_id="batch_pf",
+            request_type="dispense",
+            user_id="user_1",
+            tool_item_id=tool_item_id,
+            slot_id="1" if tool_item_id == "tool_1" else "2",
+        )
+    sent = []
+    monkeypatch.setattr(mqtt_mod, "_publish", lambda topic, payload, qos=1: sent.append((topic, payload)))
+
+    mqtt_mod.handle_evt_dispense(seeded_db, {"request_id": "req_a", "stage": "waiting_user_confirm"})
+
+    assert [(t, p["request_id"], p["after_request_id"]) for t, p in sent] == [("igen/cmd/prefetch", "req_b", "req_a")]
+    assert sent[0][1]["target_slot"] == 2
+
+    mqtt_mod.handle_evt_prefetch(seeded_db, {"request_id": "req_b", "stage": "succeeded", "final_current_slot": 2})
+
+    cake = seeded_db.get(backend_modules.models.CakeState, "cake_1")
+    assert cake.current_slot == 2
+
+
+def test_unit_of_work_rolls_back_handler_changes_but_keeps_audit_event(seeded_db, backend_modules, monkeypatch):
+    models = backend_modules.models
+    utils = importlib.import_module("app.utils")
+    create_loan_request(
+        seeded_db,
+        models,
+        request_id="req_uow",
+        batch_id="batch_uow",
+        request_type="dispense",
+        user_id="user_1",
+        tool_item_id="tool_1",
+        slot_id="1",
+    )
+
+    def broken_handler(db, payload):
+        backend_modules.mqtt.handle_evt_dispense(db, payload)
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(utils.MQTT_REGISTRY, "igen/evt/dispense", broken_handler)
+
+    with pytest.raises(RuntimeError):
+        backend_modules.mqtt._handle_mqtt_message("igen/evt/dispense", {"request_id": "req_uow", "stage": "succeeded"})
+
+    seeded_db.expire_all()
+    assert seeded_db.get(models.LoanRequest, "req_uow").hw_status == "pending"
+    assert seeded_db.query(models.Loan).filter_by(tool_item_id="tool_1").count() == 0
+    assert seeded_db.query(models.Event).filter_by(event_type="mqtt:igen/evt/dispense").count() == 1
+
+
+def test_ordering_key_groups_batch_items(backend_modules):
+    _ordering_key = backend_modules.mqtt._ordering_key
+
+    assert _ordering_key("igen/evt/dispense", {"request_id": "batch_abc_item_3"}) == "batch_abc"
+    assert _ordering_key("igen/evt/dispense", {"request_id": "x_item_1", "batch_id": "b1"}) == "b1"
+    assert _ordering_key("igen/evt/admin/manual", {"request_id": "adm_123"}) == "adm_123"
+    assert _ordering_key("igen/evt/machine/status", {}) == "igen/evt/machine/status"
+
+
+def test_inbound_worker_pool_keeps_per_batch_order(backend_modules):
+    seen = []
+    lock = threading.Lock()
+
+    def handler(topic, payload):
+        time.sleep(0.001)
+        with lock:
+            seen.append((payload["request_id"], payload["stage"]))
+
+    pool = backend_modules.mqtt.InboundWorkerPool(handler, workers=3, maxsize=2)
+    pool.start()
+    stages = ["accepted", "in_progress", "succeeded"]
+    for stage in stages:
+        for batch in ("batch_a", "batch_b", "batch_c", "batch_d"):
+            pool.submit("igen/evt/dispense", {"request_id": f"{batch}_item_1", "stage": stage})
+    pool.stop()
+
+    assert len(seen) == 12
+    for batch in ("batch_a", "batch_b", "batch_c", "batch_d"):
+        assert [stage for rid, stage in seen if rid.startswith(batch)] == stages
+
+
+def test_stream_publishes_committed_transitions_and_replays_from_last_event_id(seeded_db, backend_modules, monkeypatch):
+    import asyncio
+
+    event_stream = importlib.import_module("app.event_stream")
+    stream = event_stream.stream
+    models = backend_modules.models
+    create_loan_request(
+        seeded_db, models, request_id="req_sse", batch_id="batch_sse", request_type="dispense",
+        user_id="user_1", tool_item_id="tool_1", slot_id="1",
+    )
+    monkeypatch.setattr(backend_modules.mqtt, "_publish", lambda *a, **k: None)
+
+    mqtt = backend_modules.mqtt
+    mqtt._handle_mqtt_message("igen/evt/dispense", {"request_id": "req_sse", "stage": "accepted"})
+    mqtt._handle_mqtt_message("igen/evt/machine/status", {"state": "idle"})
+
+    utils = importlib.import_module("app.utils")
+
+    def broken_handler(db, payload):
+        mqtt.handle_evt_dispense(db, payload)
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(utils.MQTT_REGISTRY, "igen/evt/dispense", broken_handler)
+    with pytest.raises(RuntimeError):
+        mqtt._handle_mqtt_message("igen/evt/dispense", {"request_id": "req_sse", "stage": "failed"})
+
+    events, complete = stream.since(0)
+    assert complete
+    assert [(e.event, e.data.get("hw_status")) for e in events] == [
+        ("loan_request", "pending"),
+        ("loan_request", "accepted"),
+        ("machine_status", None),
+    ]
+
+    async def read(last_event_id, n, **kw):
+        gen = event_stream.sse_events(last_event_id, keepalive_s=0.05, **kw)
+        frames = []
+        async for frame in gen:
+            if frame.startswith("id:"):
+                frames.append(frame)
+            if len(frames) == n:
+                break
+        await gen.aclose()
+        return frames
+
+    frames = asyncio.run(read(1, 2))
+    assert frames[0].startswith("id: 2\nevent: loan_request\n")
+    assert '"hw_status": "accepted"' in frames[0]
+    assert frames[1].startswith("id: 3\nevent: machine_status\n")
+
+    frames = asyncio.run(read(1, 1, batch_id="other_batch"))
+    assert frames[0].startswith("id: 3\nevent: machine_status\n")
+
+    frames = asyncio.run(read(999, 1))
+    assert "event: reset" in frames[0]
+
+    # Non-admin streams only carry the session user's own requests.
+    frames = asyncio.run(read(1, 1, user_id="user_2"))
+    assert frames[0].startswith("id: 3\nevent: machine_status\n")
+    frames = asyncio.run(read(1, 1, user_id="user_1"))
+    assert '"user_id": "user_1"' in frames[0]
+
+    from fastapi import Response
+
+    auth = importlib.import_module("app.auth")
+    stream_router = importlib.import_module("app.routers.stream")
+    auth.create_session(seeded_db, seeded_db.get(models.User, "user_1"), Response())
+    token = seeded_db.execute(select(models.AuthSession.session_token)).scalars().first()
+    user = stream_router.get_stream_user(session_token=token)
+    assert (user.user_id, auth.is_admin_user(user)) == ("user_1", False)
@@ -1,4 +1,5 @@
 
+import importlib
 import pytest
 
 from .helpers import create_open_loan, create_loan_request
@@ -54,6 +55,123 @@ def test_create_dispense_batch_respects_open_loan_and_inflight_reservation(seede
         )
 
 
+def test_create_dispense_batch_prefers_items_at_next_slot_and_uses_live_slot(seeded_db, backend_modules):
+    models = backend_modules.models
+    seeded_db.add(models.CakeState(cake_id="cake_1", current_slot=3))
+    seeded_db.add(models.CakeSlotState(cake_id="cake_1", slot_index=2, tool_item_id=None))
+    seeded_db.add(models.CakeSlotState(cake_id="cake_1", slot_index=4, tool_item_id="tool_2"))
+    seeded_db.commit()
+
+    backend_modules.user_flow.create_dispense_batch(
+        seeded_db,
+        user_id="user_1",
+        items=[{"tool_model_id": "tm_hex", "qty": 2}],
+        loan_period_hours=24,
+    )
+
+    rows = seeded_db.query(models.LoanRequest).order_by(models.LoanRequest.request_id).all()
+    assert [(r.tool_item_id, r.slot_id) for r in rows] == [("tool_2", "4"), ("tool_1", "1")]
+    assert seeded_db.get(models.CakeSlotState, {"cake_id": "cake_1", "slot_index": 1}).tool_item_id == "tool_1"
+
+
+def test_dispense_planner_picks_items_by_estimated_motion_time(seeded_db, backend_modules):
+    models = backend_modules.models
+    user_flow = backend_modules.user_flow
+    planner = importlib.import_module("app.usecases.dispense_planner")
+    seeded_db.add(models.ToolItem(
+        tool_item_id="tool_4", tool_model_id="tm_hex", tool_tag_id="TAG-4",
+        cake_id="cake_2", slot_id="5", condition_status="ok", is_active=True,
+    ))
+    seeded_db.add(models.CakeState(cake_id="cake_1", current_slot=4))
+    seeded_db.add(models.CakeState(cake_id="cake_2", current_slot=0))
+    seeded_db.commit()
+    items = [{"tool_model_id": "tm_hex", "qty": 1}]
+
+    # Legacy falls back to the lowest cake number: 3 CCW slots on cake 1.
+    legacy, legacy_s = user_flow.plan_dispense(seeded_db, items, strategy="legacy")
+    motion, motion_s = user_flow.plan_dispense(seeded_db, items, strategy="motion")
+
+    assert [(ti.tool_item_id, slot) for ti, slot in legacy] == [("tool_1", 1)]
+    assert [(ti.tool_item_id, slot) for ti, slot in motion] == [("tool_4", 5)]
+    assert legacy_s == pytest.approx(planner.DEFAULT_MOTION.cycle_s(1, 4, 1))
+    assert motion_s == pytest.approx(planner.DEFAULT_MOTION.cycle_s(2, 0, 5))
+    assert motion_s < legacy_s
+
+    # Later picks on the same cake are costed from the slot the previous pick left it at.
+    plan = planner.plan_batch(
+        ["m", "m"],
+        [planner.Candidate("a", "m", 1, 2), planner.Candidate("b", "m", 1, 3), planner.Candidate("c", "m", 1, 5)],
+        {1: 1},
+    )
+    assert [c.tool_item_id for c in plan.picks] == ["a", "b"]
+    assert plan.cake_slots == {1: 3}
+    assert planner.plan_batch(["m", "m"], [planner.Candidate("a", "m", 1, 2)], {1: 1}) is None
+
+    out = user_flow.create_dispense_batch(seeded_db, user_id="user_1", items=items, loan_period_hours=24)
+    assert out["estimated_motion_s"] == round(motion_s, 2)
+    assert seeded_db.get(models.LoanRequest, out["request_ids"][0]).tool_item_id == "tool_4"
+
+
+
+def test_plan_batch_sequence_beats_dispensing_in_request_order(backend_modules):
+    planner = importlib.import_module("app.usecases.dispense_planner")
+    y1, y2, x3 = planner.Candidate("y1", "y", 1, 1), planner.Candidate("y2", "y", 1, 2), planner.Candidate("x3", "x", 1, 3)
+
+    plan = planner.plan_batch(["y", "x", "y"], [y1, y2, x3], {1: 0})
+    in_request_order = planner.estimate_duration([y1, x3, y2], {1: 0})
+
+    # 0 -> 1 -> 2 -> 3 instead of 0 -> 1 -> 3 -> 2; gantry legs are the same either way.
+    assert plan.picks == [y1, y2, x3]
+    assert plan.estimated_s < in_request_order.estimated_s
+    assert planner.order_picks(plan.picks, {1: 0}).estimated_s == pytest.approx(plan.estimated_s)
+
+
+def test_motion_model_hides_rotation_under_gantry_travel_when_overlapped(backend_modules):
+    planner = importlib.import_module("app.usecases.dispense_planner")
+    sequential = planner.MotionModel(overlap_rotation=False)
+    overlapped = planner.MotionModel(overlap_rotation=True)
+
+    assert overlapped.cycle_s(1, 0, 0) == sequential.cycle_s(1, 0, 0)
+    assert overlapped.cycle_s(1, 0, 3) == sequential.cycle_s(1, 0, 0)
+    long_rotation = planner.MotionModel(overlap_rotation=True, cake_speed=500.0)
+    assert long_rotation.cycle_s(6, 0, 3) > long_rotation.cycle_s(6, 0, 0)
+
+def test_batch_requests_run_in_persisted_sequence_order(seeded_db, backend_modules, monkeypatch):
+    models = backend_modules.models
+    mqtt_mod = backend_modules.mqtt
+    published = []
+    monkeypatch.setattr(mqtt_mod, "_publish", lambda topic, payload, qos=1, on_ack=None: published.append(payload["request_id"]))
+    seeded_db.add(models.CakeState(cake_id="cake_1", current_slot=0))
+    seeded_db.add(models.CakeState(cake_id="cake_2", current_slot=0))
+    seeded_db.commit()
+
+    out = backend_modules.user_flow.create_dispense_batch(
+        seeded_db,
+        user_id="user_1",
+        items=[{"tool_model_id": "tm_hex", "qty": 2}, {"tool_model_id": "tm_pliers", "qty": 1}],
+        loan_period_hours=24,
+    )
+    batch_id = out["batch_id"]
+    item_1, item_2, item_3 = out["request_ids"]
+
+    # Requests are created in the planner's order and keep it: cake 1 slot 1 then
+    # slot 2 is one step each, then cake 2.
+    status = backend_modules.user_flow.get_batch_status(seeded_db, batch_id)
+    assert [(r["request_id"], r["sequence"]) for r in status] == [(item_1, 1), (item_2, 2), (item_3, 3)]
+    assert [seeded_db.get(models.LoanRequest, rid).tool_item_id for rid in (item_1, item_2, item_3)] == ["tool_1", "tool_2", "tool_3"]
+
+    user_router = importlib.import_module("app.routers.user")
+
+    class _Bus:
+        def publish(self, topic, payload, qos=1):
+            published.append(payload["request_id"])
+
+    user_router._publish_first_request_for_batch(seeded_db, _Bus(), batch_id)
+    mqtt_mod.handle_evt_dispense(seeded_db, {"request_id": item_1, "stage": "succeeded", "final_current_slot": 1})
+    seeded_db.commit()
+    assert published == [item_1, item_2]
+
+
 def test_create_return_batch_requires_open_loan(seeded_db, backend_modules):
     with pytest.raises(ValueError, match="invalid_loan"):
         backend_modules.user_flow.create_return_batch(
@@ -88,3 +206,44 @@ def test_list_active_loans_returns_joined_metadata(seeded_db, backend_modules):
     assert rows[0]["tool_name"] == "Pliers"
     assert rows[0]["tool_category"] == "Hand Tools"
     assert rows[0]["tool_tag_id"] == "TAG-3"
+
+
+def test_cake_state_engine_writes_through_and_discards_rollback(seeded_db, backend_modules):
+    models = backend_modules.models
+    user_flow = backend_modules.user_flow
+    engine = importlib.import_module("app.cake_state").cake_state
+
+    user_flow.set_cake_current_slot(seeded_db, "cake_1", 2)
+    assert user_flow.get_cake_current_slot(seeded_db, "cake_1") == 2
+    assert engine.current_slot(None, "cake_1") is None
+    seeded_db.commit()
+
+    assert engine.current_slot(None, "cake_1") == 2
+    assert seeded_db.get(models.CakeState, "cake_1").current_slot == 2
+
+    user_flow.set_cake_current_slot(seeded_db, "cake_1", 4)
+    seeded_db.rollback()
+    assert engine.current_slot(seeded_db, "cake_1") == 2
+
+    seeded_db.add(models.CakeSlotState(cake_id="cake_1", slot_index=3, tool_item_id="tool_2"))
+    seeded_db.commit()
+    assert engine.tool_slots(None, "tool_2") == [("cake_1", 3)]
+    assert [c["cake_id"] for c in user_flow.get_cake_overview(seeded_db)] == ["cake_1"]
+
+
+def test_cake_state_engine_merges_concurrent_sessions_per_field(seeded_db, backend_modules):
+    engine = importlib.import_module("app.cake_state").cake_state
+    SessionLocal = backend_modules.db.SessionLocal
+
+    with SessionLocal() as worker, SessionLocal() as admin:
+        # Both sessions stage cake_1 before either commits.
+        engine.set_current_slot(worker, "cake_1", 3)
+        engine.set_slot(admin, "cake_1", 4, "tool_3")
+        worker.commit()
+        admin.commit()
+
+    assert engine.current_slot(None, "cake_1") == 3
+    assert engine.tool_slots(None, "tool_3") == [("cake_1", 4)]
+    engine.load()
+    assert engine.current_slot(None, "cake_1") == 3
+    assert engine.tool_slots(None, "tool_3") == [("cake_1", 4)]
@@ -1,5 +1,6 @@
+import importlib
 
-from .helpers import create_open_loan
+from .helpers import create_loan_request, create_open_loan
 
 
 def test_dispense_route_creates_batch_and_publishes_commands(client, seeded_db, backend_modules):
@@ -65,3 +66,109 @@ def test_catalog_route_returns_availability_counts(client, seeded_db, backend_mo
     assert rows["tm_hex"]["total"] == 2
     assert rows["tm_hex"]["available"] == 1
     assert rows["tm_hex"]["checked_out"] == 1
+
+
+def test_availability_table_tracks_reservations_returns_and_deactivation(client, seeded_db, backend_modules):
+    from app.availability import availability
+
+    models = backend_modules.models
+
+    def counts():
+        return {row["tool_model_id"]: row for row in client.get("/api/catalog").json()}["tm_hex"]
+
+    req = create_loan_request(
+        seeded_db, models, request_id="req_a", batch_id="batch_a", request_type="dispense",
+        user_id="user_1", tool_item_id="tool_1", slot_id="1",
+    )
+    assert (counts()["available"], counts()["reserved"]) == (1, 1)
+
+    req.hw_status = "dispensed_ok"
+    loan = create_open_loan(seeded_db, models, loan_id="loan_a", user_id="user_1", tool_item_id="tool_1")
+    assert (counts()["available"], counts()["checked_out"], counts()["reserved"]) == (1, 1, 0)
+
+    loan.returned_at = models.utcnow()
+    loan.status = "returned"
+    seeded_db.get(models.ToolItem, "tool_2").is_active = False
+    seeded_db.commit()
+    assert (counts()["total"], counts()["available"], counts()["checked_out"]) == (1, 1, 0)
+
+    seeded_db.get(models.ToolItem, "tool_1").is_active = False
+    seeded_db.rollback()
+    assert counts()["total"] == 1
+
+    assert availability.check()["ok"] is True
+    seeded_db.query(models.ToolModelAvailability).delete()
+    seeded_db.commit()
+    assert availability.check()["ok"] is False
+    assert availability.check(repair=True)["repaired"] is True
+    assert availability.check()["ok"] is True
+    assert counts()["available"] == 1
+
+
+def test_rfid_consume_keeps_every_scan_and_long_polls(client, backend_modules):
+    import threading
+    import time
+
+    rfid = importlib.import_module("app.routers.rfid")
+    rfid._rfid_set("kiosk", "tool", {"tag_id": "TAG-1"})
+    rfid._rfid_set("kiosk", "tool", {"tag_id": "TAG-2"})
+    rfid._rfid_set("kiosk", "card", {"uid": "CARD-1"})
+
+    body = client.get("/api/rfid/consume", params={"reader_id": "kiosk", "kind": "tool", "since": 0}).json()
+    assert [s["scan"]["tag_id"] for s in body["scans"]] == ["TAG-1", "TAG-2"]
+    assert body["gap"] is False
+    since = body["next_since"]
+
+    # Legacy cursor-less consume still pops the newest scan once.
+    assert client.get("/api/rfid/consume", params={"reader_id": "kiosk", "kind": "card"}).json()["scan"] == {"uid": "CARD-1"}
+    assert client.get("/api/rfid/consume", params={"reader_id": "kiosk", "kind": "card"}).json()["ok"] is False
+
+    timer = threading.Timer(0.1, rfid._rfid_set, args=("kiosk", "tool", {"tag_id": "TAG-3"}))
+    timer.start()
+    started = time.monotonic()
+    body = client.get(
+        "/api/rfid/consume", params={"reader_id": "kiosk", "kind": "tool", "since": since, "wait_ms": 5000}
+    ).json()
+    timer.join()
+    assert time.monotonic() - started < 4
+    assert [s["scan"]["tag_id"] for s in body["scans"]] == ["TAG-3"]
+
+    body = client.get(
+        "/api/rfid/consume", params={"reader_id": "kiosk", "kind": "tool", "since": body["next_since"], "wait_ms": 50}
+    ).json()
+    assert body["ok"] is False and body["scans"] == []
+
+
+def test_session_validation_is_cached_and_extensions_are_flushed_in_batches(client, seeded_db, backend_modules):
+    from sqlalchemy import event
+
+    auth = importlib.import_module("app.auth")
+    models = backend_modules.models
+
+    resp = client.post("/api/auth/session/card", json={"card_id": "CARD-1"})
+    assert resp.status_code == 200, resp.text
+    sess = seeded_db.query(models.AuthSession).one()
+    issued_expiry = sess.expires_at
+
+    statements = []
+
+    def record(conn, cursor, statement, params, context, executemany):
+        statements.append(statement.split()[0].upper())
+
+    event.listen(backend_modules.db.engine, "before_cursor_execute", record)
+    try:
+        for _ in range(5):
+            assert client.get("/api/auth/session/me").json()["user_id"] == "user_1"
+    finally:
+        event.remove(backend_modules.db.engine, "before_cursor_execute", record)
+
+    # One cold lookup, then cache hits; nothing written on the request path.
+    assert statements.count("SELECT") <= 2
+    assert not {"UPDATE", "INSERT", "DELETE"} & set(statements)
+
+    assert auth.session_cache.flush() == 1
+    seeded_db.expire_all()
+    assert seeded_db.get(models.AuthSession, sess.session_id).expires_at > issued_expiry
+
+    client.post("/api/auth/session/logout")
+    assert client.get("/api/auth/session/me").status_code == 401
@@ -170,6 +170,7 @@ export type ReadEepromResp = {
   request_id?: string;
   error_code?: string | null;
   error_reason?: string | null;
+  detail?: string;
   headers?: Record<string, string>;
 };
 
@@ -181,6 +182,7 @@ export type ReadAngleResp = {
   request_id?: string;
   error_code?: string | null;
   error_reason?: string | null;
+  detail?: string;
 };
 
 export type CakeReadStartResp = { ok: boolean; request_id: string; cake_id: number };
@@ -355,11 +357,15 @@ export const apiAdmin = {
     http<CakeReadStartResp>(`/api/admin/cakes/${cakeId}/read-eeprom`, { method: "POST" }),
   readCakeEeprom: (cakeId: number) =>
     http<ReadEepromResp>(`/api/admin/cakes/${cakeId}/eeprom`),
+  readCakeEepromNow: (cakeId: number) =>
+    http<ReadEepromResp>(`/api/admin/cakes/${cakeId}/read-eeprom?wait=true`, { method: "POST" }),
 
   queueCakeReadAngle: (cakeId: number) =>
     http<CakeReadStartResp>(`/api/admin/cakes/${cakeId}/read-angle`, { method: "POST" }),
   readCakeAngle: (cakeId: number) =>
     http<ReadAngleResp>(`/api/admin/cakes/${cakeId}/angle`),
+  readCakeAngleNow: (cakeId: number) =>
+    http<ReadAngleResp>(`/api/admin/cakes/${cakeId}/read-angle?wait=true`, { method: "POST" }),
 
   cakeSetHome: (cakeId: number) => http<CakeHomeStartResp>(`/api/admin/cakes/${cakeId}/home`, { method: "POST" }),
   cakeSetHomeStatus: (requestId: string) => http<CakeHomeStatusResp>(`/api/admin/cakes/home/${requestId}/status`),
@@ -15,8 +15,6 @@ function prettyJson(v: any) {
   }
 }
 
-const sleep = (ms: number) => new Promise((r) => window.setTimeout(r, ms));
-
 export default function Cakes() {
   const [cakes, setCakes] = useState<CakeOverview[]>([]);
   const [err, setErr] = useState<string | null>(null);
@@ -62,20 +60,7 @@ export default function Cakes() {
       setBusyCake(cakeId);
       setEepromModal({ cakeId, resp: null });
 
-      await apiAdmin.queueCakeReadEeprom(cakeId);
-
-      let last: ReadEepromResp | null = null;
-      for (let i = 0; i < 6; i++) {
-        await sleep(i === 0 ? 250 : 500);
-        const resp = await apiAdmin.readCakeEeprom(cakeId);
-        last = resp;
-        if (resp?.eeprom) {
-          setEepromModal({ cakeId, resp });
-          return;
-        }
-      }
-
-      setEepromModal({ cakeId, resp: last });
+      setEepromModal({ cakeId, resp: await apiAdmin.readCakeEepromNow(cakeId) });
     } catch (e: any) {
       setErr(e?.message || "Read EEPROM failed");
     } finally {
@@ -89,20 +74,7 @@ export default function Cakes() {
       setAngleBusyCake(cakeId);
       setAngleModal({ cakeId, resp: null });
 
-      await apiAdmin.queueCakeReadAngle(cakeId);
-
-      let last: ReadAngleResp | null = null;
-      for (let i = 0; i < 6; i++) {
-        await sleep(i === 0 ? 250 : 500);
-        const resp = await apiAdmin.readCakeAngle(cakeId);
-        last = resp;
-        if (resp?.reading) {
-          setAngleModal({ cakeId, resp });
-          return;
-        }
-      }
-
-      setAngleModal({ cakeId, resp: last });
+      setAngleModal({ cakeId, resp: await apiAdmin.readCakeAngleNow(cakeId) });
     } catch (e: any) {
       setErr(e?.message || "Read angle failed");
     } finally {